@@ -1,34 +1,88 @@
-import os
+import logging
 
-from flask import Flask, g, jsonify, render_template, send_from_directory
+from flask import Flask
 
+import assets
+import cache
+import compression
 import config
-import models
+import limits
+import metrics
+import storage
+import writes
 from resources.todos import todos_api
 
 
+# Admission control
+# -----------------
+# Rate limits and load shedding (see limits.py) apply to the API, and are
+# registered ahead of the connection hooks, so that a request that is
+# turned away never takes a connection.
+todos_api.before_request(limits.before_request)
+todos_api.after_request(limits.after_request)
+todos_api.teardown_request(limits.teardown_request)
+
+
+# Connection management
+# ---------------------
+# Rather than relying on peewee's autoconnect, each API request explicitly
+# takes a connection and gives it back when the request is torn down
+# (for the pooled backend, closing returns the connection to the pool).
+# Streamed responses keep the request context, and so the connection,
+# until the stream is exhausted. A sharded database connects to each shard
+# as a request first uses it, and all of them are closed at teardown.
+#
+# These are registered on the blueprint (and before the blueprint is
+# registered on the app) so that the page and static routes, which never
+# touch the database, don't pay for a connection.
+@todos_api.before_request
+def connect_database():
+    storage.REPOSITORY.connect()
+
+
+@todos_api.teardown_request
+def close_database(exception):
+    storage.REPOSITORY.release()
+
+
 app = Flask(__name__)
 app.register_blueprint(todos_api, url_prefix=config.API_URL_PREFIX)
+metrics.init_app(app)
+# static files are fingerprinted, precompressed and served from memory
+assets.init_app(app)
+# API responses are compressed on the fly
+compression.init_app(app)
+
+
+@app.template_global()
+def change_feed_enabled():
+    """Whether the page should connect to the change feed (see
+    `config.CHANGES_ENABLED`)
+    """
+    return config.CHANGES_ENABLED
 
 
 @app.route('/')
 def my_todos():
-    return render_template('index.html')
+    # (rendered once, see assets.send_template)
+    return assets.send_template('index.html')
 
 
 @app.route('/favicon.ico')
 def favicon():
     """This is to get rid of the annoying 404 for the favicon"""
-    return send_from_directory(
-        os.path.join(app.root_path, 'static'),
-        'favicon.ico',
-        mimetype='image/vnd.microsoft.icon'  # this mimetype per flask docs
-    )
+    return assets.send_static('favicon.ico')
 
 
 # ----------------
 
 if __name__ == '__main__':
 
-    models.initialize()
+    # so that the effective SQLite pragmas get reported at startup
+    logging.basicConfig(level=logging.INFO)
+
+    storage.initialize()
+    cache.initialize()
+    writes.initialize()
+    limits.initialize()
     app.run(debug=config.DEBUG, host=config.HOST, port=config.PORT)
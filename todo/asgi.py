@@ -0,0 +1,348 @@
+"""ASGI entry point for the todo app.
+
+    python3 asgi.py                 # the built-in server (see `serve()`)
+    uvicorn asgi:application        # or any other ASGI server
+
+`application` serves exactly the routes (and so the `/api/v1/todos`
+contract) of the Flask app in `app.py`. Connections are handled on an
+asyncio event loop: the request body is read there, and only then is the
+request handed to a bounded pool of `config.ASGI_THREADS` threads, which
+run the Flask view and its (synchronous) peewee queries. Idle, keep-alive
+and slow-sending clients therefore cost a coroutine rather than a thread.
+
+A request runs start to finish on one pool thread (peewee connections and
+Flask's request context are per thread), streaming its response back to
+the event loop a chunk at a time.
+"""
+import asyncio
+import concurrent.futures
+import io
+import logging
+import sys
+import urllib.parse
+from http import HTTPStatus
+
+import app
+import cache
+import config
+import limits
+import models
+import storage
+import writes
+
+
+logger = logging.getLogger(__name__)
+
+
+# The pool the requests run on (see `executor()`)
+EXECUTOR = None
+
+
+# Helper Functions
+# ----------------
+def executor():
+    """The request thread pool, created on first use"""
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.ASGI_THREADS, thread_name_prefix='asgi'
+        )
+    return EXECUTOR
+
+
+def shutdown_executor():
+    """Wait for the requests in flight, then stop the pool"""
+    global EXECUTOR
+    if EXECUTOR is not None:
+        EXECUTOR.shutdown(wait=True)
+        EXECUTOR = None
+
+
+def build_environ(scope, body):
+    """The WSGI environ for an ASGI http `scope` and its request `body`"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI strings are the raw bytes decoded as latin-1
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue  # we know the length of the body we read
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        # repeated headers are folded into one, as a WSGI server would
+        environ[name] = (environ[name] + ',' + value if name in environ
+                         else value)
+    return environ
+
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(body)
+
+
+def run_request(environ, send):
+    """Run one request through the Flask app, on a pool thread, handing
+    each message for the client to `send` (which blocks until the event
+    loop has sent it)
+    """
+    started = []
+    headers_sent = False
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and headers_sent:
+            raise exc_info[1].with_traceback(exc_info[2])
+        code, _, _ = status.partition(' ')
+        started[:] = [int(code), [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]]
+
+    def send_body(body, more_body):
+        nonlocal headers_sent
+        if not headers_sent:
+            send({'type': 'http.response.start', 'status': started[0],
+                  'headers': started[1]})
+            headers_sent = True
+        send({'type': 'http.response.body', 'body': body,
+              'more_body': more_body})
+
+    result = app.app(environ, start_response)
+    try:
+        for chunk in result:
+            if chunk:
+                send_body(chunk, True)
+        send_body(b'', False)
+    finally:
+        # this is what tears the request down (and so gives back its
+        # database connection), so it must run on this same thread
+        if hasattr(result, 'close'):
+            result.close()
+
+
+# The Application
+# ---------------
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        raise ValueError('Unsupported ASGI scope: {!r}'.format(scope['type']))
+
+    body = await read_body(receive)
+    if body is None:
+        return  # the client went away before sending the whole request
+
+    loop = asyncio.get_running_loop()
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    await loop.run_in_executor(executor(), run_request,
+                               build_environ(scope, body), send_from_thread)
+
+
+async def lifespan(receive, send):
+    """Server startup and shutdown: startup initialises the database, the
+    cache and the write queue (as `app.py` does before serving), shutdown
+    lets the requests in flight finish, then the queued writes, and closes
+    the database.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                storage.initialize()
+                cache.initialize()
+                writes.initialize()
+                limits.initialize()
+            except Exception as exc:
+                await send({'type': 'lifespan.startup.failed',
+                            'message': str(exc)})
+                raise
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.get_running_loop().run_in_executor(
+                None, shutdown_executor)
+            writes.stop()
+            models.close_database()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# The Built-in Server
+# -------------------
+# A small HTTP/1.1 server for running `application` without installing an
+# ASGI server: keep-alive, Content-Length request bodies and chunked
+# streamed responses. Use uvicorn (or similar) if you need TLS, HTTP/2 or
+# chunked request bodies.
+class _Response:
+    """Writes one response's ASGI messages to the connection"""
+
+    def __init__(self, writer, keep_alive):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.started = False
+        self.chunked = False
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            headers = list(message.get('headers', ()))
+            names = {name.lower() for name, _ in headers}
+            if b'content-length' not in names:
+                if self.keep_alive:
+                    self.chunked = True
+                    headers.append((b'transfer-encoding', b'chunked'))
+            if not self.keep_alive:
+                headers.append((b'connection', b'close'))
+            lines = ['HTTP/1.1 {} {}'.format(
+                message['status'], _reason(message['status'])).encode()]
+            lines.extend(name + b': ' + value for name, value in headers)
+            self.writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+            self.started = True
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            if self.chunked and body:
+                body = b'%x\r\n%s\r\n' % (len(body), body)
+            if self.chunked and not message.get('more_body', False):
+                body += b'0\r\n\r\n'
+            self.writer.write(body)
+        await self.writer.drain()
+
+
+def _reason(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ''
+
+
+async def _read_request(reader):
+    """(method, target, version, headers, body), or None at end of stream"""
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, target, version = request_line.decode('latin-1').split()
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        headers.append((name.strip().lower(), value.strip()))
+    length = int(dict(headers).get(b'content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return method, target, version, headers, body
+
+
+async def _serve_connection(app_, reader, writer):
+    server = writer.get_extra_info('sockname')[:2]
+    client = writer.get_extra_info('peername')[:2]
+    try:
+        while True:
+            request = await _read_request(reader)
+            if request is None:
+                break
+            method, target, version, headers, body = request
+            connection = dict(headers).get(b'connection', b'').lower()
+            keep_alive = (connection != b'close' if version == 'HTTP/1.1'
+                          else connection == b'keep-alive')
+            path, _, query = target.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': version.split('/')[1], 'method': method,
+                # (the spec's path is percent-decoded; raw_path isn't)
+                'scheme': 'http', 'path': urllib.parse.unquote(path),
+                'root_path': '', 'raw_path': path.encode('latin-1'),
+                'query_string': query.encode('latin-1'),
+                'headers': headers, 'server': server, 'client': client,
+            }
+            messages = [{'type': 'http.request', 'body': body,
+                         'more_body': False}]
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                return {'type': 'http.disconnect'}
+
+            response = _Response(writer, keep_alive)
+            try:
+                await app_(scope, receive, response.send)
+            except Exception:
+                logger.exception('Error handling %s %s', method, target)
+                if response.started:
+                    break  # nothing sensible left to send
+                await response.send({'type': 'http.response.start',
+                                     'status': 500,
+                                     'headers': [(b'content-length', b'0')]})
+                await response.send({'type': 'http.response.body'})
+            if not keep_alive:
+                break
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+        pass  # a client that went away, or one not speaking HTTP
+    finally:
+        writer.close()
+
+
+async def serve(app_=application, host=config.HOST, port=config.PORT,
+                ready=None):
+    """Serve `app_` until cancelled. `ready`, if given, is an
+    `asyncio.Future` set to the bound (host, port) once listening.
+    """
+    startup, replies = asyncio.Queue(), asyncio.Queue()
+    lifespan_task = asyncio.ensure_future(
+        app_({'type': 'lifespan'}, startup.get, replies.put))
+    await startup.put({'type': 'lifespan.startup'})
+    reply = await replies.get()
+    if reply['type'] != 'lifespan.startup.complete':
+        raise RuntimeError(reply.get('message', 'startup failed'))
+
+    server = await asyncio.start_server(
+        lambda r, w: _serve_connection(app_, r, w), host, port)
+    logger.info('Serving on %s:%s', host, port)
+    if ready is not None:
+        ready.set_result(server.sockets[0].getsockname()[:2])
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await startup.put({'type': 'lifespan.shutdown'})
+        await replies.get()
+        await lifespan_task
+
+
+# ----------------
+
+if __name__ == '__main__':
+
+    # so that the effective SQLite pragmas get reported at startup
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
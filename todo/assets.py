@@ -0,0 +1,161 @@
+import collections
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, abort, current_app, render_template, request
+
+import compression
+import config
+
+
+# A file ready to send: its content `fingerprint` (a digest, also used as
+# its ETag), and `variants` mapping each content coding we have for it
+# (None for the plain bytes) to the body
+Asset = collections.namedtuple(
+    'Asset', ['mimetype', 'fingerprint', 'variants', 'mtime']
+)
+
+# The content codings assets are precompressed with, best first
+ASSET_ENCODINGS = tuple(e for e in compression.ENCODINGS if e != 'deflate')
+
+# Compressing these is worth it (images other than SVG already are)
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'image/svg+xml', 'image/vnd.microsoft.icon',
+                      'image/x-icon')
+
+# The static files (see `init_app()`), and the templates rendered so far
+STORE = None
+RENDERED = {}
+
+
+# Helper Functions
+# ----------------
+def make_asset(data, mimetype, mtime=None):
+    """Fingerprint and precompress `data` (bytes)"""
+    variants = {None: data}
+    if (mimetype.startswith(COMPRESSIBLE_TYPES)
+            and len(data) >= config.COMPRESS_MIN_BYTES):
+        for encoding in ASSET_ENCODINGS:
+            compressed = compression.compress(data, encoding)
+            # (tiny files can come out bigger)
+            if len(compressed) < len(data):
+                variants[encoding] = compressed
+    fingerprint = hashlib.sha256(data).hexdigest()[:16]
+    return Asset(mimetype, fingerprint, variants, mtime)
+
+
+def load_asset(path):
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return make_asset(data, mimetype, os.path.getmtime(path))
+
+
+class AssetStore:
+    """Every file under `root`, read, fingerprinted and precompressed once
+    (by `build()`), and served from memory from then on.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._assets = {}
+
+    def build(self):
+        assets = {}
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                assets[name] = load_asset(path)
+        self._assets = assets
+
+    def get(self, name, reload=False):
+        """The asset for `name` (a path relative to the root, with forward
+        slashes), or None. With `reload` (for debug mode), files changed
+        since they were loaded are loaded again.
+        """
+        if reload:
+            path = os.path.join(self.root, *name.split('/'))
+            # (the same path checks as flask.send_from_directory)
+            if '..' in name.split('/') or not os.path.isfile(path):
+                self._assets.pop(name, None)
+                return None
+            asset = self._assets.get(name)
+            if asset is None or asset.mtime != os.path.getmtime(path):
+                self._assets[name] = asset = load_asset(path)
+            return asset
+        return self._assets.get(name)
+
+
+def send_asset(asset, immutable=False):
+    """A response with the best variant of `asset` the client accepts.
+    Fingerprinted URLs never change content, so can be cached forever
+    (`immutable`); anything else is revalidated with its ETag.
+    """
+    available = [e for e in ASSET_ENCODINGS if e in asset.variants]
+    encoding = compression.best_encoding(request.accept_encodings, available)
+
+    response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # each encoding is a different representation, with its own tag
+    response.set_etag(asset.fingerprint + ('-' + encoding if encoding
+                                           else ''))
+    if immutable:
+        response.headers['Cache-Control'] = (
+            'public, max-age={}, immutable'.format(config.STATIC_MAX_AGE))
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def send_static(filename):
+    asset = STORE.get(filename, reload=current_app.debug)
+    if asset is None:
+        abort(404)
+    return send_asset(asset)
+
+
+def static_view(filename):
+    """Replaces Flask's own `static` view"""
+    asset = STORE.get(filename, reload=current_app.debug)
+    if asset is None:
+        abort(404)
+    immutable = request.args.get('v') == asset.fingerprint
+    return send_asset(asset, immutable=immutable)
+
+
+def asset_url(filename):
+    """The fingerprinted URL of a static file, for templates:
+    `{{ asset_url('styles/main.css') }}`
+    """
+    asset = STORE.get(filename, reload=current_app.debug)
+    if asset is None:
+        raise ValueError('No static file {!r}'.format(filename))
+    return '{}/{}?v={}'.format(current_app.static_url_path, filename,
+                               asset.fingerprint)
+
+
+def send_template(name):
+    """A template (with no per-request content), rendered once and then
+    served from memory (re-rendered every time in debug mode)
+    """
+    asset = RENDERED.get(name)
+    if asset is None or current_app.debug:
+        html = render_template(name).encode('utf-8')
+        RENDERED[name] = asset = make_asset(html, 'text/html')
+    return send_asset(asset)
+
+
+def init_app(app):
+    """Load the app's static files, serve them (and `/static/...`) from
+    memory, and make `asset_url()` available to templates
+    """
+    global STORE
+    STORE = AssetStore(app.static_folder)
+    STORE.build()
+    RENDERED.clear()
+    app.view_functions['static'] = static_view
+    app.add_template_global(asset_url)
@@ -0,0 +1,7 @@
+"""Performance benchmarks for the todo API.
+
+These are not part of the unit test suite. Run them from the `todo`
+directory, e.g.:
+
+    python3 -m benchmarks.bench_batch
+"""
@@ -0,0 +1,55 @@
+"""Compares the threaded WSGI server with the ASGI mode (`asgi.py`) while
+holding increasing numbers of idle client connections open: requests/sec
+for 16 busy clients, and the number of threads the server is running.
+
+    python3 -m benchmarks.bench_asgi [seconds per run]
+"""
+import socket
+import sys
+import threading
+
+import app
+import asgi
+from benchmarks.common import (hammer, live_asgi_server, live_server, seed,
+                               temp_database)
+
+
+IDLE_CONNECTIONS = (0, 100, 1000)
+BUSY_CLIENTS = 16
+
+
+def open_idle(base_url, count):
+    """`count` connected sockets that never send a request"""
+    host, port = base_url.rsplit('/', 1)[1].split(':')
+    return [socket.create_connection((host, int(port)))
+            for _ in range(count)]
+
+
+def run(duration):
+    servers = [
+        ('wsgi', lambda: live_server(app.app)),
+        ('asgi', lambda: live_asgi_server(asgi.application)),
+    ]
+    print('{:<6} {:>6} {:>10} {:>8} {:>8}'.format(
+        'mode', 'idle', 'req/s', 'threads', 'errors'))
+    for mode, server in servers:
+        for idle in IDLE_CONNECTIONS:
+            with temp_database():
+                seed(1000)
+                with server() as base_url:
+                    sockets = open_idle(base_url, idle)
+                    try:
+                        count, elapsed, errors = hammer(
+                            base_url + '/api/v1/todos?limit=50',
+                            BUSY_CLIENTS, duration)
+                        # minus the benchmark's own main thread
+                        threads = threading.active_count() - 1
+                    finally:
+                        for sock in sockets:
+                            sock.close()
+                print('{:<6} {:>6} {:>10.0f} {:>8} {:>8}'.format(
+                    mode, idle, count / elapsed, threads, errors))
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 3)
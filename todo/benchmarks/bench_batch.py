@@ -0,0 +1,71 @@
+"""Compares the single-item write endpoints with `POST /api/v1/todos/batch`.
+
+    python3 -m benchmarks.bench_batch [number of todos]
+"""
+import json
+import sys
+
+import app
+import models
+from benchmarks.common import report, temp_database, timer
+
+
+def run(count):
+    client = app.app.test_client()
+    timings = {}
+
+    with temp_database():
+        with timer(timings, 'single'):
+            for i in range(count):
+                client.post(
+                    '/api/v1/todos',
+                    data=json.dumps({'name': 'todo {}'.format(i)}),
+                    content_type='application/json'
+                )
+            for todo_id in range(1, count + 1):
+                client.put(
+                    '/api/v1/todos/{}'.format(todo_id),
+                    data=json.dumps({'name': 'done', 'completed': True}),
+                    content_type='application/json'
+                )
+            for todo_id in range(1, count + 1):
+                client.delete('/api/v1/todos/{}'.format(todo_id))
+
+    with temp_database():
+        with timer(timings, 'batch'):
+            created = client.post(
+                '/api/v1/todos/batch',
+                data=json.dumps([
+                    {'op': 'create', 'name': 'todo {}'.format(i)}
+                    for i in range(count)
+                ]),
+                content_type='application/json'
+            ).get_json()['results']
+            ids = [result['todo']['id'] for result in created]
+            client.post(
+                '/api/v1/todos/batch',
+                data=json.dumps([
+                    {'op': 'update', 'id': todo_id, 'name': 'done',
+                     'completed': True}
+                    for todo_id in ids
+                ]),
+                content_type='application/json'
+            )
+            client.post(
+                '/api/v1/todos/batch',
+                data=json.dumps([
+                    {'op': 'delete', 'id': todo_id} for todo_id in ids
+                ]),
+                content_type='application/json'
+            )
+        assert models.Todo.select().count() == 0
+
+    title = '{0} creates + {0} updates + {0} deletes'.format(count)
+    report(title, [
+        ('single-item endpoints', count * 3, timings['single']),
+        ('batch endpoint', count * 3, timings['batch']),
+    ])
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,37 @@
+"""Sizes and times the full collection with each JSON encoder, sent plain
+and compressed.
+
+    python3 -m benchmarks.bench_compression [number of todos]
+"""
+import sys
+import time
+
+import app
+import config
+from benchmarks.common import seed, temp_database
+
+
+def run(count):
+    client = app.app.test_client()
+    with temp_database():
+        seed(count)
+
+        print('{} todos'.format(count))
+        print('{:<8} {:<10} {:>12} {:>10}'.format(
+            'encoder', 'encoding', 'bytes', 'ms'))
+        for fast_json in (False, True):
+            config.FAST_JSON = fast_json
+            for encoding in ('identity', 'gzip', 'deflate'):
+                start = time.perf_counter()
+                body = client.get(
+                    '/api/v1/todos',
+                    headers={'Accept-Encoding': encoding}).get_data()
+                elapsed = time.perf_counter() - start
+                print('{:<8} {:<10} {:>12} {:>10.1f}'.format(
+                    'orjson' if fast_json else 'json', encoding, len(body),
+                    elapsed * 1000))
+        config.FAST_JSON = True
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
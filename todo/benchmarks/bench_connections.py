@@ -0,0 +1,40 @@
+"""Requests/sec through a real threaded WSGI server for each
+`config.DATABASE_BACKEND`, at increasing numbers of concurrent clients.
+
+    python3 -m benchmarks.bench_connections [seconds per run]
+"""
+import sys
+
+import app
+import config
+import models
+from benchmarks.common import hammer, live_server, seed, temp_database
+
+
+BACKENDS = ('sqlite', 'pooled')
+CLIENTS = (1, 4, 16)
+
+
+def run(duration):
+    original_backend = config.DATABASE_BACKEND
+    print('{:<8} {:>8} {:>10} {:>8}'.format(
+        'backend', 'clients', 'req/s', 'errors'))
+    try:
+        for backend in BACKENDS:
+            config.DATABASE_BACKEND = backend
+            with temp_database():
+                seed(1000)
+                with live_server(app.app) as base_url:
+                    url = base_url + '/api/v1/todos?limit=50'
+                    for clients in CLIENTS:
+                        count, elapsed, errors = hammer(
+                            url, clients, duration)
+                        print('{:<8} {:>8} {:>10.0f} {:>8}'.format(
+                            backend, clients, count / elapsed, errors))
+                models.close_database()
+    finally:
+        config.DATABASE_BACKEND = original_backend
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,76 @@
+"""Read/write contention for each `config.DATABASE_PROFILES` entry: one
+thread inserting todos (one transaction per insert, like `POST`) while
+several threads read pages of the list (like `GET`).
+
+    python3 -m benchmarks.bench_contention [seconds per run] [readers]
+"""
+import sys
+import threading
+import time
+
+import config
+import models
+from benchmarks.common import percentile, seed, temp_database
+
+
+def writer(stop, latencies):
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            models.Todo.create(name='written under load')
+            latencies.append(time.perf_counter() - start)
+    finally:
+        models.DATABASE.close()
+
+
+def reader(stop, latencies):
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            list(models.Todo.select().order_by(models.Todo.id.desc())
+                 .limit(50).dicts())
+            latencies.append(time.perf_counter() - start)
+    finally:
+        models.DATABASE.close()
+
+
+def run(duration, readers):
+    original_profile = config.DATABASE_PROFILE
+    print('{:<12} {:>10} {:>12} {:>10} {:>12}'.format(
+        'profile', 'writes/s', 'write p95', 'reads/s', 'read p95'))
+    try:
+        for profile in config.DATABASE_PROFILES:
+            config.DATABASE_PROFILE = profile
+            with temp_database():
+                seed(10000)
+                stop = threading.Event()
+                write_latencies = []
+                read_latencies = [[] for _ in range(readers)]
+                threads = [threading.Thread(target=writer,
+                                            args=(stop, write_latencies))]
+                threads.extend(
+                    threading.Thread(target=reader,
+                                     args=(stop, read_latencies[i]))
+                    for i in range(readers)
+                )
+                for thread in threads:
+                    thread.start()
+                time.sleep(duration)
+                stop.set()
+                for thread in threads:
+                    thread.join()
+
+                reads = [t for samples in read_latencies for t in samples]
+                print('{:<12} {:>10.0f} {:>10.2f}ms {:>10.0f} {:>10.2f}ms'
+                      .format(profile,
+                              len(write_latencies) / duration,
+                              percentile(write_latencies, 0.95) * 1000,
+                              len(reads) / duration,
+                              percentile(reads, 0.95) * 1000))
+    finally:
+        config.DATABASE_PROFILE = original_profile
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 3,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4)
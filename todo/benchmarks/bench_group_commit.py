@@ -0,0 +1,85 @@
+"""Write throughput and tail latency with and without group commit
+(writes.py): 1 to 64 threads each `POST`ing todos back to back, under each
+`config.DATABASE_PROFILES` entry ('default' syncs every commit to disk).
+
+    python3 -m benchmarks.bench_group_commit [seconds per run]
+"""
+import json
+import sys
+import threading
+import time
+
+import app
+import config
+import writes
+from benchmarks.common import percentile, temp_database
+
+
+WRITERS = (1, 4, 16, 64)
+
+# label -> (GROUP_COMMIT, GROUP_COMMIT_MAX_WAIT_MS)
+MODES = [
+    ('direct', (False, 0)),
+    ('group', (True, 0)),
+    ('group 1ms', (True, 1)),
+]
+
+BODY = json.dumps({'name': 'written under load'})
+
+
+def writer(deadline, latencies):
+    client = app.app.test_client()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        client.post('/api/v1/todos', data=BODY,
+                    content_type='application/json')
+        latencies.append(time.perf_counter() - start)
+
+
+def run(duration):
+    original = (config.DATABASE_PROFILE, config.GROUP_COMMIT,
+                config.GROUP_COMMIT_MAX_WAIT_MS)
+    print('{:<12} {:<10} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'profile', 'mode', 'writers', 'writes/s', 'p50', 'p99',
+        'per batch'))
+    try:
+        for profile in config.DATABASE_PROFILES:
+            config.DATABASE_PROFILE = profile
+            for label, (group_commit, max_wait_ms) in MODES:
+                config.GROUP_COMMIT = group_commit
+                config.GROUP_COMMIT_MAX_WAIT_MS = max_wait_ms
+                for count in WRITERS:
+                    with temp_database():
+                        writes.initialize()
+                        latencies = [[] for _ in range(count)]
+                        deadline = time.perf_counter() + duration
+                        threads = [
+                            threading.Thread(target=writer,
+                                             args=(deadline, latencies[i]))
+                            for i in range(count)
+                        ]
+                        for thread in threads:
+                            thread.start()
+                        for thread in threads:
+                            thread.join()
+
+                        queue = writes.QUEUES and writes.QUEUES[0]
+                        writes.initialize()  # (stops the writer)
+                        samples = [t for ts in latencies for t in ts]
+                        print('{:<12} {:<10} {:>8} {:>10.0f} {:>8.2f}ms '
+                              '{:>8.2f}ms {:>10}'.format(
+                                  profile, label, count,
+                                  len(samples) / duration,
+                                  percentile(samples, 0.5) * 1000,
+                                  percentile(samples, 0.99) * 1000,
+                                  '{:.1f}'.format(queue.writes
+                                                  / queue.batches)
+                                  if queue and queue.batches else '-'))
+    finally:
+        (config.DATABASE_PROFILE, config.GROUP_COMMIT,
+         config.GROUP_COMMIT_MAX_WAIT_MS) = original
+        writes.initialize()
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 2)
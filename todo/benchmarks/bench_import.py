@@ -0,0 +1,116 @@
+"""Bulk import and export: loads N todos from an NDJSON file (as
+`manage.py import` does), exports them again as NDJSON and CSV, then
+streams the same file to `POST /api/v1/todos/import` on a live server.
+Finally the peak memory allocated (by tracemalloc) importing and exporting
+two sizes of file, which should be the same for both.
+
+    python3 -m benchmarks.bench_import [number of todos]
+"""
+import http.client
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+import urllib.parse
+
+import app
+import bulk
+import models
+from benchmarks.common import live_server, report, temp_database, timer
+from storage import fetch_rows
+
+
+MEMORY_SIZES = (20000, 100000)
+
+
+def write_file(count):
+    fh, filename = tempfile.mkstemp(suffix='.ndjson')
+    with os.fdopen(fh, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps({'name': 'todo {}'.format(i),
+                                'completed': i % 3 == 0}) + '\n')
+    return filename
+
+
+def import_file(filename):
+    with open(filename, encoding='utf-8', newline='') as lines:
+        for progress in bulk.import_todos(bulk.read_ndjson(lines)):
+            pass
+    return progress
+
+
+def export_file(fmt):
+    query = models.Todo.select().order_by(models.Todo.id)
+    rows = fetch_rows(query, bulk.export_columns(), [0], False)
+    with open(os.devnull, 'w') as output:
+        for chunk in bulk.export_rows(rows, fmt):
+            output.write(chunk)
+
+
+def post_file(base_url, filename):
+    url = urllib.parse.urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    with open(filename, 'rb') as body:
+        # (http.client sends a file a block at a time)
+        connection.request('POST', '/api/v1/todos/import', body=body, headers={
+            'Content-Type': 'application/x-ndjson',
+            'Content-Length': str(os.path.getsize(filename)),
+        })
+        lines = connection.getresponse().read().splitlines()
+    connection.close()
+    return json.loads(lines[-1])
+
+
+def peak_memory(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(count):
+    filename = write_file(count)
+    timings = {}
+    try:
+        with temp_database():
+            with timer(timings, 'import'):
+                progress = import_file(filename)
+            assert progress.imported == count
+            for fmt in bulk.FORMATS:
+                with timer(timings, fmt):
+                    export_file(fmt)
+            models.close_database()
+
+        with temp_database(), live_server(app.app) as base_url:
+            with timer(timings, 'http'):
+                summary = post_file(base_url, filename)
+            assert summary['imported'] == count
+    finally:
+        os.unlink(filename)
+
+    report('{} todos'.format(count), [
+        ('import from a file', count, timings['import']),
+        ('export as NDJSON', count, timings['ndjson']),
+        ('export as CSV', count, timings['csv']),
+        ('POST /api/v1/todos/import', count, timings['http']),
+    ])
+
+    print('{:<10} {:>14} {:>14}'.format('todos', 'import peak', 'export peak'))
+    for size in MEMORY_SIZES:
+        filename = write_file(size)
+        try:
+            with temp_database():
+                imported = peak_memory(import_file, filename)
+                exported = peak_memory(export_file, 'ndjson')
+                models.close_database()
+        finally:
+            os.unlink(filename)
+        print('{:<10} {:>12.1f}MB {:>12.1f}MB'.format(
+            size, imported / 2 ** 20, exported / 2 ** 20))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,124 @@
+"""The cost of admission control (limits.py), and what it buys.
+
+First, the time a rate limit check takes, for each bucket store. Then an
+overload: 64 clients `POST`ing back to back to a threaded WSGI server
+under SQLite's default (synced) profile, without and with load shedding,
+reporting the requests that succeeded, the ones shed (whose clients wait
+for the Retry-After, as a well-behaved client would), the ones that failed
+(SQLite gave up waiting for the lock), and the latency of the successful
+ones.
+
+    python3 -m benchmarks.bench_limits [seconds per run]
+"""
+import http.client
+import json
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import app
+import config
+import limits
+from benchmarks.common import live_server, percentile, temp_database
+
+
+CHECKS = 20000
+CLIENTS = 64
+
+# label -> (SHED_MAX_IN_FLIGHT, SHED_MAX_DB_WAIT_MS)
+SHEDDING = [
+    ('off', (None, None)),
+    ('in flight 8', (8, None)),
+    ('db wait 100ms', (None, 100)),
+]
+
+BODY = json.dumps({'name': 'written under overload'})
+
+
+def time_per_check(limiter):
+    start = time.perf_counter()
+    for _ in range(CHECKS):
+        limiter.hit('127.0.0.1', 'resources.todos.todo')
+    return (time.perf_counter() - start) / CHECKS
+
+
+def overload(base_url, duration):
+    """(successful, shed, failed, latencies of the successful ones)"""
+    address = urllib.parse.urlsplit(base_url).netloc
+    results = [[] for _ in range(CLIENTS)]
+    deadline = time.perf_counter() + duration
+
+    def client(samples):
+        connection = http.client.HTTPConnection(address, timeout=30)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            connection.request('POST', '/api/v1/todos', body=BODY,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            samples.append((response.status, time.perf_counter() - start))
+            if response.status == 503:
+                time.sleep(int(response.getheader('Retry-After')))
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(results[i],))
+               for i in range(CLIENTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    samples = [sample for client_samples in results
+               for sample in client_samples]
+    ok = [seconds for status, seconds in samples if status == 201]
+    shed = sum(1 for status, _ in samples if status == 503)
+    failed = sum(1 for status, _ in samples if status == 500)
+    return len(ok), shed, failed, ok
+
+
+def run(duration):
+    original = (config.RATE_LIMIT_ENABLED, config.RATE_LIMIT_BACKEND,
+                config.RATE_LIMIT_FILENAME, config.DEFAULT_RATE,
+                config.SHED_MAX_IN_FLIGHT, config.SHED_MAX_DB_WAIT_MS,
+                config.DATABASE_PROFILE)
+    try:
+        print('{:<10} {:>12}'.format('store', 'per check'))
+        with tempfile.NamedTemporaryFile() as buckets:
+            config.DEFAULT_RATE = '1000000/second'
+            config.RATE_LIMIT_ENABLED = True
+            config.RATE_LIMIT_FILENAME = buckets.name
+            for backend in ('memory', 'sqlite'):
+                config.RATE_LIMIT_BACKEND = backend
+                limits.initialize()
+                print('{:<10} {:>10.1f}us'.format(
+                    backend, time_per_check(limits.LIMITER) * 1e6))
+        config.RATE_LIMIT_ENABLED = False
+
+        print()
+        print('{:<14} {:>8} {:>8} {:>8} {:>10} {:>10}'.format(
+            'shedding', 'ok/s', 'shed/s', 'failed', 'ok p50', 'ok p99'))
+        config.DATABASE_PROFILE = 'default'
+        # (the failures are counted; their tracebacks would drown the table)
+        app.app.logger.disabled = True
+        for label, (in_flight, db_wait) in SHEDDING:
+            config.SHED_MAX_IN_FLIGHT = in_flight
+            config.SHED_MAX_DB_WAIT_MS = db_wait
+            limits.initialize()
+            with temp_database(), live_server(app.app) as base_url:
+                ok, shed, failed, latencies = overload(base_url, duration)
+                print('{:<14} {:>8.0f} {:>8.0f} {:>8} {:>8.0f}ms {:>8.0f}ms'
+                      .format(label, ok / duration, shed / duration, failed,
+                              percentile(latencies, 0.5) * 1000,
+                              percentile(latencies, 0.99) * 1000))
+    finally:
+        (config.RATE_LIMIT_ENABLED, config.RATE_LIMIT_BACKEND,
+         config.RATE_LIMIT_FILENAME, config.DEFAULT_RATE,
+         config.SHED_MAX_IN_FLIGHT, config.SHED_MAX_DB_WAIT_MS,
+         config.DATABASE_PROFILE) = original
+        app.app.logger.disabled = False
+        limits.initialize()
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 3)
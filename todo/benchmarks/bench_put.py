@@ -0,0 +1,56 @@
+"""Compares ways of updating a todo and reading it back (as `PUT
+/api/v1/todos/<id>` does): the old `.update()` then `.get()`, a single
+`UPDATE ... RETURNING`, and the update and read in one transaction (the
+fallback for SQLite older than 3.35).
+
+    python3 -m benchmarks.bench_put [number of updates]
+"""
+import sys
+
+import models
+from benchmarks.common import report, seed, temp_database, timer
+
+
+def update_then_get(todo_id, **values):
+    models.Todo.update(**values).where(models.Todo.id == todo_id).execute()
+    return models.Todo.get(models.Todo.id == todo_id)
+
+
+def run(count):
+    timings = {}
+    statements = {}
+    returning = models.RETURNING_SUPPORTED
+    variants = [
+        ('update, get', update_then_get, returning),
+        ('update returning', models.update_todo, True),
+        ('atomic update, get', models.update_todo, False),
+    ]
+
+    executed = []
+    models.QUERY_HOOKS.append(lambda sql, seconds: executed.append(sql))
+    try:
+        for name, update, supported in variants:
+            if name == 'update returning' and not returning:
+                continue
+            models.RETURNING_SUPPORTED = supported
+            with temp_database():
+                seed(count)
+                models.DATABASE.connect(reuse_if_open=True)
+                del executed[:]
+                with timer(timings, name):
+                    for todo_id in range(1, count + 1):
+                        update(todo_id, name='done', completed=True)
+                statements[name] = len(executed) / count
+    finally:
+        models.RETURNING_SUPPORTED = returning
+        models.QUERY_HOOKS.clear()
+
+    report('{} updates, each read back'.format(count), [
+        ('{} ({:g} stmts)'.format(name, statements[name]),
+         count, timings[name])
+        for name, _, _ in variants if name in timings
+    ])
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
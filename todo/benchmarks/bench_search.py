@@ -0,0 +1,54 @@
+"""Searching todo names: a full-text query (`?q=`) against what the
+client used to do, download the whole collection and filter it.
+
+    python3 -m benchmarks.bench_search [number of todos]
+"""
+import random
+import sys
+import time
+
+import app
+import models
+from benchmarks.common import temp_database
+
+
+WORDS = ('buy', 'call', 'fix', 'write', 'book', 'clean', 'milk', 'report',
+         'garage', 'dentist', 'invoice', 'tickets', 'plants', 'car')
+
+
+def seed_words(count, chunk_size=500):
+    """`count` todos named with three random words each"""
+    rng = random.Random(0)
+    with models.DATABASE.atomic():
+        for start in range(0, count, chunk_size):
+            models.Todo.insert_many([
+                {'name': ' '.join(rng.sample(WORDS, 3)) + ' {}'.format(i)}
+                for i in range(start, min(start + chunk_size, count))
+            ]).execute()
+    models.DATABASE.close()
+
+
+def run(count):
+    client = app.app.test_client()
+    with temp_database():
+        seed_words(count)
+
+        print('{} todos'.format(count))
+        print('{:<28} {:>8} {:>12} {:>10}'.format(
+            'request', 'matches', 'bytes', 'ms'))
+        for label, path, matches in [
+                ('full list, filter in client', '/api/v1/todos',
+                 lambda body: body.count(b'invoice')),
+                ('?q=invoice&limit=50', '/api/v1/todos?q=invoice&limit=50',
+                 lambda body: body.count(b'"id"')),
+                ('?q=inv den&limit=50', '/api/v1/todos?q=inv+den&limit=50',
+                 lambda body: body.count(b'"id"'))]:
+            start = time.perf_counter()
+            body = client.get(path).get_data()
+            elapsed = time.perf_counter() - start
+            print('{:<28} {:>8} {:>12} {:>10.1f}'.format(
+                label, matches(body), len(body), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,48 @@
+"""Serialising a listing of todos: the old per-row `marshal()` on model
+instances against the compiled serializer on row tuples.
+
+    python3 -m benchmarks.bench_serializer [number of todos]
+"""
+import json
+import sys
+
+from flask_restful import marshal
+
+import models
+from benchmarks.common import report, seed, temp_database, timer
+from resources.todos import todo_fields, todo_serializer
+
+
+def run(count):
+    timings = {}
+    with temp_database():
+        seed(count)
+
+        def query():
+            return models.Todo.select().order_by(models.Todo.id)
+
+        def tuples():
+            return query().select(*todo_serializer.columns).tuples()
+
+        with timer(timings, 'models + marshal'):
+            json.dumps([marshal(todo, todo_fields) for todo in query()])
+
+        with timer(timings, 'tuples + marshal'):
+            json.dumps([marshal(todo_serializer.as_dict(row), todo_fields)
+                        for row in tuples().iterator()])
+
+        with timer(timings, 'tuples + compiled'):
+            '[' + ', '.join(todo_serializer(row)
+                            for row in tuples().iterator()) + ']'
+
+        rows = list(tuples())
+        with timer(timings, 'compiled only (rows in memory)'):
+            '[' + ', '.join(todo_serializer(row) for row in rows) + ']'
+
+    report('Serialising {} todos'.format(count), [
+        (label, count, seconds) for label, seconds in timings.items()
+    ])
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
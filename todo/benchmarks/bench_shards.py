@@ -0,0 +1,97 @@
+"""Write throughput and tail latency with the todos on 1, 2 and 4 SQLite
+shards (`config.DATABASE_SHARDS`): 16 threads each `POST`ing todos back to
+back, under each `config.DATABASE_PROFILES` entry. Then the cost of the
+scatter-gather on reads: a page of 100, and the whole collection, from
+10000 todos.
+
+    python3 -m benchmarks.bench_shards [seconds per run]
+"""
+import json
+import sys
+import threading
+import time
+
+import app
+import config
+import models
+from benchmarks.common import percentile, temp_database
+
+
+SHARDS = (1, 2, 4)
+WRITERS = 16
+ROWS = 10000
+
+BODY = json.dumps({'name': 'written under load'})
+
+
+def writer(deadline, latencies):
+    client = app.app.test_client()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        client.post('/api/v1/todos', data=BODY,
+                    content_type='application/json')
+        latencies.append(time.perf_counter() - start)
+
+
+def seed_shards(rows):
+    for shard in range(models.shard_count()):
+        with models.using_shard(shard), models.DATABASE.atomic():
+            for _ in range(shard, rows, models.shard_count()):
+                models.create_todo(name='seeded')
+
+
+def time_get(client, url, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(url).get_data()
+        samples.append(time.perf_counter() - start)
+    return percentile(samples, 0.5) * 1000
+
+
+def run(duration):
+    original = (config.DATABASE_PROFILE, config.DATABASE_SHARDS)
+    print('{:<12} {:>7} {:>10} {:>10} {:>10}'.format(
+        'profile', 'shards', 'writes/s', 'p50', 'p99'))
+    try:
+        for profile in config.DATABASE_PROFILES:
+            config.DATABASE_PROFILE = profile
+            for shards in SHARDS:
+                config.DATABASE_SHARDS = shards
+                with temp_database():
+                    latencies = [[] for _ in range(WRITERS)]
+                    deadline = time.perf_counter() + duration
+                    threads = [
+                        threading.Thread(target=writer,
+                                         args=(deadline, latencies[i]))
+                        for i in range(WRITERS)
+                    ]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    samples = [t for ts in latencies for t in ts]
+                    print('{:<12} {:>7} {:>10.0f} {:>8.2f}ms {:>8.2f}ms'
+                          .format(profile, shards, len(samples) / duration,
+                                  percentile(samples, 0.5) * 1000,
+                                  percentile(samples, 0.99) * 1000))
+
+        config.DATABASE_PROFILE = 'performance'
+        print()
+        print('{:>7} {:>12} {:>12}'.format(
+            'shards', 'page of 100', 'all {}'.format(ROWS)))
+        for shards in SHARDS:
+            config.DATABASE_SHARDS = shards
+            with temp_database():
+                seed_shards(ROWS)
+                client = app.app.test_client()
+                print('{:>7} {:>10.2f}ms {:>10.2f}ms'.format(
+                    shards,
+                    time_get(client, '/api/v1/todos?limit=100'),
+                    time_get(client, '/api/v1/todos', repeat=5)))
+    finally:
+        config.DATABASE_PROFILE, config.DATABASE_SHARDS = original
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 2)
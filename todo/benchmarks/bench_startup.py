@@ -0,0 +1,130 @@
+"""Measures what it costs to start a worker and to handle a request:
+
+- import: `import app` in a fresh interpreter, and the modules that take
+  longest to import (from `python -X importtime`)
+- first response: importing the app, `models.initialize()` and one GET,
+  again in a fresh interpreter
+- per request: the time a request takes and the memory it allocates at
+  its peak (tracemalloc), for a few typical requests
+
+    python3 -m benchmarks.bench_startup [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import app
+from benchmarks.common import seed, temp_database
+
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter; prints the seconds to import and to the end
+# of the first response
+FIRST_RESPONSE = '''
+import time
+start = time.perf_counter()
+import os, tempfile
+import config
+fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+import app, models
+imported = time.perf_counter()
+models.initialize()
+app.app.test_client().get('/api/v1/todos')
+print(imported - start, time.perf_counter() - start)
+models.close_database()
+os.close(fh)
+os.unlink(config.DATABASE_FILENAME)
+'''
+
+REQUESTS = [
+    ('GET', '/api/v1/todos/1', None),
+    ('GET', '/api/v1/todos?limit=20', None),
+    ('PUT', '/api/v1/todos/1', {'name': 'renamed', 'completed': True}),
+    ('POST', '/api/v1/todos', {'name': 'new'}),
+]
+
+
+def python(*args):
+    return subprocess.run([sys.executable] + list(args), cwd=APP_DIR,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+def import_profile(top=10):
+    """[(module, self microseconds, cumulative microseconds)] for the
+    modules that take longest to import themselves
+    """
+    stderr = python('-X', 'importtime', '-c', 'import app').stderr
+    modules = []
+    for line in stderr.splitlines()[1:]:
+        # 'import time:  <self us> | <cumulative us> | <module>'
+        self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+
+
+def startup(runs):
+    imports, firsts = [], []
+    for _ in range(runs):
+        imported, first = map(float, python('-c', FIRST_RESPONSE).stdout
+                              .split())
+        imports.append(imported)
+        firsts.append(first)
+
+    print('Startup (median of {} runs)'.format(runs))
+    print('{:<16} {:>10.1f} ms'.format(
+        'import app', statistics.median(imports) * 1000))
+    print('{:<16} {:>10.1f} ms'.format(
+        'first response', statistics.median(firsts) * 1000))
+
+    print()
+    print('Slowest imports')
+    print('{:<40} {:>10} {:>12}'.format('module', 'self ms', 'total ms'))
+    for name, self_us, cumulative_us in import_profile():
+        print('{:<40} {:>10.1f} {:>12.1f}'.format(
+            name, self_us / 1000, cumulative_us / 1000))
+
+
+def per_request(runs):
+    client = app.app.test_client()
+    print()
+    print('Per request (mean of {} requests)'.format(runs))
+    print('{:<28} {:>10} {:>14}'.format('request', 'ms', 'peak KiB'))
+    with temp_database():
+        seed(1000)
+        for method, path, body in REQUESTS:
+            kwargs = {}
+            if body is not None:
+                kwargs = {'data': json.dumps(body),
+                          'content_type': 'application/json'}
+            client.open(path, method=method, **kwargs)  # warm up
+
+            start = time.perf_counter()
+            for _ in range(runs):
+                client.open(path, method=method, **kwargs)
+            elapsed = (time.perf_counter() - start) / runs
+
+            # (separately: tracing slows everything down)
+            peaks = []
+            tracemalloc.start()
+            for _ in range(runs):
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                client.open(path, method=method, **kwargs)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            tracemalloc.stop()
+
+            print('{:<28} {:>10.3f} {:>14.1f}'.format(
+                '{} {}'.format(method, path), elapsed * 1000,
+                statistics.mean(peaks) / 1024))
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    startup(runs)
+    per_request(runs * 10)
@@ -0,0 +1,88 @@
+"""Stats: reading the kept counts (`GET /api/v1/todos/stats`) against
+counting the same things with a scan of the todo table, at a few table
+sizes, then what keeping the counts costs single creates, updates and
+deletes (with and without the stats triggers).
+
+    python3 -m benchmarks.bench_stats [largest number of todos]
+"""
+import sys
+import time
+
+import app
+import models
+import storage
+from benchmarks.common import percentile, report, seed, temp_database, timer
+
+
+READS = 200
+WRITES = 2000
+
+# what the stats are, counted from scratch
+COUNT_QUERY = """SELECT substr(created_date, 1, 10), COUNT(*), SUM(completed)
+    FROM todo GROUP BY 1"""
+
+
+def median_time(function, times):
+    samples = []
+    for _ in range(times):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return percentile(samples, 0.5)
+
+
+def reads(count):
+    with temp_database():
+        seed(count)
+        client = app.app.test_client()
+        repository = storage.SqliteRepository()
+        kept = median_time(repository.stats, READS)
+        endpoint = median_time(
+            lambda: client.get('/api/v1/todos/stats').get_data(), READS)
+        counted = median_time(
+            lambda: models.DATABASE.execute_sql(COUNT_QUERY).fetchall(),
+            max(3, READS // (1 + count // 10000)))
+        models.close_database()
+    return kept, endpoint, counted
+
+
+def writes(with_triggers):
+    repository = storage.SqliteRepository()
+    timings = {}
+    with temp_database():
+        if not with_triggers:
+            for name in models.TRIGGERS:
+                if name.startswith('todo_stats_'):
+                    models.DATABASE.execute_sql(
+                        'DROP TRIGGER {}'.format(name))
+        with timer(timings, 'create'):
+            ids = [repository.create('todo').id for _ in range(WRITES)]
+        with timer(timings, 'update'):
+            for todo_id in ids:
+                repository.update(todo_id, 'todo', True)
+        with timer(timings, 'delete'):
+            for todo_id in ids:
+                repository.delete(todo_id)
+        models.close_database()
+    return timings
+
+
+def run(largest):
+    print('{:<10} {:>14} {:>14} {:>14}'.format(
+        'todos', 'stats() (ms)', 'GET (ms)', 'COUNT (ms)'))
+    for count in (10000, 100000, largest):
+        kept, endpoint, counted = reads(count)
+        print('{:<10} {:>14.3f} {:>14.3f} {:>14.1f}'.format(
+            count, kept * 1e3, endpoint * 1e3, counted * 1e3))
+    print()
+
+    for with_triggers in (False, True):
+        timings = writes(with_triggers)
+        report('with stats triggers' if with_triggers
+               else 'without stats triggers',
+               [(operation, WRITES, seconds)
+                for operation, seconds in timings.items()])
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,119 @@
+"""Storage engines: the memory held by N todos in `MemoryRepository`
+(measured by tracemalloc, next to the same todos as a dict of plain
+objects, and the size of the SQLite file), then the latency of each
+repository operation on both engines, holding N todos.
+
+    python3 -m benchmarks.bench_storage [number of todos]
+"""
+import datetime
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import models
+import storage
+from benchmarks.common import percentile, seed, temp_database
+
+
+SAMPLES = 2000
+PAGE_SIZE = 50
+
+
+class PlainTodo:
+    # (the obvious way to hold todos in memory, for comparison)
+    def __init__(self, id, name, completed, created_date):
+        self.id = id
+        self.name = name
+        self.completed = completed
+        self.created_date = created_date
+
+
+def fill(repository, count):
+    for i in range(count):
+        repository.create('todo {}'.format(i), completed=i % 3 == 0)
+
+
+def traced(function, *args):
+    """The memory still allocated by what `function` returns"""
+    tracemalloc.start()
+    try:
+        kept = function(*args)
+        return kept, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def memory_repository(count):
+    repository = storage.MemoryRepository()
+    fill(repository, count)
+    return repository
+
+
+def plain_todos(count):
+    now = datetime.datetime.now()
+    return {i: PlainTodo(i, 'todo {}'.format(i), i % 3 == 0, now)
+            for i in range(1, count + 1)}
+
+
+def latencies(repository, count):
+    """{operation: list of seconds} for SAMPLES of each operation"""
+    ids = random.sample(range(1, count + 1), SAMPLES)
+    results = {}
+
+    def measure(name, function, arguments):
+        samples = results[name] = []
+        for args in arguments:
+            start = time.perf_counter()
+            function(*args)
+            samples.append(time.perf_counter() - start)
+
+    def page(todo_id):
+        rows, _ = repository.list(sort='id', after=('id', [todo_id]),
+                                  limit=PAGE_SIZE)
+        return list(rows)
+
+    measure('get', repository.get, [(i,) for i in ids])
+    measure('list a page', page, [(i,) for i in ids])
+    measure('update', repository.update,
+            [(i, 'renamed', True) for i in ids])
+    measure('create', repository.create,
+            [('new todo',)] * SAMPLES)
+    measure('delete', repository.delete, [(i,) for i in ids])
+    return results
+
+
+def run(count):
+    repository, held = traced(memory_repository, count)
+    plain, plain_held = traced(plain_todos, count)
+    del plain
+    with temp_database() as filename:
+        seed(count)
+        sqlite_size = os.path.getsize(filename)
+        sqlite = latencies(storage.SqliteRepository(), count)
+        models.close_database()
+    memory = latencies(repository, count)
+
+    title = '{} todos'.format(count)
+    print(title)
+    print('-' * len(title))
+    for label, size in [('MemoryRepository', held),
+                        ('dict of objects', plain_held),
+                        ('SQLite file', sqlite_size)]:
+        print('{:<20} {:>8.1f}MB {:>8.0f} bytes/todo'.format(
+            label, size / 2 ** 20, size / count))
+    print()
+
+    print('{:<14} {:>12} {:>12} {:>12} {:>12}'.format(
+        'us', 'sqlite p50', 'sqlite p99', 'memory p50', 'memory p99'))
+    for operation in sqlite:
+        print('{:<14} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            operation,
+            *(percentile(samples[operation], fraction) * 1e6
+              for samples in (sqlite, memory)
+              for fraction in (0.5, 0.99))))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
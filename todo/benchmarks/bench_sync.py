@@ -0,0 +1,41 @@
+"""Compares a full reload of the collection with a delta sync
+(`?since=<version>`) after a handful of writes.
+
+    python3 -m benchmarks.bench_sync [number of todos] [number of writes]
+"""
+import json
+import sys
+import time
+
+import app
+from benchmarks.common import seed, temp_database
+
+
+def run(count, writes):
+    client = app.app.test_client()
+    with temp_database():
+        seed(count)
+        version = client.get('/api/v1/todos?limit=1').headers['X-Version']
+
+        for todo_id in range(1, writes + 1):
+            client.put('/api/v1/todos/{}'.format(todo_id),
+                       data=json.dumps({'name': 'changed'}),
+                       content_type='application/json')
+        client.delete('/api/v1/todos/{}'.format(count))
+
+        print('{} todos, {} updates and a delete since the last sync'.format(
+            count, writes))
+        print('{:<12} {:>12} {:>10}'.format('request', 'bytes', 'ms'))
+        for label, path in [
+                ('full reload', '/api/v1/todos'),
+                ('delta sync', '/api/v1/todos?since={}'.format(version))]:
+            start = time.perf_counter()
+            body = client.get(path).get_data()
+            elapsed = time.perf_counter() - start
+            print('{:<12} {:>12} {:>10.1f}'.format(
+                label, len(body), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50)
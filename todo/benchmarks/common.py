@@ -0,0 +1,163 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import config
+import models
+
+
+@contextlib.contextmanager
+def temp_database(template=None):
+    """Point the models at a fresh temporary database for the duration of
+    the block (the same way the unit tests do). If given, the database
+    starts as a copy of the (closed) database file `template`.
+    """
+    original_filename = config.DATABASE_FILENAME
+    fh, config.DATABASE_FILENAME = tempfile.mkstemp(suffix='.sqlite')
+    try:
+        if template is not None:
+            shutil.copyfile(template, config.DATABASE_FILENAME)
+        models.initialize()
+        yield config.DATABASE_FILENAME
+    finally:
+        models.close_database()
+        os.close(fh)
+        for shard in range(config.DATABASE_SHARDS):
+            filename = models.shard_filename(shard)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(filename + suffix):
+                    os.unlink(filename + suffix)
+        config.DATABASE_FILENAME = original_filename
+
+
+@contextlib.contextmanager
+def timer(results, key):
+    """Store the wall clock time spent in the block in `results[key]`"""
+    start = time.perf_counter()
+    yield
+    results[key] = time.perf_counter() - start
+
+
+def percentile(samples, fraction):
+    """The nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = int(round(fraction * len(ordered)))
+    index = min(len(ordered) - 1, max(0, rank - 1))
+    return ordered[index]
+
+
+def report(title, rows):
+    """Print `rows` (a list of (label, count, seconds)) as a small table"""
+    print(title)
+    print('-' * len(title))
+    for label, count, seconds in rows:
+        print('{:<32} {:>8} ops {:>9.3f}s {:>11.0f} ops/s'.format(
+            label, count, seconds, count / seconds if seconds else 0))
+    print()
+
+
+def seed(count, chunk_size=500):
+    """Insert `count` todos in chunked multi-row INSERTs"""
+    with models.DATABASE.atomic():
+        for start in range(0, count, chunk_size):
+            rows = [
+                {'name': 'todo {}'.format(i), 'completed': i % 3 == 0}
+                for i in range(start, min(start + chunk_size, count))
+            ]
+            models.Todo.insert_many(rows).execute()
+    models.DATABASE.close()
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Don't log every request (the logging would dominate the timings)"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@contextlib.contextmanager
+def live_server(wsgi_app):
+    """Serve `wsgi_app` from a threaded WSGI server on a free local port
+    and yield its base URL
+    """
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(server.server_port)
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+@contextlib.contextmanager
+def live_asgi_server(application):
+    """Serve the ASGI `application` from `asgi.serve()`, on an event loop
+    in a background thread, and yield its base URL
+    """
+    import asgi
+
+    loop = asyncio.new_event_loop()
+    address = concurrent.futures.Future()
+    tasks = []
+
+    async def main():
+        ready = loop.create_future()
+        tasks.append(asyncio.ensure_future(asgi.serve(
+            application, host='127.0.0.1', port=0, ready=ready)))
+        address.set_result(await ready)
+        try:
+            await tasks[0]
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=loop.run_until_complete,
+                              args=(main(),), daemon=True)
+    thread.start()
+    try:
+        yield 'http://{}:{}'.format(*address.result(timeout=30))
+    finally:
+        loop.call_soon_threadsafe(tasks[0].cancel)
+        thread.join()
+        loop.close()
+
+
+def hammer(url, clients, duration, method='GET', body=None):
+    """Have `clients` threads request `url` back to back for `duration`
+    seconds. Returns (number of requests, elapsed seconds, errors)
+    """
+    counts = [0] * clients
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+    headers = {'Content-Type': 'application/json'} if body else {}
+
+    def client(index):
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(
+                url, data=body, method=method, headers=headers)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                counts[index] += 1
+            except OSError:
+                errors[index] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts), time.perf_counter() - start, sum(errors)
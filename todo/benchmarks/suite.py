@@ -0,0 +1,272 @@
+"""The API benchmark suite: drives the list, create, update and delete
+endpoints against databases of different sizes, both through the Flask
+test client (the app on its own) and through a real local WSGI server
+with concurrent clients, and reports throughput and p50/p95/p99 latency.
+
+    python3 -m benchmarks.suite --rows 1000 100000 --output results.json
+    python3 -m benchmarks.suite --baseline results.json
+
+Results are written as JSON. Given a `--baseline` (an earlier results
+file) the suite compares every matching run against it, and exits with
+status 1 if throughput dropped, or p95 latency grew, by more than
+`--tolerance`.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import app
+import models
+from benchmarks.common import live_server, percentile, seed, temp_database
+
+
+# Scenarios
+# ---------
+# Each scenario is a function (rows, index) -> (method, path, body) giving
+# the index-th request against a database seeded with `rows` todos.
+def list_page(rows, index):
+    return 'GET', '/api/v1/todos?limit=100', None
+
+
+def list_all(rows, index):
+    return 'GET', '/api/v1/todos', None
+
+
+def create(rows, index):
+    body = json.dumps({'name': 'benchmark {}'.format(index)})
+    return 'POST', '/api/v1/todos', body
+
+
+def update(rows, index):
+    body = json.dumps({'name': 'updated {}'.format(index), 'completed': True})
+    todo_id = random.randint(1, rows)
+    return 'PUT', '/api/v1/todos/{}'.format(todo_id), body
+
+
+def delete(rows, index):
+    # counting down from the last seeded todo, so every delete hits a row
+    return 'DELETE', '/api/v1/todos/{}'.format(rows - index), None
+
+
+SCENARIOS = {
+    'list_page': list_page,
+    'list_all': list_all,
+    'create': create,
+    'update': update,
+    'delete': delete,
+}
+
+# the whole list is only benchmarked up to this many rows
+LIST_ALL_MAX_ROWS = 100000
+
+
+# Drivers
+# -------
+def drive_test_client(scenario, rows, requests):
+    """Issue `requests` requests, one after another, through the Flask test
+    client. Returns (latencies, errors, elapsed).
+    """
+    client = app.app.test_client()
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for index in range(requests):
+        method, path, body = scenario(rows, index)
+        began = time.perf_counter()
+        response = client.open(path, method=method, data=body,
+                               content_type='application/json')
+        response.get_data()
+        latencies.append(time.perf_counter() - began)
+        if response.status_code >= 400:
+            errors += 1
+    return latencies, errors, time.perf_counter() - start
+
+
+def drive_server(scenario, rows, requests, clients):
+    """Issue `requests` requests from `clients` threads against a live
+    threaded WSGI server. Returns (latencies, errors, elapsed).
+    """
+    counter = itertools.count()
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+
+    def client(number, host, port):
+        # the threads share one itertools.count, whose next() is atomic
+        # under the GIL, so every index (and so every todo id a delete
+        # uses) is handed out exactly once
+        for index in counter:
+            if index >= requests:
+                return
+            method, path, body = scenario(rows, index)
+            headers = {'Content-Type': 'application/json'} if body else {}
+            began = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+                if response.status >= 400:
+                    errors[number] += 1
+            except OSError:
+                errors[number] += 1
+            latencies[number].append(time.perf_counter() - began)
+
+    with live_server(app.app) as base_url:
+        host, port = base_url.rsplit('/', 1)[1].split(':')
+        threads = [threading.Thread(target=client, args=(i, host, int(port)))
+                   for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+    return [t for samples in latencies for t in samples], sum(errors), elapsed
+
+
+# Running and comparing
+# ---------------------
+def summarise(latencies, errors, elapsed, **run):
+    run.update(
+        requests=len(latencies),
+        errors=errors,
+        seconds=round(elapsed, 4),
+        throughput=round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        p50_ms=round(percentile(latencies, 0.50) * 1000, 3),
+        p95_ms=round(percentile(latencies, 0.95) * 1000, 3),
+        p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+    )
+    return run
+
+
+def run_suite(row_counts, scenarios, modes, client_counts, requests):
+    results = []
+    for rows in row_counts:
+        # seed once per size, then give every run its own copy
+        fh, template = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fh)
+        try:
+            with temp_database() as filename:
+                seed(rows)
+                models.close_database()
+                shutil.copyfile(filename, template)
+
+            for name in scenarios:
+                if name == 'list_all' and rows > LIST_ALL_MAX_ROWS:
+                    continue
+                count = min(requests, rows) if name == 'delete' else requests
+                runs = []
+                if 'client' in modes:
+                    runs.append(('client', 1))
+                if 'server' in modes:
+                    runs.extend(('server', clients)
+                                for clients in client_counts)
+
+                for mode, clients in runs:
+                    with temp_database(template):
+                        if mode == 'client':
+                            outcome = drive_test_client(
+                                SCENARIOS[name], rows, count)
+                        else:
+                            outcome = drive_server(
+                                SCENARIOS[name], rows, count, clients)
+                    result = summarise(*outcome, scenario=name, mode=mode,
+                                       rows=rows, clients=clients)
+                    results.append(result)
+                    print_result(result)
+        finally:
+            os.unlink(template)
+    return results
+
+
+def run_key(result):
+    return (result['scenario'], result['mode'], result['rows'],
+            result['clients'])
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of human readable regressions (empty if none)"""
+    previous = {run_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(run_key(result))
+        if before is None:
+            continue
+        label = '{scenario}/{mode} rows={rows} clients={clients}'.format(
+            **result)
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append('{}: throughput {} -> {} req/s'.format(
+                label, before['throughput'], result['throughput']))
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {} -> {} ms'.format(
+                label, before['p95_ms'], result['p95_ms']))
+    return regressions
+
+
+def print_result(result):
+    print('{scenario:<10} {mode:<7} rows={rows:<8} clients={clients:<3} '
+          '{throughput:>9.1f} req/s  p50={p50_ms:.2f}ms '
+          'p95={p95_ms:.2f}ms p99={p99_ms:.2f}ms errors={errors}'
+          .format(**result))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000],
+                        help='database sizes to seed (e.g. 1000 1000000)')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS),
+                        choices=list(SCENARIOS))
+    parser.add_argument('--modes', nargs='+', default=['client', 'server'],
+                        choices=['client', 'server'])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8],
+                        help='concurrent clients for the server mode')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per run')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed fractional regression (default 0.2)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_suite(args.rows, args.scenarios, args.modes, args.clients,
+                        args.requests)
+    document = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'requests': args.requests,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(document, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+        print('No regressions against {}'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
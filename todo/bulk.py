@@ -0,0 +1,205 @@
+import collections
+import csv
+import datetime
+import io
+import itertools
+import json
+
+import config
+import models
+import serializers
+
+
+# The columns of an export. An import reads all but the id (it gives every
+# todo a new one), so an export can be imported again, into any database.
+EXPORT_COLUMNS = ('id', 'name', 'completed', 'created_date')
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# How an import is going: the lines read so far, how many todos have been
+# imported and how many rows rejected, and the first
+# `config.IMPORT_MAX_ERRORS` rejections, as {"line": ..., "message": ...}
+Progress = collections.namedtuple(
+    'Progress', ['lines', 'imported', 'rejected', 'errors'])
+
+
+# Export
+# ------
+def export_columns():
+    """The columns to select for an export, in `EXPORT_COLUMNS` order.
+    created_date is read as the text SQLite holds, which is what gets
+    written out: having peewee parse every date only for it to be
+    formatted again would take most of the time an export takes.
+    """
+    todo = models.Todo
+    return [todo.id, todo.name, todo.completed, todo.created_date.cast('TEXT')]
+
+
+def export_rows(rows, fmt):
+    """Yield row tuples of the `export_columns()` (an iterator, see
+    `storage.fetch_rows()`) as NDJSON or CSV text,
+    `config.STREAM_CHUNK_SIZE` rows at a time
+    """
+    rows = iter(rows)
+    format_chunk = _ndjson_chunk if fmt == 'ndjson' else _csv_chunk
+    if fmt == 'csv':
+        yield _csv_chunk([EXPORT_COLUMNS])
+    while True:
+        chunk = list(itertools.islice(rows, config.STREAM_CHUNK_SIZE))
+        if not chunk:
+            return
+        yield format_chunk(chunk)
+
+
+def _ndjson_chunk(chunk):
+    return ''.join(serializers.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+                   for row in chunk)
+
+
+def _csv_chunk(chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    # (booleans as `inputs.boolean` reads them back)
+    writer.writerows([value if not isinstance(value, bool)
+                      else str(value).lower() for value in row]
+                     for row in chunk)
+    return buffer.getvalue()
+
+
+# Import
+# ------
+# Readers turn an import's lines of text into (line number, item), where
+# the item is a dict of the row's values, or, if the line can't be read,
+# the error message
+def read_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield number, 'Invalid JSON'
+            continue
+        yield number, (item if isinstance(item, dict)
+                       else 'Expected a JSON object')
+
+
+def read_csv(lines):
+    """The first row names the columns (an export's header does).
+    Missing cells and cells beyond the header are left out of the item.
+    """
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, {name: value for name, value in row.items()
+                                if name is not None and value is not None}
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+
+def validate(item):
+    """Returns (values, None) for a valid item, where values is a (name,
+    completed, created_date) row for `models.insert_todos()`, or (None,
+    error_message).
+
+    These are the rules of `resources.todos.set_reqparser()`, with the
+    same messages, worked through directly: reqparse takes about 25us an
+    item, which would be most of the time an import takes. (Where reqparse
+    would let a null `name` or `completed` through, this rejects it: the
+    database would refuse it anyway.) `created_date` is optional, in ISO
+    8601 format, and defaults to now.
+    """
+    if 'name' not in item:
+        return None, {'name': 'No todo name provided'}
+    name = _first(item['name'])
+    if name is None:
+        return None, {'name': 'No todo name provided'}
+
+    completed = _first(item.get('completed', False))
+    if isinstance(completed, str):
+        completed = _BOOLEANS.get(completed.lower())
+    if not isinstance(completed, bool):
+        return None, {'completed': 'Invalid value for complete'}
+
+    created_date = item.get('created_date')
+    if created_date is None or created_date == '':
+        created_date = datetime.datetime.now()
+    else:
+        try:
+            created_date = datetime.datetime.fromisoformat(created_date)
+        except (TypeError, ValueError):
+            return None, {'created_date': 'Invalid date'}
+        if created_date.tzinfo is not None:
+            return None, {'created_date': 'Invalid date'}
+
+    return (name if isinstance(name, str) else str(name),
+            completed, created_date), None
+
+
+# (what `flask_restful.inputs.boolean` accepts)
+_BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def _first(value):
+    # (reqparse reads the first of a list of values)
+    return value[0] if isinstance(value, list) and value else value
+
+
+def import_todos(items, on_commit=None):
+    """Import (line number, item) pairs from a reader, yielding the
+    `Progress` after every `config.IMPORT_CHUNK_SIZE` rows, and once more
+    at the end.
+
+    Each chunk is inserted in one write transaction (taking turns between
+    the shards, like single creates), so memory stays flat however big the
+    import, and the write lock is never held for long. Rows that fail
+    validation are counted and skipped; the rest of the import carries on.
+    `on_commit(ids, rows)` is called after each chunk has committed.
+
+    Text that can't be decoded (a UnicodeDecodeError from `items`) ends
+    the import there, with the rows before it imported.
+    """
+    chunk_size = config.IMPORT_CHUNK_SIZE
+    lines = imported = rejected = 0
+    errors = []
+    chunk = []
+
+    def reject(number, message):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < config.IMPORT_MAX_ERRORS:
+            errors.append({'line': number, 'message': message})
+
+    def commit():
+        with models.using_shard(models.next_shard()):
+            with models.write_transaction():
+                ids = models.insert_todos(chunk)
+        if on_commit is not None:
+            on_commit(ids, chunk)
+        return len(ids)
+
+    try:
+        for number, item in items:
+            lines = number
+            values, error = ((None, item) if isinstance(item, str)
+                             else validate(item))
+            if error is not None:
+                reject(number, error)
+                continue
+            chunk.append(values)
+            if len(chunk) >= chunk_size:
+                imported += commit()
+                chunk = []
+                yield Progress(lines, imported, rejected, errors)
+    except UnicodeDecodeError:
+        reject(lines + 1, 'Invalid UTF-8: the import stopped here')
+
+    if chunk:
+        imported += commit()
+    yield Progress(lines, imported, rejected, errors)
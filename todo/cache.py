@@ -0,0 +1,286 @@
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+
+# A serialised response, ready to send: the body bytes, the mimetype and
+# any extra headers (as a tuple of (name, value) pairs)
+CachedResponse = collections.namedtuple(
+    'CachedResponse', ['body', 'mimetype', 'headers']
+)
+
+
+# The configured backend (see `initialize()`). None means caching is off.
+CACHE = None
+
+
+# Backends
+# --------
+class CacheBackend:
+    """The storage interface the todo resources cache through.
+
+    Entries are keyed on the repository's version (see `item_key()` and
+    `collection_key()`), which every write bumps, whichever process made
+    it: an entry for an older version is simply never read again, and ages
+    out of the LRU. So there is nothing to invalidate, and every process
+    agrees with the database (and with the ETags) on what is current.
+
+    Subclasses implement the storage; the hit/miss/eviction counters are
+    kept here.
+    """
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def stats(self):
+        """{'hits': ..., 'misses': ..., 'evictions': ..., 'expirations':
+        ..., 'entries': ..., 'bytes': ...}
+        """
+        with self._stats_lock:
+            stats = {name: self._stats[name] for name in
+                     ('hits', 'misses', 'evictions', 'expirations')}
+        stats.update(self.usage())
+        return stats
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def usage(self):
+        """{'entries': ..., 'bytes': ...}"""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """A bounded LRU held in this process. Entries expire `ttl` seconds
+    after they are stored, and the least recently used entries are evicted
+    once there are more than `max_entries` of them or their bodies add up
+    to more than `max_bytes`.
+
+    Each process has its own, so with several worker processes each one
+    caches its own copy of the same entries.
+    """
+
+    def __init__(self, max_entries, max_bytes, max_entry_bytes, ttl,
+                 clock=time.monotonic):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (expires, value)
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                self.count('expirations')
+                entry = None
+            if entry is None:
+                self.count('misses')
+                return None
+            self._entries.move_to_end(key)
+        self.count('hits')
+        return entry[1]
+
+    def set(self, key, value):
+        size = len(value.body)
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.count('evictions')
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def usage(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes}
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value.body)
+
+
+class SqliteBackend(CacheBackend):
+    """A stand-in for a shared cache server: the entries live in a local
+    SQLite file, so every worker process on the box shares the same
+    entries. Same bounds and TTL as `MemoryBackend`
+    (times are wall clock, since they are compared across processes).
+    """
+
+    def __init__(self, filename, max_entries, max_bytes, max_entry_bytes,
+                 ttl, clock=time.time):
+        super().__init__()
+        self.filename = filename
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entry ('
+                ' key TEXT PRIMARY KEY, value BLOB NOT NULL,'
+                ' size INTEGER NOT NULL, expires REAL NOT NULL,'
+                ' accessed REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS entry_accessed'
+                         ' ON entry (accessed)')
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=5)
+            conn.execute('PRAGMA journal_mode=wal')
+            conn.execute('PRAGMA synchronous=normal')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        now = self.clock()
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT value, expires FROM entry WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and row[1] <= now:
+                conn.execute('DELETE FROM entry WHERE key = ?', (key,))
+                self.count('expirations')
+                row = None
+            if row is None:
+                self.count('misses')
+                return None
+            conn.execute('UPDATE entry SET accessed = ? WHERE key = ?',
+                         (now, key))
+        self.count('hits')
+        return decode_response(row[0])
+
+    def set(self, key, value):
+        size = len(value.body)
+        if size > self.max_entry_bytes:
+            return
+        now = self.clock()
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entry'
+                ' (key, value, size, expires, accessed)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (key, encode_response(value), size, now + self.ttl, now)
+            )
+            entries, total = conn.execute(
+                'SELECT COUNT(*), TOTAL(size) FROM entry').fetchone()
+            while entries > self.max_entries or total > self.max_bytes:
+                oldest, size = conn.execute(
+                    'SELECT key, size FROM entry ORDER BY accessed LIMIT 1'
+                ).fetchone()
+                conn.execute('DELETE FROM entry WHERE key = ?', (oldest,))
+                entries, total = entries - 1, total - size
+                self.count('evictions')
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM entry WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM entry')
+
+    def usage(self):
+        entries, total = self._connection().execute(
+            'SELECT COUNT(*), TOTAL(size) FROM entry').fetchone()
+        return {'entries': entries, 'bytes': int(total)}
+
+
+# Helper Functions
+# ----------------
+def encode_response(value):
+    """CachedResponse -> bytes, for backends that store bytes. The body
+    follows a one line JSON header, so it is never re-encoded.
+    """
+    header = json.dumps([value.mimetype, list(value.headers)])
+    return header.encode('utf-8') + b'\n' + value.body
+
+
+def decode_response(data):
+    header, body = bytes(data).split(b'\n', 1)
+    mimetype, headers = json.loads(header.decode('utf-8'))
+    return CachedResponse(body, mimetype, tuple(map(tuple, headers)))
+
+
+def make_backend():
+    """Build the backend selected by `config.CACHE_BACKEND`"""
+    bounds = dict(
+        max_entries=config.CACHE_MAX_ENTRIES,
+        max_bytes=config.CACHE_MAX_BYTES,
+        max_entry_bytes=config.CACHE_MAX_ENTRY_BYTES,
+        ttl=config.CACHE_TTL,
+    )
+    if config.CACHE_BACKEND == 'memory':
+        return MemoryBackend(**bounds)
+    if config.CACHE_BACKEND == 'sqlite':
+        return SqliteBackend(config.CACHE_FILENAME, **bounds)
+    raise ValueError(
+        'Unknown CACHE_BACKEND: {!r}'.format(config.CACHE_BACKEND)
+    )
+
+
+def initialize():
+    """(Re)build `CACHE` from the config. Like `models.initialize()` this
+    reads the config when it is called, so the tests can change it first.
+    """
+    global CACHE
+    CACHE = make_backend() if config.CACHE_ENABLED else None
+
+
+def item_key(version, todo_id):
+    """The key for todo `todo_id` as of `version` (the repository's
+    `version(todo_id)`)
+    """
+    return 'todo:{}:{}'.format(version, todo_id)
+
+
+def collection_key(version, *parts):
+    """The key for a collection response that depends on `parts`, as of
+    `version` (the repository's `version()`)
+    """
+    return 'todos:{}:{!r}'.format(version, parts)
@@ -0,0 +1,187 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import config
+
+
+# One write to a todo: `seq` is the change's position in the log (1, 2,
+# ...), `op` is 'create', 'update' or 'delete', and `todo` is the
+# marshalled todo (just its id for a delete)
+Change = collections.namedtuple('Change', ['seq', 'op', 'todo'])
+
+
+class ChangeLog:
+    """The most recent `capacity` changes, in order, in a ring buffer.
+
+    The write paths `append()` to it once their write has committed, and
+    each `GET /api/v1/todos/changes` stream reads from it (waiting on the
+    condition for new changes), resuming after whichever sequence number
+    the client last saw. A client that has fallen further behind than the
+    buffer reaches has to reload the collection instead.
+
+    The log lives in this process, so it only sees the writes this process
+    makes: with several worker processes, each has a log of its own. Its
+    `boot_id` (random, and new with every log) tells the logs apart, so
+    that a client can't resume from one log's sequence numbers in another
+    (see `resume_seq()`).
+    """
+
+    def __init__(self, capacity):
+        self.boot_id = os.urandom(6).hex()
+        self._changes = collections.deque(maxlen=capacity)
+        self._condition = threading.Condition()
+        self._seq = 0
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def append(self, op, todo):
+        with self._condition:
+            self._seq += 1
+            change = Change(self._seq, op, todo)
+            self._changes.append(change)
+            self._condition.notify_all()
+        return change
+
+    def extend(self, op, todos):
+        """`append()` a change for each of `todos`, taking the lock (and
+        waking the streams) once
+        """
+        with self._condition:
+            for todo in todos:
+                self._seq += 1
+                self._changes.append(Change(self._seq, op, todo))
+            self._condition.notify_all()
+
+    def since(self, seq):
+        """The changes after `seq`, or None if some of them have already
+        dropped out of the buffer (or `seq` is from the future: a log from
+        before a restart)
+        """
+        with self._condition:
+            if seq > self._seq:
+                return None
+            if seq == self._seq:
+                return []
+            if not self._changes or self._changes[0].seq > seq + 1:
+                return None
+            # the sequence numbers are consecutive, so the position of the
+            # first change we want follows from the oldest one held
+            start = seq + 1 - self._changes[0].seq
+            return [self._changes[i]
+                    for i in range(start, len(self._changes))]
+
+    def wait(self, seq, timeout):
+        """Block until there are changes after `seq`, or `timeout`
+        seconds have passed. Returns whether there are.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._seq != seq,
+                                            timeout)
+
+
+# The log every write path appends to (see `record()`)
+LOG = ChangeLog(config.CHANGES_BUFFER_SIZE)
+
+
+# Helper Functions
+# ----------------
+def initialize():
+    """Start a new, empty `LOG` (sized from the config as it is now). A
+    forked worker does this too, so that its log has a boot id of its own.
+    """
+    global LOG
+    LOG = ChangeLog(config.CHANGES_BUFFER_SIZE)
+
+
+def record(op, todo):
+    """Add a change to `LOG`, unless the change feed is off
+    (`config.CHANGES_ENABLED`). `todo` is the marshalled todo, or for a
+    delete, the todo's id.
+    """
+    if not config.CHANGES_ENABLED:
+        return None
+    if op == 'delete':
+        todo = {'id': todo}
+    return LOG.append(op, todo)
+
+
+def record_many(op, todos):
+    """`record()` for many changes with the same `op` at once (`todos`
+    can be a generator: it isn't consumed while the feed is off)
+    """
+    if not config.CHANGES_ENABLED:
+        return
+    if op == 'delete':
+        todos = ({'id': todo_id} for todo_id in todos)
+    LOG.extend(op, todos)
+
+
+def event_id(log, seq):
+    """An event's id: the log's boot id and the sequence number"""
+    return '{}-{}'.format(log.boot_id, seq)
+
+
+def resume_seq(last_event_id, log=None):
+    """The sequence number to resume after, from a client's
+    Last-Event-ID, or None if the id isn't from this log (it is another
+    worker's, or from before a restart), so the client has to start
+    again. Raises ValueError for an id of this log that makes no sense.
+    """
+    log = LOG if log is None else log
+    boot_id, _, seq = last_event_id.rpartition('-')
+    if boot_id != log.boot_id:
+        return None
+    seq = int(seq)
+    if seq < 0:
+        raise ValueError('Invalid event id: {!r}'.format(last_event_id))
+    return seq
+
+
+def format_event(change, log):
+    """A change (from `log`) as a Server-Sent Event"""
+    data = json.dumps({'seq': change.seq, 'op': change.op,
+                       'todo': change.todo})
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        event_id(log, change.seq), change.op, data)
+
+
+def stream(last_seq, log=None, clock=time.monotonic):
+    """The event stream text, as a generator, for a client that has seen
+    every change up to `last_seq` (None for a client that has to start
+    again, see `resume_seq()`).
+
+    The stream ends after `config.CHANGES_STREAM_SECONDS` (an EventSource
+    reconnects by itself, sending Last-Event-ID), so a client doesn't hold
+    a server thread indefinitely. While there is nothing to send, a comment
+    line goes out every `config.CHANGES_HEARTBEAT_SECONDS` to keep proxies
+    from closing the connection.
+    """
+    log = LOG if log is None else log
+    deadline = clock() + config.CHANGES_STREAM_SECONDS
+    # how long the client should wait before reconnecting (in ms)
+    yield 'retry: {}\n\n'.format(config.CHANGES_RETRY_MS)
+
+    while True:
+        changes = None if last_seq is None else log.since(last_seq)
+        if changes is None:
+            # the client is too far behind (or has an id from another
+            # log): it has to reload everything, and can then carry on
+            # from the latest change
+            last_seq = log.last_seq
+            yield 'id: {}\nevent: reset\ndata: {{}}\n\n'.format(
+                event_id(log, last_seq))
+        elif changes:
+            last_seq = changes[-1].seq
+            yield ''.join(format_event(change, log) for change in changes)
+
+        remaining = deadline - clock()
+        if remaining <= 0:
+            return
+        if not log.wait(last_seq,
+                        min(remaining, config.CHANGES_HEARTBEAT_SECONDS)):
+            yield ': keep-alive\n\n'
@@ -0,0 +1,117 @@
+import gzip
+import zlib
+
+from flask import request
+
+import config
+
+try:
+    import brotli
+except ImportError:  # optional: brotli is only used if it is installed
+    brotli = None
+
+
+# Content codings we can produce, best (smallest) first
+ENCODINGS = (('br',) if brotli is not None else ()) + ('gzip', 'deflate')
+
+# The codings responses are compressed with on the fly (which needs a
+# streaming compressor: zlib's)
+RESPONSE_ENCODINGS = ('gzip', 'deflate')
+
+# Responses worth compressing on the fly. Not text/event-stream: each event
+# has to reach the client as soon as it is sent.
+RESPONSE_TYPES = ('application/json', 'application/x-ndjson', 'text/plain',
+                  'text/html', 'text/css', 'application/javascript')
+
+# zlib's wbits for each coding (+16: a gzip header and trailer)
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+# Helper Functions
+# ----------------
+def compress(data, encoding, level=9):
+    """`data` (bytes) compressed with the content coding `encoding`"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level + 2, 11))
+    if encoding == 'gzip':
+        # mtime=0 so the same input always gives the same bytes
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'deflate':
+        return zlib.compress(data, level)
+    raise ValueError('Unknown content coding: {!r}'.format(encoding))
+
+
+def best_encoding(accept_encodings, available):
+    """Of the content codings `available`, the one to send a client whose
+    Accept-Encoding header parsed to `accept_encodings` (werkzeug's
+    `request.accept_encodings`), or None for the plain body. Codings are
+    tried in the order given, so list the best first.
+    """
+    for encoding in available:
+        if accept_encodings[encoding]:  # its q-value (0 if not accepted)
+            return encoding
+    return None
+
+
+def compress_stream(chunks, encoding, level):
+    """Compress an iterable of chunks (str or bytes) as it goes, flushing
+    after each one so the client gets every chunk when it is sent
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield (compressor.compress(chunk)
+                       + compressor.flush(zlib.Z_SYNC_FLUSH))
+        yield compressor.flush()
+    finally:
+        # e.g. stream_with_context, so the request context is torn down
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    """An `after_request` hook compressing API responses (the static files
+    are precompressed, see assets.py) for clients that accept it: streamed
+    bodies always, others once they are `config.COMPRESS_MIN_BYTES` or
+    more.
+    """
+    if (not config.COMPRESS_RESPONSES
+            or request.method == 'HEAD'
+            or not 200 <= response.status_code < 300
+            or response.status_code == 204
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in RESPONSE_TYPES):
+        return response
+
+    if not response.is_streamed and (
+            len(response.get_data()) < config.COMPRESS_MIN_BYTES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = best_encoding(request.accept_encodings, RESPONSE_ENCODINGS)
+    if encoding is None:
+        return response
+
+    level = config.COMPRESS_LEVEL
+    if response.is_streamed:
+        response.response = compress_stream(
+            response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compress(response.get_data(), encoding, level))
+    response.headers['Content-Encoding'] = encoding
+
+    # the compressed bytes are a different representation, but the same
+    # content: keep the tag, weakened (conditional requests compare weakly)
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -5,3 +5,171 @@ SECRET_KEY = 'GWK~M$F2"|[|i|,KEJWxvA5~JQN!}fUz>|&h`>g.K2/p)%t3%4P:tuR6G6A'
 DEFAULT_RATE = "100/hour"
 API_URL_PREFIX = '/api/v1'
 DATABASE_FILENAME = 'todo.sqlite'
+# Spread the todos over this many SQLite files (DATABASE_FILENAME, then
+# 'todo.shard1.sqlite', ...), each with its own write lock (see models.py).
+# A database can't be re-sharded in place, so this is fixed once it has
+# todos.
+DATABASE_SHARDS = 1
+# Where the todos are kept (see storage.py): 'sqlite', or 'memory' for a
+# compact in-process store that is lost on restart and not shared between
+# worker processes. Search, delta sync, batch writes and bulk import and
+# export need 'sqlite' (with 'memory' they answer 501).
+STORAGE_BACKEND = 'sqlite'
+
+# Collection pagination
+# (`GET /api/v1/todos?limit=<n>&after=<cursor>`; when no `limit` is given
+# the whole collection is streamed in chunks of STREAM_CHUNK_SIZE rows)
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+
+# Batch writes (`POST /api/v1/todos/batch`)
+MAX_BATCH_SIZE = 1000
+# rows per INSERT/UPDATE/DELETE statement. Keeps us comfortably below
+# SQLite's host parameter limit (999 on older builds)
+BATCH_CHUNK_SIZE = 100
+
+# Group commit (writes.py): single todo writes from concurrent requests are
+# queued to one writer thread, which commits up to GROUP_COMMIT_MAX_OPS of
+# them per transaction, waiting up to GROUP_COMMIT_MAX_WAIT_MS after the
+# first for more to arrive. Off by default.
+GROUP_COMMIT = False
+GROUP_COMMIT_MAX_OPS = 64
+GROUP_COMMIT_MAX_WAIT_MS = 0
+# the writer closes its connection after this long without writes
+GROUP_COMMIT_IDLE_SECONDS = 1
+
+# Database connections
+# 'sqlite' opens a connection per request; 'pooled' reuses connections
+# from a pool of at most DATABASE_MAX_CONNECTIONS
+DATABASE_BACKEND = 'sqlite'
+DATABASE_MAX_CONNECTIONS = 16
+# seconds before an idle pooled connection is recycled
+DATABASE_STALE_TIMEOUT = 300
+# seconds to wait for a free pooled connection (None waits forever)
+DATABASE_POOL_TIMEOUT = 10
+
+# SQLite pragmas, applied to every connection by `models.initialize()`.
+# DATABASE_PROFILE names one of the DATABASE_PROFILES below.
+#
+# 'performance' uses write-ahead logging, so readers are never blocked by
+# a writer (and vice versa), with synchronous=NORMAL (in WAL mode this only
+# fsyncs at checkpoints, and is still safe against corruption), a 64MiB
+# page cache, 256MiB of memory-mapped I/O, in-memory temp tables and a busy
+# timeout so that concurrent writers wait for the lock rather than fail.
+DATABASE_PROFILE = 'performance'
+DATABASE_PROFILES = {
+    'default': {},
+    'performance': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -64 * 1024,  # negative means KiB rather than pages
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 5000,  # ms
+        'temp_store': 'memory',
+    },
+}
+
+# Read cache (see cache.py)
+# 'memory' is a per-process LRU; 'sqlite' keeps the entries in
+# CACHE_FILENAME so that every worker process on the host shares them
+CACHE_ENABLED = False
+CACHE_BACKEND = 'memory'
+CACHE_FILENAME = 'cache.sqlite'
+CACHE_TTL = 60  # seconds
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# responses bigger than this are served (or streamed) but not cached
+CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+
+# Serialise collections with the compiled serializer (serializers.py)
+# rather than flask_restful's `marshal()`. The output is identical.
+FAST_SERIALIZER = True
+# Encode JSON with orjson when it is installed (the output is the same,
+# except that non-ASCII characters aren't escaped)
+FAST_JSON = True
+
+# Request and query metrics, served at /metrics (see metrics.py)
+METRICS_ENABLED = False
+# queries slower than this (in seconds) are counted and logged
+METRICS_SLOW_QUERY_SECONDS = 0.1
+# a request running the same SQL this many times is flagged as an N+1
+METRICS_N_PLUS_ONE_THRESHOLD = 10
+
+# ASGI serving mode (asgi.py)
+# requests are handed to a pool of at most ASGI_THREADS threads, which is
+# therefore also the most requests (and database connections) in flight
+# at once; idle and keep-alive connections don't take a thread
+ASGI_THREADS = 16
+
+# Production launcher (serve.py)
+# worker processes; None means one per CPU
+WORKERS = None
+# a worker is replaced after serving this many requests (0 for never),
+# plus a random 0..WORKER_MAX_REQUESTS_JITTER so they don't all go at once
+WORKER_MAX_REQUESTS = 10000
+WORKER_MAX_REQUESTS_JITTER = 1000
+# seconds workers get to finish their requests when stopping
+GRACEFUL_TIMEOUT = 30
+LISTEN_BACKLOG = 1024
+
+# Rate limiting (limits.py)
+# with RATE_LIMIT_ENABLED, each client (by IP address) gets DEFAULT_RATE
+# API requests, as a token bucket: bursts of up to the limit, refilled
+# steadily over the period. RATE_LIMITS overrides it for some endpoints,
+# each of which then has a bucket of its own, e.g.
+# {'resources.todos.todos_batch': '10/minute'}. Rates are '<n>/<unit>',
+# '<n> per <unit>' or '<n>/<m> <unit>s' (second, minute, hour or day).
+RATE_LIMIT_ENABLED = False
+RATE_LIMITS = {}
+# 'sqlite' keeps the buckets in RATE_LIMIT_FILENAME, shared by every worker
+# process on the host; 'memory' keeps them per process
+RATE_LIMIT_BACKEND = 'sqlite'
+RATE_LIMIT_FILENAME = 'ratelimit.sqlite'
+
+# Load shedding (limits.py)
+# API requests get a 503 rather than queueing while this process is
+# already handling SHED_MAX_IN_FLIGHT of them, or while SQL statements have
+# recently been taking more than SHED_MAX_DB_WAIT_MS on average. None
+# turns either check off. Clients are told to retry after SHED_RETRY_AFTER
+# seconds.
+SHED_MAX_IN_FLIGHT = None
+SHED_MAX_DB_WAIT_MS = None
+SHED_RETRY_AFTER = 1
+
+# Change feed (`GET /api/v1/todos/changes`, see changes.py)
+# off by default: every open stream holds a server thread (a whole
+# `serve.py` worker, or one of the ASGI_THREADS) for up to
+# CHANGES_STREAM_SECONDS, so only turn it on with threads to spare for
+# every open page. The web app only connects while it is on.
+CHANGES_ENABLED = False
+# how many recent changes a reconnecting client can resume from
+CHANGES_BUFFER_SIZE = 10000
+# each stream ends after this many seconds, and the client reconnects
+# (after CHANGES_RETRY_MS), so no client holds a server thread for long
+CHANGES_STREAM_SECONDS = 60
+CHANGES_RETRY_MS = 1000
+CHANGES_HEARTBEAT_SECONDS = 15
+
+# Delta sync (`GET /api/v1/todos?since=<version>`)
+# seconds a deleted todo's tombstone is kept; a client that last synced
+# longer ago than this has to reload the whole collection
+TOMBSTONE_RETENTION = 30 * 24 * 60 * 60
+# how often (in seconds) deletes check for tombstones to compact
+TOMBSTONE_COMPACT_INTERVAL = 60 * 60
+
+# Compression (see compression.py and assets.py)
+# bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = 512
+# compress API responses on the fly, at this zlib level (1-9)
+COMPRESS_RESPONSES = True
+COMPRESS_LEVEL = 6
+# how long (in seconds) browsers may cache fingerprinted static files
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# Bulk import and export (`POST /api/v1/todos/import`, `GET
+# /api/v1/todos/export` and `manage.py import/export`, see bulk.py)
+# rows inserted per transaction. Each transaction holds the write lock
+# while it runs, so this also bounds how long other writers wait.
+IMPORT_CHUNK_SIZE = 5000
+# an import reports at most this many rejected rows (it counts them all)
+IMPORT_MAX_ERRORS = 100
@@ -0,0 +1,336 @@
+import collections
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from flask import Response, g, request
+
+import config
+import models
+import serializers
+
+
+# A rate: at most `limit` requests per `period` seconds
+Rate = collections.namedtuple('Rate', ['limit', 'period'])
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 60 * 60, 'day': 24 * 60 * 60}
+
+_RATE = re.compile(r'^\s*(\d+)\s*(?:/|per)\s*(\d*)\s*'
+                   r'(second|minute|hour|day)s?\s*$', re.IGNORECASE)
+
+# The configured limiter and shedder (see `initialize()`). None means off.
+LIMITER = None
+SHEDDER = None
+
+
+# Bucket Stores
+# -------------
+# Rates are enforced as token buckets: a bucket holds up to `limit`
+# tokens, every request takes one, and it refills steadily at `limit`
+# tokens per `period`. So a client can burst up to the limit, and after
+# that gets the rate and no more.
+def refill(tokens, updated, rate, now):
+    """How many tokens a bucket that held `tokens` at time `updated` has
+    at time `now`
+    """
+    return min(rate.limit,
+               tokens + max(0.0, now - updated) * rate.limit / rate.period)
+
+
+def take(tokens):
+    """(allowed, tokens left) for a request against a bucket holding
+    `tokens`
+    """
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+class MemoryBuckets:
+    """The buckets, held in this process. Each process has its own, so
+    with several worker processes each enforces the rate on its own.
+    """
+
+    def __init__(self, clock=time.monotonic, max_buckets=100000):
+        self.clock = clock
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, updated, period)
+
+    def hit(self, key, rate):
+        """Take a token from bucket `key`. Returns (allowed, tokens
+        left).
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = (rate.limit if bucket is None
+                      else refill(bucket[0], bucket[1], rate, now))
+            allowed, tokens = take(tokens)
+            self._buckets[key] = (tokens, now, rate.period)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now):
+        # buckets untouched for a whole period (of their own rate) are
+        # full again, which is the same as having no bucket at all
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if now - bucket[1] < bucket[2]}
+
+
+class SqliteBuckets:
+    """The buckets in a local SQLite file, so that every worker process on
+    the host takes from the same ones (times are wall clock, since they
+    are compared across processes). Each hit is one short IMMEDIATE
+    transaction: read the bucket, write it back.
+    """
+
+    def __init__(self, filename, clock=time.time, prune_every=1000):
+        self.filename = filename
+        self.clock = clock
+        self.prune_every = prune_every
+        self._hits = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS bucket ('
+                ' key TEXT PRIMARY KEY, tokens REAL NOT NULL,'
+                ' updated REAL NOT NULL, period REAL NOT NULL)'
+            )
+            columns = [row[1] for row in
+                       conn.execute('PRAGMA table_info(bucket)')]
+            if 'period' not in columns:
+                # a file from before buckets kept their rate's period:
+                # keep its buckets for a day (the longest unit)
+                conn.execute('ALTER TABLE bucket ADD COLUMN period REAL'
+                             ' NOT NULL DEFAULT {}'.format(PERIODS['day']))
+
+    def _connection(self):
+        # (as `cache.SqliteBackend`: per thread, and per process)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.filename, timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=wal')
+            conn.execute('PRAGMA synchronous=normal')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def hit(self, key, rate):
+        now = self.clock()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM bucket'
+                               ' WHERE key = ?', (key,)).fetchone()
+            tokens = (rate.limit if row is None
+                      else refill(row[0], row[1], rate, now))
+            allowed, tokens = take(tokens)
+            conn.execute('INSERT OR REPLACE INTO bucket'
+                         ' (key, tokens, updated, period) VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, rate.period))
+            self._hits += 1
+            if self._hits % self.prune_every == 0:
+                # (each bucket by its own rate's period, as MemoryBuckets)
+                conn.execute('DELETE FROM bucket WHERE updated + period < ?',
+                             (now,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, tokens
+
+
+# Rate Limiter
+# ------------
+def parse_rate(text):
+    """'100/hour' (or '100 per hour', '10/5 minutes', ...) -> Rate(100,
+    3600). Raises ValueError for anything else.
+    """
+    match = _RATE.match(text)
+    if match is None:
+        raise ValueError('Invalid rate: {!r}'.format(text))
+    limit, multiple, unit = match.groups()
+    period = int(multiple or 1) * PERIODS[unit.lower()]
+    if int(limit) < 1 or period < 1:
+        raise ValueError('Invalid rate: {!r}'.format(text))
+    return Rate(int(limit), period)
+
+
+class RateLimiter:
+    """Per-client rate limits: `default` (a rate string) for every
+    endpoint, except those in `overrides` ({endpoint: rate string}), which
+    each get a bucket of their own
+    """
+
+    def __init__(self, store, default, overrides=None):
+        self.store = store
+        self.default = parse_rate(default)
+        self.overrides = {endpoint: parse_rate(rate)
+                          for endpoint, rate in (overrides or {}).items()}
+
+    def hit(self, client, endpoint):
+        """Count a request. Returns (allowed, rate, tokens left)."""
+        if endpoint in self.overrides:
+            scope, rate = endpoint, self.overrides[endpoint]
+        else:
+            scope, rate = '*', self.default
+        allowed, tokens = self.store.hit(
+            '{}|{}'.format(client, scope), rate)
+        return allowed, rate, tokens
+
+
+def retry_after(rate, tokens):
+    """Whole seconds until a bucket holding `tokens` has one to take"""
+    return max(1, math.ceil((1 - tokens) * rate.period / rate.limit))
+
+
+# Load Shedder
+# ------------
+# recent statement times decay by half every this many seconds without
+# new ones (so that shedding stops once the database has recovered, even
+# though shedding means fewer statements to measure)
+DB_WAIT_HALF_LIFE = 1.0
+# how much each statement moves the average
+DB_WAIT_WEIGHT = 0.2
+
+
+class LoadShedder:
+    """Admission control: turns requests away (rather than letting them
+    queue) while `max_in_flight` requests are already being handled by
+    this process, or while statements have recently been taking longer
+    than `max_db_wait` seconds on average (which is how SQLite lock
+    contention shows: writers wait in the busy handler). Either bound can
+    be None.
+    """
+
+    def __init__(self, max_in_flight=None, max_db_wait=None,
+                 clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_db_wait = max_db_wait
+        self.clock = clock
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._db_wait = 0.0
+        self._db_wait_at = clock()
+
+    def admit(self):
+        """Count a request in, returning None, or, if it should be shed,
+        the reason why (and it isn't counted)
+        """
+        if (self.max_db_wait is not None
+                and self.db_wait() > self.max_db_wait):
+            return 'The database is overloaded'
+        with self._lock:
+            if (self.max_in_flight is not None
+                    and self.in_flight >= self.max_in_flight):
+                return 'Too many requests in progress'
+            self.in_flight += 1
+        return None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def db_wait(self):
+        """The decayed average statement time, in seconds"""
+        with self._lock:
+            return self._decayed(self.clock())
+
+    def record_query(self, sql, seconds):
+        """Registered in `models.QUERY_HOOKS` (see `initialize()`)"""
+        with self._lock:
+            now = self.clock()
+            self._db_wait = self._decayed(now)
+            self._db_wait += DB_WAIT_WEIGHT * (seconds - self._db_wait)
+            self._db_wait_at = now
+
+    def _decayed(self, now):
+        elapsed = now - self._db_wait_at
+        return self._db_wait * 0.5 ** (elapsed / DB_WAIT_HALF_LIFE)
+
+
+# Hooks
+# -----
+# Registered on the API blueprint (see app.py), ahead of the database
+# connection, so a request that is turned away never takes one
+def error_response(status, message, seconds, headers=()):
+    response = Response(serializers.dumps({'message': message}),
+                        status=status, mimetype='application/json',
+                        headers=list(headers))
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+
+def before_request():
+    if SHEDDER is not None:
+        reason = SHEDDER.admit()
+        if reason is not None:
+            return error_response(503, reason, config.SHED_RETRY_AFTER)
+        g.limits_admitted = True
+
+    if LIMITER is not None:
+        allowed, rate, tokens = LIMITER.hit(request.remote_addr,
+                                            request.endpoint)
+        g.limits_headers = [('X-RateLimit-Limit', str(rate.limit)),
+                            ('X-RateLimit-Remaining', str(int(tokens)))]
+        if not allowed:
+            return error_response(
+                429, 'Rate limit exceeded: {} requests per {} seconds'
+                .format(rate.limit, rate.period),
+                retry_after(rate, tokens), g.limits_headers)
+
+
+def after_request(response):
+    for name, value in g.get('limits_headers', ()):
+        response.headers.setdefault(name, value)
+    return response
+
+
+def teardown_request(exception):
+    # (once a streamed response has been sent in full)
+    if g.pop('limits_admitted', False):
+        SHEDDER.release()
+
+
+# Helper Functions
+# ----------------
+def make_store():
+    """Build the bucket store selected by `config.RATE_LIMIT_BACKEND`"""
+    if config.RATE_LIMIT_BACKEND == 'memory':
+        return MemoryBuckets()
+    if config.RATE_LIMIT_BACKEND == 'sqlite':
+        return SqliteBuckets(config.RATE_LIMIT_FILENAME)
+    raise ValueError(
+        'Unknown RATE_LIMIT_BACKEND: {!r}'.format(config.RATE_LIMIT_BACKEND)
+    )
+
+
+def initialize():
+    """(Re)build `LIMITER` and `SHEDDER` from the config. Like
+    `cache.initialize()` this reads the config when it is called.
+    """
+    global LIMITER, SHEDDER
+    if SHEDDER is not None and SHEDDER.record_query in models.QUERY_HOOKS:
+        models.QUERY_HOOKS.remove(SHEDDER.record_query)
+
+    LIMITER = None
+    if config.RATE_LIMIT_ENABLED:
+        LIMITER = RateLimiter(make_store(), config.DEFAULT_RATE,
+                              config.RATE_LIMITS)
+
+    SHEDDER = None
+    if (config.SHED_MAX_IN_FLIGHT is not None
+            or config.SHED_MAX_DB_WAIT_MS is not None):
+        SHEDDER = LoadShedder(
+            config.SHED_MAX_IN_FLIGHT,
+            None if config.SHED_MAX_DB_WAIT_MS is None
+            else config.SHED_MAX_DB_WAIT_MS / 1000)
+        if SHEDDER.max_db_wait is not None:
+            # statements are only timed when something needs the times
+            models.QUERY_HOOKS.append(SHEDDER.record_query)
@@ -0,0 +1,163 @@
+"""Maintenance commands for the todo database.
+
+    python3 manage.py [--database FILE] [--shards N] rebuild-search
+    python3 manage.py [--database FILE] [--shards N] [--repair] check-stats
+    python3 manage.py [--database FILE] [--shards N] [--format FORMAT]
+                      import|export FILE
+
+rebuild-search      index every todo name again, from scratch (for a
+                    database whose full-text index is out of step, e.g.
+                    after its todo table was edited with the search
+                    triggers missing)
+check-stats         count the todos and compare the counts with the ones
+                    kept for `GET /api/v1/todos/stats`, listing the days
+                    that differ (and exiting with status 1); with
+                    --repair, count them into the stats again instead
+import FILE         create a todo for every row of FILE (NDJSON or CSV, as
+                    `POST /api/v1/todos/import` takes; '-' reads stdin),
+                    reporting progress, then the rows it rejected
+export FILE         write every todo to FILE (NDJSON or CSV, as `GET
+                    /api/v1/todos/export`; '-' writes to stdout)
+
+The format is --format, or else the FILE's extension ('.csv' is CSV,
+anything else NDJSON).
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+
+import bulk
+import config
+import models
+import storage
+
+
+# Commands
+# --------
+def rebuild_search(args):
+    count = 0
+    for shard in range(models.shard_count()):
+        with models.using_shard(shard), models.DATABASE.atomic():
+            models.rebuild_search_index()
+            count += models.Todo.select().count()
+    print('Indexed {} todos'.format(count))
+
+
+def check_stats(args):
+    differences = 0
+    for shard in range(models.shard_count()):
+        with models.using_shard(shard):
+            mismatches = models.check_stats()
+            for day, (kept, counted) in sorted(mismatches.items()):
+                print('{}{}: kept {} todos ({} completed), counted {} '
+                      '({} completed)'.format(
+                          'shard {}, '.format(shard)
+                          if models.shard_count() > 1 else '',
+                          'all days' if day == models.ALL_DAYS else day,
+                          *kept, *counted))
+            if mismatches and args.repair:
+                models.recount_stats()
+        differences += len(mismatches)
+    if not differences:
+        print('The stats match the todos')
+    elif args.repair:
+        print('Recounted the stats ({} differences)'.format(differences))
+    else:
+        return 1
+
+
+def import_todos(args):
+    with open_file(args.file, 'r') as lines:
+        for progress in bulk.import_todos(
+                bulk.READERS[file_format(args)](lines)):
+            print('\r{} lines read, {} imported, {} rejected'.format(
+                progress.lines, progress.imported, progress.rejected),
+                end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    for error in progress.errors:
+        print('line {line}: {message}'.format(**error), file=sys.stderr)
+    if progress.rejected > len(progress.errors):
+        print('(and {} more rejected)'.format(
+            progress.rejected - len(progress.errors)), file=sys.stderr)
+
+
+def export_todos(args):
+    columns = bulk.export_columns()
+    query = models.Todo.select().order_by(models.Todo.id)
+    # (the collection's own k-way merge of the shards)
+    rows = storage.fetch_rows(query, columns, [0], False)
+    with open_file(args.file, 'w') as output:
+        for chunk in bulk.export_rows(rows, file_format(args)):
+            output.write(chunk)
+
+
+COMMANDS = {
+    'rebuild-search': rebuild_search,
+    'check-stats': check_stats,
+    'import': import_todos,
+    'export': export_todos,
+}
+
+
+# Helper Functions
+# ----------------
+def file_format(args):
+    if args.format is not None:
+        return args.format
+    return 'csv' if os.path.splitext(args.file)[1] == '.csv' else 'ndjson'
+
+
+def open_file(filename, mode):
+    """`filename` as text, for `csv` (so without newline translation), or
+    stdin/stdout for '-'
+    """
+    if filename == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        return contextlib.nullcontext(stream)
+    return open(filename, mode, encoding='utf-8', newline='')
+
+
+# ----------------
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__.split('\n\n', 2)[2])
+    parser.add_argument('--database', default=config.DATABASE_FILENAME,
+                        help='SQLite database file')
+    parser.add_argument('--shards', type=int, default=config.DATABASE_SHARDS,
+                        help='how many shards the database is spread over')
+    parser.add_argument('--format', choices=sorted(bulk.FORMATS),
+                        help='file format for import and export')
+    parser.add_argument('--repair', action='store_true',
+                        help='for check-stats: recount the stats that differ')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('file', nargs='?',
+                        help='the file to import or export')
+    args = parser.parse_args(argv)
+    if args.command in ('import', 'export') and args.file is None:
+        parser.error('{} needs a FILE'.format(args.command))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    config.DATABASE_FILENAME = args.database
+    config.DATABASE_SHARDS = args.shards
+    # (which also brings the schema up to date)
+    models.initialize()
+    models.connect()
+    try:
+        # (the command's exit status, if not 0)
+        return COMMANDS[args.command](args) or 0
+    finally:
+        models.close_database()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
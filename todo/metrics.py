@@ -0,0 +1,272 @@
+import bisect
+import collections
+import logging
+import threading
+import time
+
+from flask import Response, abort, g, has_request_context, request
+
+import cache
+import config
+import models
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+# and of the queries-per-request histogram
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+
+# Metric Types
+# ------------
+# Each metric holds one series per combination of label values. Updating
+# a series takes one lock, so recording costs a few microseconds.
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = collections.defaultdict(float)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, dict(zip(self.labels, label_values)), value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [count per bucket (+Inf last), sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0
+                ]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (labels, (list(counts), total))
+                for labels, (counts, total) in self._values.items()
+            )
+        for label_values, (counts, total) in values:
+            labels = dict(zip(self.labels, label_values))
+            cumulative = 0
+            bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (self.name + '_bucket', dict(labels, le=bound),
+                       cumulative)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+# Metrics
+# -------
+REQUESTS = Counter(
+    'todo_http_requests_total', 'HTTP requests handled',
+    ('method', 'endpoint', 'status'))
+REQUEST_DURATION = Histogram(
+    'todo_http_request_duration_seconds',
+    'Time from the start of a request until its response was sent',
+    ('method', 'endpoint'))
+IN_FLIGHT = Gauge(
+    'todo_http_requests_in_flight', 'HTTP requests being handled')
+QUERIES = Counter(
+    'todo_db_queries_total', 'SQL statements executed', ('endpoint',))
+QUERY_DURATION = Histogram(
+    'todo_db_query_duration_seconds', 'Time to execute a SQL statement',
+    ('endpoint',))
+QUERIES_PER_REQUEST = Histogram(
+    'todo_db_queries_per_request', 'SQL statements executed per request',
+    ('endpoint',), buckets=QUERY_COUNT_BUCKETS)
+SLOW_QUERIES = Counter(
+    'todo_db_slow_queries_total',
+    'SQL statements slower than config.METRICS_SLOW_QUERY_SECONDS',
+    ('endpoint',))
+N_PLUS_ONE = Counter(
+    'todo_db_n_plus_one_total',
+    'Requests that ran the same SQL statement at least '
+    'config.METRICS_N_PLUS_ONE_THRESHOLD times',
+    ('endpoint',))
+
+REGISTRY = [REQUESTS, REQUEST_DURATION, IN_FLIGHT, QUERIES, QUERY_DURATION,
+            QUERIES_PER_REQUEST, SLOW_QUERIES, N_PLUS_ONE]
+
+
+# Hooks
+# -----
+def _endpoint():
+    # the url rule's endpoint rather than the path, so that every todo id
+    # is counted as the same endpoint
+    return request.endpoint or 'unmatched'
+
+
+def record_query(sql, seconds):
+    """Registered in `models.QUERY_HOOKS` by the first request handled
+    with metrics enabled (and removed by the first one handled with them
+    disabled again)
+    """
+    if not config.METRICS_ENABLED:
+        return
+    endpoint = _endpoint() if has_request_context() else 'none'
+    QUERIES.inc(endpoint)
+    QUERY_DURATION.observe(seconds, endpoint)
+
+    if seconds >= config.METRICS_SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.inc(endpoint)
+        logger.warning('Slow query (%.3fs) in %s: %s',
+                       seconds, endpoint, sql)
+
+    if has_request_context() and 'metrics_queries' in g:
+        g.metrics_queries[sql] += 1
+
+
+def before_request():
+    # the query hook is only there while metrics are actually on, so that
+    # with metrics off queries aren't even timed
+    if not config.METRICS_ENABLED:
+        if record_query in models.QUERY_HOOKS:
+            models.QUERY_HOOKS.remove(record_query)
+        return
+    if record_query not in models.QUERY_HOOKS:
+        models.QUERY_HOOKS.append(record_query)
+    g.metrics_start = time.perf_counter()
+    g.metrics_status = 500  # unless after_request says otherwise
+    g.metrics_queries = collections.Counter()
+    IN_FLIGHT.inc()
+
+
+def after_request(response):
+    if 'metrics_start' in g:
+        g.metrics_status = response.status_code
+    return response
+
+
+def teardown_request(exception):
+    """Runs once the response has been sent (for a streamed response, once
+    the stream is exhausted), so the duration covers the whole response
+    """
+    if 'metrics_start' not in g:
+        return
+    endpoint = _endpoint()
+    elapsed = time.perf_counter() - g.pop('metrics_start')
+    IN_FLIGHT.dec()
+    REQUESTS.inc(request.method, endpoint, str(g.metrics_status))
+    REQUEST_DURATION.observe(elapsed, request.method, endpoint)
+
+    queries = g.pop('metrics_queries')
+    QUERIES_PER_REQUEST.observe(sum(queries.values()), endpoint)
+    if not queries:
+        return
+    sql, repeats = queries.most_common(1)[0]
+    if repeats >= config.METRICS_N_PLUS_ONE_THRESHOLD:
+        N_PLUS_ONE.inc(endpoint)
+        logger.warning('Possible N+1: %s ran the same query %d times: %s',
+                       endpoint, repeats, sql)
+
+
+# Exposition
+# ----------
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _cache_samples():
+    if cache.CACHE is None:
+        return []
+    stats = cache.CACHE.stats()
+    return [
+        ('todo_cache_{}_total'.format(name), 'counter',
+         'Read cache {}'.format(name), stats[name])
+        for name in ('hits', 'misses', 'evictions', 'expirations')
+    ] + [
+        ('todo_cache_entries', 'gauge', 'Read cache entries',
+         stats['entries']),
+        ('todo_cache_bytes', 'gauge', 'Read cache size in bytes',
+         stats['bytes']),
+    ]
+
+
+def render():
+    """All the metrics, in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help_text))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            if labels:
+                name += '{' + ','.join(
+                    '{}="{}"'.format(key, _escape(label))
+                    for key, label in labels.items()
+                ) + '}'
+            lines.append('{} {}'.format(name, _format_value(value)))
+    for name, kind, help_text, value in _cache_samples():
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        lines.append('{} {}'.format(name, _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    if not config.METRICS_ENABLED:
+        abort(404)
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def reset():
+    """Forget everything recorded so far (for the tests)"""
+    for metric in REGISTRY:
+        with metric._lock:
+            metric._values.clear()
+
+
+def init_app(app):
+    """Register the request hooks and the `/metrics` route. Nothing is
+    recorded (and `/metrics` is a 404) unless `config.METRICS_ENABLED` is
+    set.
+    """
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -1,11 +1,109 @@
+import contextlib
 import datetime
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
 
-from peewee import *
+from peewee import (BooleanField, CharField, DatabaseProxy, DateTimeField,
+                    FloatField, IntegerField, Model, SqliteDatabase,
+                    TextField, fn)
 
 import config
 
 
-DATABASE = SqliteDatabase(None)
+logger = logging.getLogger(__name__)
+
+
+# The concrete database (plain or pooled, see `make_database()`, or with
+# `config.DATABASE_SHARDS` a `ShardRouter` over several) is only chosen
+# when `initialize()` runs, so the models are bound to a proxy
+DATABASE = DatabaseProxy()
+
+
+# Query Hooks
+# -----------
+# Functions called as `hook(sql, seconds)` after every statement the
+# database executes (e.g. by `metrics.py`). When there are none, executing
+# a statement costs no more than it would otherwise.
+QUERY_HOOKS = []
+
+
+class QueryHookMixin:
+
+    def execute_sql(self, sql, *args, **kwargs):
+        if not QUERY_HOOKS:
+            return super().execute_sql(sql, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in QUERY_HOOKS:
+                hook(sql, elapsed)
+
+
+class HookedSqliteDatabase(QueryHookMixin, SqliteDatabase):
+    pass
+
+
+# The pooled equivalent, built by `pooled_database_class()`
+HookedPooledSqliteDatabase = None
+
+
+def pooled_database_class():
+    """HookedPooledSqliteDatabase, built on first use. playhouse.pool (and
+    the sqlite extensions it imports) is only imported once pooling is
+    actually configured, which keeps it out of every worker's startup.
+    """
+    global HookedPooledSqliteDatabase
+    if HookedPooledSqliteDatabase is None:
+        from playhouse.pool import PooledSqliteDatabase
+
+        class HookedPooledSqliteDatabase(QueryHookMixin,
+                                         PooledSqliteDatabase):
+            pass
+    return HookedPooledSqliteDatabase
+
+
+# Sharding
+# --------
+# With `config.DATABASE_SHARDS` above 1, the todos are spread over that
+# many SQLite files (see `shard_filename()`), each a complete database of
+# its own, with its own write lock. A todo's id says which shard holds it
+# (`shard_of()`), so a request for one todo goes straight to its shard.
+class ShardRouter:
+    """Stands in for the database when it is sharded: everything asked of
+    it is passed on to the shard the current thread has selected with
+    `using_shard()`. Peewee only ever sees one shard at a time, so the
+    models and queries are the same as for a single database.
+    """
+
+    def __init__(self, shards):
+        self.shards = shards
+        self._local = threading.local()
+
+    @property
+    def current(self):
+        """The index of the current thread's shard, or None"""
+        return getattr(self._local, 'shard', None)
+
+    @contextlib.contextmanager
+    def use(self, shard):
+        previous = self.current
+        self._local.shard = shard
+        try:
+            yield self.shards[shard]
+        finally:
+            self._local.shard = previous
+
+    def __getattr__(self, attr):
+        shard = self.current
+        if shard is None:
+            raise RuntimeError('No shard selected (see models.using_shard())')
+        return getattr(self.shards[shard], attr)
 
 
 # Models
@@ -17,13 +115,372 @@ class Todo(Model):
     name = CharField()
     created_date = DateTimeField(default=datetime.datetime.now)
     completed = BooleanField(default=False)
+    # The todo table's `TableVersion` as of this row's last write (set by
+    # the triggers below), for delta syncs. Not part of the API's todo.
+    version = IntegerField(default=0)
 
     class Meta:
         database = DATABASE
 
+        # (completed, created_date) serves `?completed=...` filters
+        # sorted by created_date as an index range scan, and
+        # (created_date) serves the same sort without the filter. Indexes
+        # on a rowid table implicitly end with the id, so (completed) on
+        # its own serves the filter in the default id order, and all of
+        # them break ties the same way the keyset pagination does.
+        #
+        # (version) serves delta syncs (`?since=<version>`).
+        #
+        # `create_tables(safe=True)` in `initialize()` also adds these to
+        # existing databases.
+        indexes = (
+            (('completed', 'created_date'), False),
+            (('created_date',), False),
+            (('completed',), False),
+            (('version',), False),
+        )
+
+
+class TableVersion(Model):
+    """A counter per table that goes up by one with every row inserted,
+    updated or deleted (the triggers below keep it current, whichever code
+    path does the writing). Reading it is a single primary key lookup, so
+    it is a cheap way of telling whether anything has changed.
+    """
+    table = CharField(primary_key=True)
+    version = IntegerField(default=0)
+
+    class Meta:
+        database = DATABASE
+
+
+class Tombstone(Model):
+    """A deleted todo (recorded by the delete trigger below), so that
+    delta syncs can report the deletion. Tombstones are compacted once
+    they are older than `config.TOMBSTONE_RETENTION` seconds (see
+    `compact_tombstones()`).
+    """
+    todo_id = IntegerField(primary_key=True)
+    version = IntegerField(index=True)
+    deleted_at = IntegerField()  # unix time
+
+    class Meta:
+        database = DATABASE
+
+
+class TodoSearch(Model):
+    """The full-text index of todo names, for `?q=` searches: an FTS5
+    table, which `initialize()` creates (see `SEARCH_TABLE`) and the
+    triggers below keep in step with `todo`. Peewee only queries it.
+    """
+    rowid = IntegerField(primary_key=True)  # the todo's id
+    name = TextField()
+    # FTS5's relevance of a row to the search (its bm25 score: the lower,
+    # the better the match)
+    rank = FloatField()
+
+    class Meta:
+        database = DATABASE
+        table_name = 'todo_search'
+
+
+class TodoStats(Model):
+    """Running counts of the todos, so that `GET /api/v1/todos/stats`
+    never has to count rows: one row per day that todos were created on
+    (`day` is the date part of `created_date`, 'YYYY-MM-DD'), and one,
+    `ALL_DAYS`, for every todo. The triggers below keep them current, as
+    `insert_todos()` does for bulk inserts. `check_stats()` compares them
+    with a count of the todos, and `recount_stats()` repairs them.
+    """
+    day = CharField(primary_key=True)
+    total = IntegerField(default=0)
+    completed = IntegerField(default=0)
+
+    class Meta:
+        database = DATABASE
+
+
+# An external content table: it holds just the index, and reads the names
+# themselves from `todo`. The prefix indexes make prefix searches of 2 or 3
+# characters index lookups too (longer prefixes are anyway).
+SEARCH_TABLE = """CREATE VIRTUAL TABLE IF NOT EXISTS todo_search USING fts5(
+    name, content='todo', content_rowid='id', prefix='2 3')"""
+
+
+# The `TodoStats` row counting every todo
+ALL_DAYS = '*'
+
+
+# The `TableVersion` row holding the newest tombstone version compacted
+# away: a delta sync from an older version could have missed a deletion
+SYNC_HORIZON = 'todo_sync_horizon'
+
+
+# `UPDATE ... RETURNING` arrived in SQLite 3.35
+RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+# Triggers
+# --------
+# (Re)created by `initialize()`. Every row written bumps the todo table's
+# version and stamps the row with the new version; deletes leave a
+# tombstone instead. The update trigger only fires for the API's columns,
+# so the triggers' own `SET version = ...` doesn't set it off again.
+#
+# The search triggers mirror each name into the full-text index (an
+# external content table has to be told the old value to remove it). The
+# insert triggers leave rows that already have a version alone: those
+# come from bulk inserts, which do all of this themselves, once for all
+# their rows (see `insert_todos()`).
+#
+# The stats triggers add each row written to its day's `TodoStats` and to
+# `ALL_DAYS`, and take it away from its old day. A day whose todos are all
+# gone is deleted. (The day is the date part of the text peewee stores for
+# a datetime.)
+_BUMP_VERSION = """UPDATE tableversion SET version = version + 1
+        WHERE "table" = 'todo';"""
+_CURRENT_VERSION = """(SELECT version FROM tableversion
+        WHERE "table" = 'todo')"""
+_ADD_STATS = """ON CONFLICT (day) DO UPDATE SET
+            total = total + excluded.total,
+            completed = completed + excluded.completed;"""
+
+TRIGGERS = {
+    'todo_version_after_insert': """AFTER INSERT ON todo
+        WHEN NEW.version = 0
+    BEGIN
+        {bump}
+        UPDATE todo SET version = {current} WHERE id = NEW.id;
+        -- (SQLite can reuse the id of the last row after it is deleted)
+        DELETE FROM tombstone WHERE todo_id = NEW.id;
+    END""",
+    'todo_version_after_update': """AFTER UPDATE OF name, completed,
+        created_date ON todo
+    BEGIN
+        {bump}
+        UPDATE todo SET version = {current} WHERE id = NEW.id;
+    END""",
+    'todo_version_after_delete': """AFTER DELETE ON todo
+    BEGIN
+        {bump}
+        INSERT OR REPLACE INTO tombstone (todo_id, version, deleted_at)
+        VALUES (OLD.id, {current}, CAST(strftime('%s', 'now') AS INTEGER));
+    END""",
+    'todo_search_after_insert': """AFTER INSERT ON todo
+        WHEN NEW.version = 0
+    BEGIN
+        INSERT INTO todo_search (rowid, name) VALUES (NEW.id, NEW.name);
+    END""",
+    'todo_search_after_update': """AFTER UPDATE OF name ON todo
+    BEGIN
+        INSERT INTO todo_search (todo_search, rowid, name)
+        VALUES ('delete', OLD.id, OLD.name);
+        INSERT INTO todo_search (rowid, name) VALUES (NEW.id, NEW.name);
+    END""",
+    'todo_search_after_delete': """AFTER DELETE ON todo
+    BEGIN
+        INSERT INTO todo_search (todo_search, rowid, name)
+        VALUES ('delete', OLD.id, OLD.name);
+    END""",
+    'todo_stats_after_insert': """AFTER INSERT ON todo
+        WHEN NEW.version = 0
+    BEGIN
+        INSERT INTO todostats (day, total, completed)
+        VALUES (substr(NEW.created_date, 1, 10), 1, NEW.completed),
+            ('*', 1, NEW.completed)
+        {add_stats}
+    END""",
+    'todo_stats_after_update': """AFTER UPDATE OF completed, created_date
+        ON todo
+        WHEN OLD.completed IS NOT NEW.completed
+            OR OLD.created_date IS NOT NEW.created_date
+    BEGIN
+        INSERT INTO todostats (day, total, completed)
+        VALUES (substr(OLD.created_date, 1, 10), -1, -OLD.completed),
+            (substr(NEW.created_date, 1, 10), 1, NEW.completed),
+            ('*', 0, NEW.completed - OLD.completed)
+        {add_stats}
+        DELETE FROM todostats
+        WHERE day = substr(OLD.created_date, 1, 10) AND total = 0;
+    END""",
+    'todo_stats_after_delete': """AFTER DELETE ON todo
+    BEGIN
+        INSERT INTO todostats (day, total, completed)
+        VALUES (substr(OLD.created_date, 1, 10), -1, -OLD.completed),
+            ('*', -1, -OLD.completed)
+        {add_stats}
+        DELETE FROM todostats
+        WHERE day = substr(OLD.created_date, 1, 10) AND total = 0;
+    END""",
+}
+
+# Adds the todos matching {where} to their days' stats and `ALL_DAYS`.
+# (The WHERE clauses aren't optional: without one, SQLite would read the
+# ON CONFLICT as a join's.)
+_COUNT_TODOS = """INSERT INTO todostats (day, total, completed)
+    SELECT substr(created_date, 1, 10), COUNT(*), SUM(completed)
+    FROM todo WHERE {where} GROUP BY 1
+    UNION ALL
+    SELECT '*', COUNT(*), IFNULL(SUM(completed), 0)
+    FROM todo WHERE {where}
+    """ + _ADD_STATS
+
 
 # Helper Functions
 # ----------------
+def make_database(filename=None):
+    """Build the database selected by `config.DATABASE_BACKEND`, on
+    `filename` (by default `config.DATABASE_FILENAME`):
+
+    - 'sqlite': a plain SqliteDatabase (one connection per thread, opened
+      and closed around each request)
+    - 'pooled': a PooledSqliteDatabase, where closing a connection returns
+      it to a pool of at most `config.DATABASE_MAX_CONNECTIONS`, and
+      connections idle for more than `config.DATABASE_STALE_TIMEOUT`
+      seconds are recycled
+    """
+    if filename is None:
+        filename = config.DATABASE_FILENAME
+    pragmas = profile_pragmas()
+    if config.DATABASE_BACKEND == 'sqlite':
+        return HookedSqliteDatabase(filename, pragmas=pragmas)
+    if config.DATABASE_BACKEND == 'pooled':
+        return pooled_database_class()(
+            filename,
+            pragmas=pragmas,
+            max_connections=config.DATABASE_MAX_CONNECTIONS,
+            stale_timeout=config.DATABASE_STALE_TIMEOUT,
+            timeout=config.DATABASE_POOL_TIMEOUT,
+            # pooled connections move between threads (and are closed by
+            # whichever thread calls `close_database()`)
+            check_same_thread=False
+        )
+    raise ValueError(
+        'Unknown DATABASE_BACKEND: {!r}'.format(config.DATABASE_BACKEND)
+    )
+
+
+def make_databases():
+    """The database `DATABASE` stands for: `make_database()`, or with
+    `config.DATABASE_SHARDS` above 1 a `ShardRouter` over one per shard
+    """
+    count = config.DATABASE_SHARDS
+    if count < 1:
+        raise ValueError(
+            'DATABASE_SHARDS must be at least 1, not {!r}'.format(count))
+    if count == 1:
+        return make_database()
+    return ShardRouter([make_database(shard_filename(shard))
+                        for shard in range(count)])
+
+
+def shard_filename(shard):
+    """The file shard number `shard` lives in. Shard 0 is
+    `config.DATABASE_FILENAME` itself (so an unsharded database is shard
+    0 of any sharding); the others go beside it ('todo.shard1.sqlite',
+    ...).
+    """
+    if shard == 0:
+        return config.DATABASE_FILENAME
+    base, extension = os.path.splitext(config.DATABASE_FILENAME)
+    return '{}.shard{}{}'.format(base, shard, extension)
+
+
+def shard_count():
+    """How many shards the todos are spread over (1 when unsharded)"""
+    if isinstance(DATABASE.obj, ShardRouter):
+        return len(DATABASE.obj.shards)
+    return 1
+
+
+def shard_of(todo_id):
+    """The shard that holds todo `todo_id` (see `create_todo()`)"""
+    return todo_id % shard_count()
+
+
+def current_shard():
+    """The shard the current thread is using: always 0 when unsharded,
+    and None when sharded and no shard is selected
+    """
+    if isinstance(DATABASE.obj, ShardRouter):
+        return DATABASE.obj.current
+    return 0
+
+
+def using_shard(shard):
+    """Context manager selecting `shard` for the current thread (nesting,
+    and restoring the previous selection on the way out). A no-op when
+    the database isn't sharded.
+    """
+    if isinstance(DATABASE.obj, ShardRouter):
+        return DATABASE.obj.use(shard)
+    return contextlib.nullcontext()
+
+
+_round_robin = itertools.count()
+
+
+def next_shard():
+    """The shard to put the next new todo in, taking turns"""
+    return next(_round_robin) % shard_count()
+
+
+def databases():
+    """Every shard's database (just the one when unsharded)"""
+    if isinstance(DATABASE.obj, ShardRouter):
+        return list(DATABASE.obj.shards)
+    return [DATABASE.obj]
+
+
+def profile_pragmas():
+    """The pragmas of the configured `config.DATABASE_PROFILE`, in the
+    list-of-pairs form peewee takes (so they are applied in order)
+    """
+    try:
+        profile = config.DATABASE_PROFILES[config.DATABASE_PROFILE]
+    except KeyError:
+        raise ValueError(
+            'Unknown DATABASE_PROFILE: {!r}'.format(config.DATABASE_PROFILE)
+        )
+    return list(profile.items())
+
+
+# SQLite reports these pragmas as numbers even when they are set by name
+PRAGMA_VALUES = {
+    'synchronous': {'off': 0, 'normal': 1, 'full': 2, 'extra': 3},
+    'temp_store': {'default': 0, 'file': 1, 'memory': 2},
+}
+
+
+def effective_pragmas(names=('journal_mode', 'synchronous', 'cache_size',
+                             'mmap_size', 'busy_timeout', 'temp_store')):
+    """What SQLite says the pragmas actually are on the current
+    connection
+    """
+    return {name: DATABASE.pragma(name) for name in names}
+
+
+def check_pragmas():
+    """Compare the effective pragmas with the configured profile (SQLite
+    silently ignores some settings, e.g. WAL on an in-memory database, or
+    an mmap_size above the compile-time maximum). Returns
+    {name: (wanted, actual)} for each pragma that didn't take.
+    """
+    wanted = dict(profile_pragmas())
+    actual = effective_pragmas(tuple(wanted))
+    mismatches = {}
+    for name, value in wanted.items():
+        if isinstance(value, str):
+            value = value.lower()
+            value = PRAGMA_VALUES.get(name, {}).get(value, value)
+        found = actual[name]
+        if isinstance(found, str):
+            found = found.lower()
+        if found != value:
+            mismatches[name] = (wanted[name], actual[name])
+    return mismatches
+
+
 def initialize():
 
     # We can use Run-time database configuration to set the DB to load
@@ -31,7 +488,357 @@ def initialize():
     # suite before creating the database)
     # see:
     # http://docs.peewee-orm.com/en/latest/peewee/database.html
-    DATABASE.init(config.DATABASE_FILENAME)
+    close_database()
+    DATABASE.initialize(make_databases())
+    _last_compaction.clear()
+    check_shard_layout()
+    for shard in range(shard_count()):
+        with using_shard(shard):
+            initialize_shard()
+
+
+def initialize_shard():
+    """Bring the current shard's schema up to date (the whole database,
+    when unsharded)
+    """
     DATABASE.connect(reuse_if_open=True)
-    DATABASE.create_tables([Todo], safe=True)
+    DATABASE.pragma('user_version', shard_count())
+    DATABASE.create_tables([TableVersion], safe=True)
+    for table in ('todo', SYNC_HORIZON):
+        TableVersion.insert(table=table).on_conflict_ignore().execute()
+    add_version_column()
+    DATABASE.create_tables([Todo, Tombstone], safe=True)
+    with DATABASE.atomic():
+        search_exists = TodoSearch.table_exists()
+        DATABASE.execute_sql(SEARCH_TABLE)
+        stats_exist = TodoStats.table_exists()
+        DATABASE.create_tables([TodoStats], safe=True)
+        # replaced every time, so that changes to them take effect
+        for name, body in TRIGGERS.items():
+            DATABASE.execute_sql('DROP TRIGGER IF EXISTS {}'.format(name))
+            DATABASE.execute_sql('CREATE TRIGGER {} {}'.format(
+                name, body.format(bump=_BUMP_VERSION,
+                                  current=_CURRENT_VERSION,
+                                  add_stats=_ADD_STATS)))
+        if not search_exists:
+            # a database from before search: index the todos it has
+            rebuild_search_index()
+        if not stats_exist:
+            # or from before stats: count them
+            recount_stats()
+    compact_tombstones()
+    logger.info('SQLite pragmas: %s', effective_pragmas())
+    for name, (wanted, actual) in check_pragmas().items():
+        logger.warning('SQLite pragma %s is %r (profile %r wants %r)',
+                       name, actual, config.DATABASE_PROFILE, wanted)
     DATABASE.close()
+
+
+def check_shard_layout():
+    """Ids only say which shard holds a todo for one number of shards, so
+    each shard records the number it was laid out for (in SQLite's
+    `user_version`, 0 for a database from before sharding, which counts as
+    1), and once it has todos it is refused under any other. So is a
+    layout that leaves todos in shards beyond `config.DATABASE_SHARDS`.
+
+    Every shard is checked before `initialize()` changes any of them.
+    """
+    count = shard_count()
+    for shard in range(count):
+        with using_shard(shard):
+            DATABASE.connect(reuse_if_open=True)
+            try:
+                recorded = DATABASE.pragma('user_version') or 1
+                has_todos = Todo.table_exists() and Todo.select().exists()
+            finally:
+                DATABASE.close()
+        if recorded != count and has_todos:
+            raise ValueError(
+                '{} is laid out for {} shard(s), not DATABASE_SHARDS = '
+                '{}'.format(shard_filename(shard), recorded, count))
+
+    shard = count
+    while os.path.exists(shard_filename(shard)):
+        connection = sqlite3.connect(shard_filename(shard))
+        try:
+            has_todos = connection.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'todo'"
+            ).fetchone() and connection.execute(
+                'SELECT EXISTS (SELECT 1 FROM todo)').fetchone()[0]
+        finally:
+            connection.close()
+        if has_todos:
+            raise ValueError('{} holds todos, but DATABASE_SHARDS = {}'.format(
+                shard_filename(shard), count))
+        shard += 1
+
+
+def add_version_column():
+    """Migrate a todo table from before delta syncs: add the `version`
+    column, and give every existing row a version above 0 (so a first
+    sync from 0 includes them)
+    """
+    if not Todo.table_exists():
+        return
+    if 'version' in [column.name for column in DATABASE.get_columns('todo')]:
+        return
+    with DATABASE.atomic():
+        DATABASE.execute_sql('ALTER TABLE todo ADD COLUMN version INTEGER '
+                             'NOT NULL DEFAULT 0')
+        DATABASE.execute_sql(_BUMP_VERSION)
+        DATABASE.execute_sql('UPDATE todo SET version = ' + _CURRENT_VERSION)
+
+
+def rebuild_search_index():
+    """Index every todo name again, from scratch (`initialize()` does this
+    when it adds the index to an existing database; `python3 manage.py
+    rebuild-search` does it on demand)
+    """
+    DATABASE.execute_sql(
+        "INSERT INTO todo_search (todo_search) VALUES ('rebuild')")
+
+
+def recount_stats():
+    """Count the todos (on the current shard) into `TodoStats` again, from
+    scratch (`initialize()` does this when it adds the table to an existing
+    database; `python3 manage.py check-stats --repair` does it when the
+    counts are wrong)
+    """
+    with DATABASE.atomic():
+        TodoStats.delete().execute()
+        DATABASE.execute_sql(_COUNT_TODOS.format(where='1'))
+
+
+def check_stats():
+    """Compare the current shard's `TodoStats` with a count of its todos
+    (one scan of the table). Returns {day: (kept, counted)} for the days
+    whose counts differ, each count a (total, completed) pair.
+    """
+    with DATABASE.atomic():
+        kept = {row.day: (row.total, row.completed)
+                for row in TodoStats.select()}
+        # (coerce(False): not read back as a datetime and a boolean)
+        day = fn.substr(Todo.created_date, 1, 10).coerce(False)
+        counted = {
+            row_day: (total, completed)
+            for row_day, total, completed in Todo.select(
+                day, fn.COUNT(Todo.id), fn.SUM(Todo.completed).coerce(False)
+            ).group_by(day).tuples()
+        }
+    counted[ALL_DAYS] = (sum(total for total, _ in counted.values()),
+                         sum(completed for _, completed in counted.values()))
+    nothing = (0, 0)
+    return {day: (kept.get(day, nothing), counted.get(day, nothing))
+            for day in set(kept) | set(counted)
+            if kept.get(day, nothing) != counted.get(day, nothing)}
+
+
+# when `compact_tombstones()` last ran on each shard (by time.monotonic())
+_last_compaction = {}
+
+
+def compact_tombstones(now=None):
+    """Delete the tombstones older than `config.TOMBSTONE_RETENTION`
+    seconds, moving the sync horizon up past them. Returns how many were
+    deleted.
+    """
+    _last_compaction[current_shard()] = time.monotonic()
+    cutoff = (time.time() if now is None else now) - config.TOMBSTONE_RETENTION
+    with DATABASE.atomic():
+        newest = (Tombstone
+                  .select(fn.MAX(Tombstone.version))
+                  .where(Tombstone.deleted_at < cutoff)
+                  .scalar())
+        if newest is None:
+            return 0
+        (TableVersion
+         .update(version=fn.MAX(TableVersion.version, newest))
+         .where(TableVersion.table == SYNC_HORIZON)
+         .execute())
+        # everything up to the horizon goes, so that what is left is
+        # exactly the deletions after it
+        return Tombstone.delete().where(Tombstone.version <= newest).execute()
+
+
+def compact_tombstones_if_due():
+    """`compact_tombstones()`, at most once every
+    `config.TOMBSTONE_COMPACT_INTERVAL` seconds per shard (called after
+    deletes, on the shard deleted from)
+    """
+    last = _last_compaction.get(current_shard())
+    if (last is None
+            or time.monotonic() - last >= config.TOMBSTONE_COMPACT_INTERVAL):
+        compact_tombstones()
+
+
+def reopen_after_fork():
+    """Called in a newly forked worker process (see serve.py): swaps the
+    database inherited from the parent, along with any connection or pool
+    state it holds, for a fresh one, so the worker opens its own
+    connections. A SQLite connection must never be shared across a fork.
+    """
+    DATABASE.initialize(make_databases())
+
+
+def create_todo(**values):
+    """Create a todo (on the current shard) and return it.
+
+    Sharded, a todo's id is the shard's next id that is congruent to the
+    shard's number modulo the number of shards, which is what lets
+    `shard_of()` find it again. It is worked out in the INSERT itself, so
+    two creates can't be given the same one.
+    """
+    count = shard_count()
+    if count == 1:
+        return Todo.create(**values)
+    next_id = Todo.select(fn.IFNULL(fn.MAX(Todo.id), current_shard()) + count)
+    return Todo.create(id=next_id, **values)
+
+
+def next_ids(number):
+    """The next `number` ids `create_todo()` would give todos on the
+    current shard, for inserting several at once. Only use them inside a
+    `write_transaction()`, which stops anything else taking them first.
+    """
+    step = shard_count()
+    last = Todo.select(fn.MAX(Todo.id)).scalar()
+    first = (current_shard() if last is None else last) + step
+    return list(range(first, first + step * number, step))
+
+
+_INSERT_TODOS = """INSERT INTO todo
+    (id, name, completed, created_date, version) VALUES (?, ?, ?, ?, ?)"""
+
+
+def insert_todos(rows):
+    """Insert new todos in bulk on the current shard (for imports), and
+    return their ids. `rows` are (name, completed, created_date) tuples.
+    Only use it inside a `write_transaction()`, as `next_ids()`.
+
+    Every row is run through one prepared statement, since having peewee
+    build a multi-row INSERT takes longer than SQLite takes to run it.
+    The rows skip the insert triggers, which would run five statements
+    for each of them: the table's version is bumped once and every row
+    is stamped with it, and the names are indexed and the rows counted
+    into `TodoStats` in one statement each.
+    """
+    if not rows:
+        return []
+    ids = next_ids(len(rows))
+    DATABASE.execute_sql(_BUMP_VERSION)
+    version = table_version()
+    DATABASE.cursor().executemany(_INSERT_TODOS, [
+        (todo_id, name, completed, str(created_date), version)
+        for todo_id, (name, completed, created_date) in zip(ids, rows)
+    ])
+    DATABASE.execute_sql(
+        'INSERT INTO todo_search (rowid, name) SELECT id, name FROM todo'
+        ' WHERE id BETWEEN ? AND ?', (ids[0], ids[-1]))
+    DATABASE.execute_sql(_COUNT_TODOS.format(where='id BETWEEN ? AND ?'),
+                         (ids[0], ids[-1]) * 2)
+    # (these ids may have been used before)
+    (Tombstone
+     .delete()
+     .where(Tombstone.todo_id.between(ids[0], ids[-1]))
+     .execute())
+    return ids
+
+
+def write_transaction():
+    """A transaction on the current shard that takes SQLite's write lock
+    as it begins (BEGIN IMMEDIATE), for writes that depend on what they
+    read first
+    """
+    # (through the shard itself: the proxy's atomic() takes no lock type)
+    return DATABASE.obj.atomic(lock_type='IMMEDIATE')
+
+
+def update_todo(todo_id, **values):
+    """Update one todo and return it, or None if there is no such todo.
+
+    Where SQLite supports it this is a single `UPDATE ... RETURNING`
+    statement; otherwise the update and the read that follows it share a
+    transaction, so nothing can change the row in between.
+    """
+    query = Todo.update(**values).where(Todo.id == todo_id)
+    if RETURNING_SUPPORTED:
+        # the cursor has to be read to the end, or the statement (and
+        # its write lock) stays open
+        rows = list(query.returning(*Todo._meta.sorted_fields).execute())
+        return rows[0] if rows else None
+
+    with DATABASE.atomic():
+        if not query.execute():
+            return None
+        return Todo.get(Todo.id == todo_id)
+
+
+def delete_todo(todo_id):
+    """Delete one todo. Returns whether there was one to delete."""
+    return Todo.delete().where(Todo.id == todo_id).execute() > 0
+
+
+def table_version(table='todo'):
+    """The current `TableVersion` of `table`. Sharded, and with no shard
+    selected, it is the sum of every shard's, which still goes up with
+    every write to any of them.
+    """
+    if current_shard() is None:
+        total = 0
+        for shard in range(shard_count()):
+            with using_shard(shard):
+                total += table_version(table)
+        return total
+    return (TableVersion
+            .select(TableVersion.version)
+            .where(TableVersion.table == table)
+            .scalar())
+
+
+def todo_stats():
+    """The `TodoStats` as {day: (total, completed)}, `ALL_DAYS` included.
+    Sharded, and with no shard selected, every shard's are added up.
+    """
+    if current_shard() is None:
+        totals = {}
+        for shard in range(shard_count()):
+            with using_shard(shard):
+                for day, (total, completed) in todo_stats().items():
+                    before = totals.get(day, (0, 0))
+                    totals[day] = (before[0] + total, before[1] + completed)
+        return totals
+    return {day: (total, completed) for day, total, completed in
+            TodoStats.select(TodoStats.day, TodoStats.total,
+                             TodoStats.completed).tuples()}
+
+
+def connect():
+    """Take the current thread's connection (for a request). Sharded,
+    each shard is connected to when it is first used instead: most
+    requests only need one of them.
+    """
+    if shard_count() == 1:
+        DATABASE.connect(reuse_if_open=True)
+
+
+def release_connections():
+    """Close (or, pooled, give back) whichever of the current thread's
+    connections are open, on every shard
+    """
+    for database in databases():
+        if not database.is_closed():
+            database.close()
+
+
+def close_database():
+    """Close the current thread's connections and, for a pooled database,
+    every idle connection in the pools. Safe to call before
+    `initialize()`.
+    """
+    if DATABASE.obj is None:
+        return
+    release_connections()
+    for database in databases():
+        # (only pools have idle connections)
+        if hasattr(database, 'close_all'):
+            database.close_all()
@@ -1,8 +1,26 @@
-from flask import Blueprint, request
+import base64
+import binascii
+import codecs
+import datetime
+import hashlib
+import json
+
+from flask import Blueprint, Response, request, stream_with_context
 from flask_restful import (Resource, Api, url_for, reqparse, fields, inputs,
-                           marshal, marshal_with)
-
+                           marshal, marshal_with, abort)
+from peewee import Case, chunked
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
+
+import bulk
+import cache
+import changes
+import config
 import models
+import serializers
+import storage
+from serializers import CompiledSerializer
+from storage import KEY_TYPES, SORT_CHOICES, SORT_KEYS, fetch_rows
 
 
 MODULE_PATH = 'resources.todos'
@@ -17,13 +35,18 @@ todo_fields = {
 }
 
 
+# The same mapping, compiled for serialising collections straight from
+# row tuples (see `serialize_row()`)
+todo_serializer = CompiledSerializer(todo_fields, models.Todo)
+
+
 # Helper Functions
 # ----------------
 def set_reqparser():
     """The nature of this API is such that both List and Item resources
     will need to handle `name`, and `completed` fields[note1]. Therefore,
-    we can centralise the parser definition and just call it in each
-    resource's initialiser.
+    we can centralise the parser definition, build it once (as
+    `TODO_PARSER`) and share it between the resources.
 
     [note1]:  we don't need to do anything with `edited` because every request
     either persists to the database (thus clearing the edited flag) or reads
@@ -58,19 +81,489 @@ def set_reqparser():
     return parser
 
 
+def set_listparser():
+    """The collection's query string arguments. These are kept apart from
+    `set_reqparser()` because they are only ever read from the URL and
+    never from the request body.
+    """
+    parser = reqparse.RequestParser()
+    parser.add_argument(
+        'limit',
+        required=False,
+        type=page_size,
+        location='args'
+    )
+    parser.add_argument(
+        'after',
+        required=False,
+        help='Invalid cursor',
+        type=decode_cursor,
+        location='args'
+    )
+    parser.add_argument(
+        'completed',
+        required=False,
+        help='Invalid value for completed',
+        type=inputs.boolean,
+        location='args'
+    )
+    parser.add_argument(
+        'sort',
+        required=False,
+        help='sort must be one of: {}'.format(', '.join(SORT_CHOICES)),
+        choices=SORT_CHOICES,
+        location='args'
+    )
+    parser.add_argument(
+        'q',
+        required=False,
+        type=search_terms,
+        location='args'
+    )
+    parser.add_argument(
+        'since',
+        required=False,
+        help='since must be a version (a whole number)',
+        type=inputs.natural,
+        location='args'
+    )
+    return parser
+
+
+def page_size(value):
+    """The `limit` argument. The maximum is read from the config on every
+    request, not when the parser is built.
+    """
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        limit = 0
+    if not 1 <= limit <= config.MAX_PAGE_SIZE:
+        raise ValueError(
+            'limit must be between 1 and {}'.format(config.MAX_PAGE_SIZE))
+    return limit
+
+
+def search_terms(value):
+    """The `q` argument: the words to search todo names for, as an FTS5
+    query. A todo matches if every word starts a word of its name,
+    ignoring case and accents ('buy mil' finds 'Buy milk').
+    """
+    words = [word for word in value.split()
+             if any(character.isalnum() for character in word)]
+    if not words:
+        raise ValueError('q must contain a word to search for')
+    # each word quoted, so that FTS5's operators and punctuation are just
+    # text, and made a prefix with '*'
+    return ' '.join('"{}"*'.format(word.replace('"', '""'))
+                    for word in words)
+
+
+def encode_cursor(sort, values):
+    """Cursors are opaque to clients: they are the (urlsafe) base64 of a
+    JSON list of the sort they belong to followed by the keyset values of
+    the last row on a page. Keeping them opaque means we can change what
+    goes into the key without breaking the contract.
+    """
+    payload = [sort] + [
+        str(value) if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """The inverse of `encode_cursor()`, returning (sort, values). Raises
+    ValueError for anything we didn't produce (which reqparse turns into
+    a 400).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        sort, *values = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+    if sort not in SORT_CHOICES:
+        raise ValueError('Invalid cursor')
+    names = SORT_KEYS[sort.lstrip('-')]
+    if (len(values) != len(names)
+            or not all(isinstance(value, KEY_TYPES[name])
+                       for name, value in zip(names, values))):
+        raise ValueError('Invalid cursor')
+    return sort, values
+
+
+def version_etag(version, *parts):
+    """A strong ETag for a representation built from the todos: `version`,
+    the repository's version (which every write bumps; for a single todo,
+    see `storage.Repository.version()`), plus a digest of whatever else the
+    representation depends on (the id, the query string, ...).
+
+    The version must be read *before* the rows are. If a write lands in
+    between, the tag is merely older than the body, and the client just
+    gets a fresh copy next time.
+    """
+    digest = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+    return '{}-{}'.format(version, digest)
+
+
+def sqlite_storage():
+    """Whether the todos are in SQLite (`config.STORAGE_BACKEND`)"""
+    return isinstance(storage.REPOSITORY, storage.SqliteRepository)
+
+
+def require_sqlite(feature):
+    """Abort with a 501 unless the todos are in SQLite, which `feature`
+    needs (it goes beyond `storage.Repository`)
+    """
+    if not sqlite_storage():
+        abort(501, message='{} need the SQLite storage'.format(feature))
+
+
+def not_modified(etag, vary=()):
+    """A `304 Not Modified` response if the client already has `etag`,
+    otherwise None.
+
+    The 304 has to carry the `Vary` the full response would have (the
+    request headers in `vary` it is negotiated on, plus Accept-Encoding
+    when it may be compressed), or a shared cache could mix the variants
+    up.
+    """
+    # weakly: a compressed response carries the weak form of the tag
+    # (see `compression.compress_response()`)
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.update(vary)
+    if config.COMPRESS_RESPONSES:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def json_response(value, etag):
+    """Send a `cache.CachedResponse` (as-is: the body is already JSON)"""
+    response = Response(value.body, mimetype=value.mimetype,
+                        headers=list(value.headers))
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
+
+
+def cache_stream(chunks, key, mimetype, headers=()):
+    """Pass a streamed response's chunks through, keeping a copy to cache
+    once the stream completes, unless it grows past
+    `config.CACHE_MAX_ENTRY_BYTES` (in which case the copy is dropped so
+    that big collections still stream in constant memory).
+    """
+    buffered, size = [], 0
+    for chunk in chunks:
+        yield chunk
+        if buffered is not None:
+            data = chunk.encode('utf-8')
+            size += len(data)
+            if size > config.CACHE_MAX_ENTRY_BYTES:
+                buffered = None
+            else:
+                buffered.append(data)
+    if buffered is not None and cache.CACHE is not None:
+        cache.CACHE.set(key, cache.CachedResponse(
+            b''.join(buffered), mimetype, tuple(headers)))
+
+
+def wants_ndjson():
+    """Content negotiation for the streamed collection. `*/*` (which is
+    what the Angular client sends) resolves to plain JSON.
+    """
+    best = request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']
+    )
+    return best == 'application/x-ndjson'
+
+
+def export_format():
+    """Content negotiation for exports (when there is no `?format=`):
+    NDJSON, unless CSV is preferred
+    """
+    best = request.accept_mimetypes.best_match(
+        [bulk.FORMATS['ndjson'], bulk.FORMATS['csv']]
+    )
+    return 'csv' if best == bulk.FORMATS['csv'] else 'ndjson'
+
+
+def import_report(progress):
+    """An import's `bulk.Progress` as NDJSON: a line after every chunk,
+    then the summary, with `"done": true` and the rejected rows
+    """
+    previous = None
+    for current in progress:
+        if previous is not None:
+            yield serializers.dumps({'lines': previous.lines,
+                                     'imported': previous.imported,
+                                     'rejected': previous.rejected}) + '\n'
+        previous = current
+    yield serializers.dumps(dict(previous._asdict(), done=True)) + '\n'
+
+
+def record_imported(ids, rows):
+    """`bulk.import_todos()`'s on_commit: the same as any other write
+    path does once it has committed, for a whole chunk at a time
+    """
+    changes.record_many('create', (
+        {'id': todo_id, 'name': name, 'completed': completed}
+        for todo_id, (name, completed, _) in zip(ids, rows)))
+
+
+def serialize_row(row):
+    """The JSON text for one todo row tuple (selected with
+    `todo_serializer.columns` first).
+
+    With `config.FAST_SERIALIZER` this goes through the compiled
+    serializer; without it, through `marshal()` and `serializers.dumps()`,
+    which is what the compiled one has to match, byte for byte.
+    """
+    if config.FAST_SERIALIZER:
+        return todo_serializer.dumps_row(row)
+    return serializers.dumps(
+        marshal(todo_serializer.as_dict(row), todo_fields))
+
+
+def serialize_rows(rows):
+    """A JSON array of todo row tuples (formatted as `serializers.dumps()`
+    would format the list)
+    """
+    if config.FAST_SERIALIZER:
+        return todo_serializer.dumps_rows(rows)
+    return serializers.dumps(
+        [marshal(todo_serializer.as_dict(row), todo_fields) for row in rows])
+
+
+def stream_todos(rows, ndjson=False):
+    """Yield todo row tuples (an iterator, see `fetch_rows()`) as either
+    one JSON array or as newline-delimited JSON, one chunk of
+    `config.STREAM_CHUNK_SIZE` rows at a time.
+
+    `.tuples().iterator()` means peewee neither builds model instances nor
+    caches the rows it has already returned, so memory use stays flat
+    however big the table is.
+    """
+    chunk_size = config.STREAM_CHUNK_SIZE
+    chunk = []
+    first = True
+
+    if not ndjson:
+        yield '['
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield _join_chunk(chunk, first, ndjson)
+            first = False
+            chunk = []
+
+    if chunk:
+        yield _join_chunk(chunk, first, ndjson)
+
+    if not ndjson:
+        yield ']'
+
+
+def _join_chunk(chunk, first, ndjson):
+    if ndjson:
+        return '\n'.join(serialize_row(row) for row in chunk) + '\n'
+    # the chunk's rows as an array, without its brackets
+    separator = '' if first else ','
+    return separator + serialize_rows(chunk)[1:-1]
+
+
+class BatchItem:
+    """Just enough of a request for reqparse to read one batch operation
+    as if it were the JSON body of a single-item request. This lets us
+    validate batch items with exactly the same rules as `set_reqparser()`.
+    """
+    form = None
+
+    def __init__(self, data):
+        self.json = data
+
+
+def parse_batch_item(parser, item):
+    """Returns (args, None) for a valid item, or (None, error_message) if
+    reqparse rejected it.
+    """
+    try:
+        return parser.parse_args(req=BatchItem(item)), None
+    except HTTPException as e:
+        return None, getattr(e, 'data', {}).get('message', e.description)
+
+
+def existing_ids(ids):
+    """The subset of `ids` that are in the table, in chunked
+    `WHERE id IN (...)` queries.
+    """
+    found = set()
+    for chunk in chunked(ids, config.BATCH_CHUNK_SIZE):
+        query = (models.Todo
+                 .select(models.Todo.id)
+                 .where(models.Todo.id.in_(chunk))
+                 .tuples())
+        found.update(todo_id for (todo_id,) in query)
+    return found
+
+
+# The request parsers, built once at import and shared by every request
+# (parsing doesn't change them)
+TODO_PARSER = set_reqparser()
+LIST_PARSER = set_listparser()
+
+
 # Resource Classes
 # ----------------
 class ToDoList(Resource):
-
-    def __init__(self):
-        self.reqparse = set_reqparser()
+    # flask_restful makes a new resource for every request, so the parsers
+    # are shared rather than built in `__init__()`
+    reqparse = TODO_PARSER
+    listparse = LIST_PARSER
 
     def get(self):
-        todos = models.Todo.select()
-
-        response_body = [marshal(todo, todo_fields) for todo in todos]
-
-        return response_body
+        args = self.listparse.parse_args()
+        if args['sort'] is None:
+            args['sort'] = 'id' if args['q'] is None else 'rank'
+        ndjson = wants_ndjson()
+
+        query_args = sorted(request.args.items(multi=True))
+        version = storage.REPOSITORY.version()
+        etag = version_etag(version, 'todos', query_args, ndjson)
+        unchanged = not_modified(etag, vary=['Accept'])
+        if unchanged is not None:
+            return unchanged
+
+        if args['since'] is not None:
+            return self._delta(args['since'], etag)
+
+        cache_key = None
+        if cache.CACHE is not None:
+            # the version is in the key, so any write since this was
+            # cached means a different key (and a miss)
+            cache_key = cache.collection_key(version, query_args, ndjson)
+            hit = cache.CACHE.get(cache_key)
+            if hit is not None:
+                return json_response(hit, etag)
+
+        # the version to start delta syncs (`?since=`) from: the same one
+        # as the ETag's, read before the rows, so at worst a sync from it
+        # repeats some of them. (Delta syncs need a single SQLite database:
+        # see `_delta()`.)
+        additional_headers = []
+        if sqlite_storage() and models.shard_count() == 1:
+            additional_headers.append(('X-Version', str(version)))
+
+        # Keyset pagination: rather than OFFSET (which has to walk past
+        # every skipped row) we seek straight to the first row after the
+        # cursor (in SQLite, using an index). With a limit, we fetch one
+        # extra row so we know whether there is a next page without
+        # having to run a COUNT.
+        try:
+            rows, key_positions = storage.REPOSITORY.list(
+                completed=args['completed'], sort=args['sort'],
+                after=args['after'], q=args['q'],
+                limit=None if args['limit'] is None else args['limit'] + 1)
+        except storage.QueryError as e:
+            abort(400, message=e.message)
+        except storage.Unsupported as e:
+            abort(501, message=str(e))
+
+        if args['limit'] is None:
+            return self._stream(rows, etag, ndjson, cache_key,
+                                additional_headers)
+
+        rows = list(rows)
+        has_more = len(rows) > args['limit']
+        rows = rows[:args['limit']]
+
+        if has_more:
+            cursor = encode_cursor(
+                args['sort'],
+                [rows[-1][position] for position in key_positions]
+            )
+            next_url = url_for(
+                'resources.todos.todos',
+                limit=args['limit'],
+                after=cursor,
+                **{name: request.args[name]
+                   for name in ('completed', 'sort', 'q')
+                   if name in request.args}
+            )
+            additional_headers.append(('X-Next-Cursor', cursor))
+            additional_headers.append(
+                ('Link', '<{}>; rel="next"'.format(next_url)))
+
+        value = cache.CachedResponse(
+            serialize_rows(rows).encode('utf-8'),
+            'application/json',
+            tuple(additional_headers)
+        )
+        if cache_key is not None:
+            cache.CACHE.set(cache_key, value)
+        return json_response(value, etag)
+
+    def _delta(self, since, etag):
+        """Every todo written, and the id of every todo deleted, after
+        version `since`, as `{"version": ..., "changed": [...], "deleted":
+        [...]}`. `version` is the version to sync from next time.
+
+        Versions are per database, so a sharded one has no single version
+        to sync from, and no delta syncs.
+        """
+        require_sqlite('Delta syncs')
+        if models.shard_count() > 1:
+            abort(400, message={'since': 'Delta syncs are not available '
+                                'with a sharded database'})
+        other = [name for name in ('limit', 'after', 'completed', 'sort', 'q')
+                 if name in request.args]
+        if other:
+            abort(400, message={'since': 'Cannot be combined with {}'.format(
+                ', '.join(other))})
+
+        # one read transaction, so the version, the rows and the
+        # tombstones are all from the same snapshot
+        with models.DATABASE.atomic():
+            if since < models.table_version(models.SYNC_HORIZON):
+                abort(410, message='Deletions since version {} have been '
+                      'compacted: reload the collection'.format(since))
+            version = models.table_version()
+            rows = (models.Todo
+                    .select(*todo_serializer.columns)
+                    .where(models.Todo.version > since)
+                    .order_by(models.Todo.version)
+                    .tuples())
+            deleted = (models.Tombstone
+                       .select(models.Tombstone.todo_id)
+                       .where(models.Tombstone.version > since)
+                       .order_by(models.Tombstone.version)
+                       .tuples())
+            body = '{{"version":{},"changed":{},"deleted":{}}}'.format(
+                version, serialize_rows(rows),
+                serializers.dumps([todo_id for todo_id, in deleted]))
+
+        return json_response(cache.CachedResponse(
+            body.encode('utf-8'), 'application/json', ()), etag)
+
+    def _stream(self, rows, etag, ndjson, cache_key=None, headers=()):
+        """The whole collection, without ever holding it in memory"""
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        chunks = stream_todos(rows, ndjson=ndjson)
+        if cache_key is not None:
+            chunks = cache_stream(chunks, cache_key, mimetype, headers)
+
+        # stream_with_context keeps the request context (and with it the
+        # database connection) alive until the last chunk has been sent
+        response = Response(stream_with_context(chunks), mimetype=mimetype,
+                            headers=list(headers))
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        return response
 
     def post(self):
 
@@ -79,8 +572,9 @@ class ToDoList(Resource):
         # but don't care about, we can just not parse them
         pkwargs = self.reqparse.parse_args()
 
-        # create the corresponding DB entry and return it
-        todo = models.Todo.create(**pkwargs)
+        # create the todo (committed by the time the repository returns
+        # it) and return it
+        todo = storage.REPOSITORY.create(**pkwargs)
 
         # use marshal to convert the peewee model instance into a
         # data structure that is JSONable.
@@ -114,6 +608,7 @@ class ToDoList(Resource):
         # the first element in the tuple will be marshalled, the rest of the
         # tuple will be passed through unchanged.
         response_body = marshal(todo, todo_fields)
+        changes.record('create', response_body)
         status_code = 201
         additional_headers = {
             'Location': url_for('resources.todos.todo', id=todo.id)
@@ -123,19 +618,48 @@ class ToDoList(Resource):
 
 
 class ToDo(Resource):
-    def __init__(self):
-        self.reqparse = set_reqparser()
+    reqparse = TODO_PARSER
+
+    def get(self, id):
+        version = storage.REPOSITORY.version(id)
+        etag = version_etag(version, 'todo', id)
+        unchanged = not_modified(etag, vary=['Accept'])
+        if unchanged is not None:
+            return unchanged
+
+        if cache.CACHE is not None:
+            hit = cache.CACHE.get(cache.item_key(version, id))
+            if hit is not None:
+                return json_response(hit, etag)
+
+        todo = storage.REPOSITORY.get(id)
+        if todo is None:
+            abort(404, message='Todo {} does not exist'.format(id))
+
+        response_body = marshal(todo, todo_fields)
+        if cache.CACHE is not None:
+            value = cache.CachedResponse(
+                serializers.dumps(response_body).encode('utf-8'),
+                'application/json',
+                ()
+            )
+            cache.CACHE.set(cache.item_key(version, id), value)
+            return json_response(value, etag)
+        status_code = 200
+        additional_headers = {'ETag': quote_etag(etag)}
+
+        return (response_body, status_code, additional_headers)
 
     @marshal_with(todo_fields)
     def put(self, id):
         pkwargs = self.reqparse.parse_args()
 
-        # .update() returns a query not a model object
-        query = models.Todo.update(**pkwargs).where(models.Todo.id == id)
-        query.execute()
-
-        # now we have to actually get the model
-        response_body = models.Todo.get(models.Todo.id == id)
+        # update and read back the todo in one go (in SQLite, rather than
+        # an .update() query followed by a .get())
+        response_body = storage.REPOSITORY.update(id, **pkwargs)
+        if response_body is None:
+            abort(404, message='Todo {} does not exist'.format(id))
+        changes.record('update', marshal(response_body, todo_fields))
 
         status_code = 200
         additional_headers = {
@@ -146,9 +670,9 @@ class ToDo(Resource):
 
     def delete(self, id):
 
-        # .delete() returns a query not a model object
-        query = models.Todo.delete().where(models.Todo.id == id)
-        query.execute()
+        if not storage.REPOSITORY.delete(id):
+            abort(404, message='Todo {} does not exist'.format(id))
+        changes.record('delete', id)
 
         response_body = ''
         status_code = 204  # (no content)
@@ -165,15 +689,325 @@ class ToDo(Resource):
         return response
 
 
+class ToDoBatch(Resource):
+    """Applies a list of create/update/delete operations in a single
+    transaction (with a sharded database, one per shard written to). The
+    request body is a JSON list such as:
+
+        [
+            {"op": "create", "name": "new", "completed": false},
+            {"op": "update", "id": 3, "name": "renamed", "completed": true},
+            {"op": "delete", "id": 4}
+        ]
+
+    and the response has one result per operation, in the same order,
+    each with the status code the equivalent single-item request would
+    have returned.
+    """
+    reqparse = TODO_PARSER
+
+    def post(self):
+        require_sqlite('Batch writes')
+        operations = request.get_json(silent=True)
+        if not isinstance(operations, list):
+            abort(400, message='Expected a JSON list of operations')
+        if len(operations) > config.MAX_BATCH_SIZE:
+            abort(413, message='At most {} operations per batch'.format(
+                config.MAX_BATCH_SIZE))
+
+        results = [None] * len(operations)
+        creates = []   # [(position, args)]
+        updates = {}   # id -> [(position, args)]; the last one wins
+        deletes = {}   # id -> position
+
+        for position, item in enumerate(operations):
+            op = item.get('op') if isinstance(item, dict) else None
+            todo_id = item.get('id') if isinstance(item, dict) else None
+
+            if op not in ('create', 'update', 'delete'):
+                results[position] = {
+                    'status': 400,
+                    'message': {'op': 'Must be create, update or delete'}
+                }
+                continue
+
+            # (JSON true and false are ints to Python)
+            if op != 'create' and (not isinstance(todo_id, int)
+                                   or isinstance(todo_id, bool)):
+                results[position] = {
+                    'status': 400, 'message': {'id': 'No todo id provided'}
+                }
+                continue
+
+            if op != 'create' and todo_id in deletes:
+                # already deleted earlier in this same batch
+                results[position] = self._not_found(todo_id)
+                continue
+
+            if op == 'delete':
+                deletes[todo_id] = position
+                continue
+
+            args, error = parse_batch_item(self.reqparse, item)
+            if error is not None:
+                results[position] = {'status': 400, 'message': error}
+            elif op == 'create':
+                creates.append((position, args))
+            else:
+                updates.setdefault(todo_id, []).append((position, args))
+
+        # the creates all go to one shard, and everything else to the
+        # shard of the todo it is for
+        create_shard = models.next_shard() if creates else None
+        for shard in range(models.shard_count()):
+            shard_creates = creates if shard == create_shard else []
+            shard_updates = {todo_id: ops for todo_id, ops in updates.items()
+                             if models.shard_of(todo_id) == shard}
+            shard_deletes = {todo_id: position
+                             for todo_id, position in deletes.items()
+                             if models.shard_of(todo_id) == shard}
+            if not (shard_creates or shard_updates or shard_deletes):
+                continue
+            with models.using_shard(shard):
+                with models.write_transaction():
+                    self._apply_creates(shard_creates, results)
+                    self._apply_updates(shard_updates, results)
+                    self._apply_deletes(shard_deletes, results)
+                if shard_deletes:
+                    models.compact_tombstones_if_due()
+
+        # in request order, which is the order a client would have made
+        # the equivalent single-item requests in
+        for item, result in zip(operations, results):
+            if result['status'] in (200, 201):
+                changes.record(item['op'], result['todo'])
+            elif result['status'] == 204:
+                changes.record('delete', item['id'])
+
+        return {'results': results}, 200
+
+    def _apply_creates(self, creates, results):
+        for chunk in chunked(creates, config.BATCH_CHUNK_SIZE):
+            # The ids are allocated up front (the ones `create_todo()`
+            # would have given, one by one): the transaction has held the
+            # write lock since it began, so nothing else can take them
+            rows = [dict(args, id=todo_id) for todo_id, (_, args)
+                    in zip(models.next_ids(len(chunk)), chunk)]
+            models.Todo.insert_many(rows).execute()
+
+            for row, (position, _) in zip(rows, chunk):
+                results[position] = {
+                    'status': 201, 'todo': marshal(row, todo_fields)
+                }
+
+    def _apply_updates(self, updates, results):
+        found = existing_ids(list(updates))
+        for todo_id, operations in updates.items():
+            for position, args in operations:
+                results[position] = (
+                    self._updated(todo_id, args) if todo_id in found
+                    else self._not_found(todo_id)
+                )
+
+        to_update = [todo_id for todo_id in updates if todo_id in found]
+        for chunk in chunked(to_update, config.BATCH_CHUNK_SIZE):
+            # one `UPDATE ... SET col = CASE id WHEN ... END` per chunk,
+            # rather than one statement per row
+            final = {todo_id: updates[todo_id][-1][1] for todo_id in chunk}
+            names = [(i, args['name']) for i, args in final.items()]
+            completed = [(i, args['completed']) for i, args in final.items()]
+            (models.Todo
+             .update(name=Case(models.Todo.id, names),
+                     completed=Case(models.Todo.id, completed))
+             .where(models.Todo.id.in_(chunk))
+             .execute())
+
+    def _apply_deletes(self, deletes, results):
+        found = existing_ids(list(deletes))
+        for todo_id, position in deletes.items():
+            results[position] = (
+                {'status': 204} if todo_id in found
+                else self._not_found(todo_id)
+            )
+
+        for chunk in chunked(list(found), config.BATCH_CHUNK_SIZE):
+            (models.Todo
+             .delete()
+             .where(models.Todo.id.in_(chunk))
+             .execute())
+
+    @staticmethod
+    def _updated(todo_id, args):
+        todo = dict(args, id=todo_id)
+        return {'status': 200, 'todo': marshal(todo, todo_fields)}
+
+    @staticmethod
+    def _not_found(todo_id):
+        return {
+            'status': 404,
+            'message': 'Todo {} does not exist'.format(todo_id)
+        }
+
+
+class ToDoExport(Resource):
+    """Every todo, in id order, as NDJSON or CSV (`?format=ndjson` or
+    `?format=csv`, or by the Accept header), for backups and migrations.
+    The rows stream from a cursor, a chunk at a time, so memory use stays
+    flat however big the table is, and (unsharded) the whole export is
+    read from one snapshot.
+    """
+
+    def get(self):
+        require_sqlite('Exports')
+        fmt = request.args.get('format') or export_format()
+        if fmt not in bulk.FORMATS:
+            abort(400, message={'format': 'format must be one of: {}'.format(
+                ', '.join(sorted(bulk.FORMATS)))})
+
+        columns = bulk.export_columns()
+        query = models.Todo.select().order_by(models.Todo.id)
+        rows = fetch_rows(query, columns, [0], False)
+        response = Response(stream_with_context(bulk.export_rows(rows, fmt)),
+                            mimetype=bulk.FORMATS[fmt])
+        response.headers['Content-Disposition'] = (
+            'attachment; filename="todos.{}"'.format(fmt))
+        return response
+
+
+class ToDoImport(Resource):
+    """Creates todos from an NDJSON (`Content-Type: application/x-ndjson`)
+    or CSV (`text/csv`) request body of any size, such as an export (whose
+    ids are ignored: every todo gets a new one). See
+    `bulk.import_todos()`.
+
+    The body is read as it arrives, and the response streams NDJSON
+    progress as the chunks commit, ending with a summary of what was
+    imported and which rows were rejected (invalid rows don't stop the
+    import).
+    """
+
+    def post(self):
+        require_sqlite('Imports')
+        fmt = {mimetype: name for name, mimetype in bulk.FORMATS.items()
+               }.get(request.mimetype)
+        if fmt is None:
+            abort(415, message='Send the todos as {}'.format(
+                ' or '.join(sorted(bulk.FORMATS.values()))))
+
+        lines = codecs.iterdecode(request.stream, 'utf-8')
+        progress = bulk.import_todos(bulk.READERS[fmt](lines),
+                                     on_commit=record_imported)
+        return Response(stream_with_context(import_report(progress)),
+                        mimetype='application/x-ndjson')
+
+
+class ToDoStats(Resource):
+    """How many todos there are, completed and pending, and how many were
+    created on each day (by `created_date`), for counts like the UI's "N
+    remaining" without fetching the collection. The storage keeps these
+    counts as the todos are written (see `models.TodoStats`), so nothing is
+    counted here.
+    """
+
+    def get(self):
+        etag = version_etag(storage.REPOSITORY.version(), 'stats')
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+
+        total, completed, days = storage.REPOSITORY.stats()
+        response_body = {
+            'total': total,
+            'completed': completed,
+            'pending': total - completed,
+            'created_per_day': [{'date': day, 'count': count}
+                                for day, count in days],
+        }
+        return response_body, 200, {'ETag': quote_etag(etag)}
+
+
+class ToDoChanges(Resource):
+    """A Server-Sent Events stream of every create, update and delete,
+    each event carrying the change's sequence number (in the event id) and
+    the todo. A client that reconnects with `Last-Event-ID` (as
+    EventSource does) carries on from there; one without only gets changes
+    from now on.
+
+    Each stream holds a server thread (a `serve.py` worker, or one of the
+    ASGI pool's threads) for as long as it is open, so the feed is off
+    unless `config.CHANGES_ENABLED` is set.
+    """
+
+    def get(self):
+        if not config.CHANGES_ENABLED:
+            abort(404, message='The change feed is off')
+        log = changes.LOG
+        last_event_id = request.headers.get(
+            'Last-Event-ID', request.args.get('last_event_id'))
+        if last_event_id is None:
+            last_seq = log.last_seq
+        else:
+            try:
+                last_seq = changes.resume_seq(last_event_id, log)
+            except ValueError:
+                abort(400, message='Invalid Last-Event-ID')
+
+        # Not stream_with_context: the stream doesn't need the database,
+        # so the request (and its connection) is done with straight away
+        response = Response(changes.stream(last_seq, log=log),
+                            mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # stop nginx from buffering the events
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+
 todos_api = Blueprint(MODULE_PATH, NAMESPACE)
 api = Api(todos_api)
 
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """flask_restful's own JSON representation, but compact (even in debug
+    mode, where flask_restful would indent it) and through the faster
+    encoder if there is one
+    """
+    response = Response(serializers.dumps(data), status=code,
+                        mimetype='application/json')
+    response.headers.extend(headers or {})
+    return response
+
+
 api.add_resource(
     ToDoList,
     '/todos',
     endpoint='todos'
 )
+api.add_resource(
+    ToDoBatch,
+    '/todos/batch',
+    endpoint='todos_batch'
+)
+api.add_resource(
+    ToDoExport,
+    '/todos/export',
+    endpoint='todos_export'
+)
+api.add_resource(
+    ToDoImport,
+    '/todos/import',
+    endpoint='todos_import'
+)
+api.add_resource(
+    ToDoStats,
+    '/todos/stats',
+    endpoint='todos_stats'
+)
+api.add_resource(
+    ToDoChanges,
+    '/todos/changes',
+    endpoint='todos_changes'
+)
 api.add_resource(
     ToDo,
     '/todos/<int:id>',
@@ -0,0 +1,298 @@
+"""Production launcher: serves the app from a pre-forked pool of worker
+processes sharing one listening socket.
+
+    python3 serve.py [--bind HOST:PORT] [--workers N] [--max-requests N]
+                     [--debug]
+
+The master process binds the socket and initialises the database once,
+then forks the workers. Each worker swaps the database inherited from the
+master for its own, and handles one request at a time until it has served
+`--max-requests` requests, when it exits and the master starts a fresh one
+in its place (so a worker's memory can't grow without bound).
+
+Signals (to the master):
+    SIGHUP              graceful restart: start a new set of workers, and
+                        let the old ones finish their current request
+    SIGTERM, SIGINT     graceful shutdown (after config.GRACEFUL_TIMEOUT
+                        seconds any worker still running is killed)
+
+Debug mode (tracebacks in responses) is off unless `--debug` is given.
+"""
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import app
+import cache
+import changes
+import config
+import limits
+import models
+import storage
+import writes
+
+
+logger = logging.getLogger(__name__)
+
+
+# Helper Functions
+# ----------------
+def bind(host, port):
+    """The listening socket every worker accepts from"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(config.LISTEN_BACKLOG)
+    listener.set_inheritable(True)
+    # Every worker waits on the socket and they all wake for a new
+    # connection, but only one gets it: non-blocking, the others' accept()
+    # fails straight away (and they go back to waiting) rather than
+    # blocking until the next connection.
+    listener.setblocking(False)
+    return listener
+
+
+def max_requests_for_worker(max_requests, jitter):
+    """Per-worker request limit, randomised so that workers started
+    together don't all restart together
+    """
+    if not max_requests:
+        return 0
+    return max_requests + random.randint(0, jitter)
+
+
+# Workers
+# -------
+class Worker:
+    """Serves requests from `listener`, one at a time, until it has served
+    `max_requests` of them (0 for no limit) or is asked to stop
+    """
+
+    # how often (in seconds) a worker waiting for a connection checks
+    # whether it has been asked to stop
+    poll_interval = 0.5
+
+    def __init__(self, listener, max_requests, debug=False):
+        self.listener = listener
+        self.max_requests = max_requests
+        self.debug = debug
+        self.served = 0
+        self.stopping = False
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self):
+        app.app.debug = self.debug
+        host, port = self.listener.getsockname()[:2]
+        server = make_server(host, port, app.app,
+                             request_handler=WSGIRequestHandler,
+                             fd=self.listener.fileno())
+        server.timeout = self.poll_interval
+
+        process_request = server.process_request
+
+        def count_and_process_request(request, client_address):
+            self.served += 1
+            process_request(request, client_address)
+        server.process_request = count_and_process_request
+
+        try:
+            while not self.stopping:
+                if self.max_requests and self.served >= self.max_requests:
+                    logger.info('Worker %d recycling after %d requests',
+                                os.getpid(), self.served)
+                    break
+                # handle_request() returns after one request, or after
+                # server.timeout seconds without a connection
+                server.handle_request()
+        finally:
+            # the socket is shared: close our copy, not the listener
+            server.socket.close()
+            models.close_database()
+
+
+def start_worker(listener, max_requests, debug):
+    """Fork a worker process. Returns its pid (in the master)."""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # in the worker
+    status = 0
+    try:
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # Ctrl-C goes to the whole process group: leave it to the master
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        worker = Worker(listener, max_requests, debug)
+        signal.signal(signal.SIGTERM, worker.stop)
+        models.reopen_after_fork()
+        # (a log, and boot id, of its own: see changes.resume_seq())
+        changes.initialize()
+        cache.initialize()
+        writes.initialize()
+        limits.initialize()
+        worker.run()
+    except Exception:
+        logger.exception('Worker %d failed', os.getpid())
+        status = 1
+    finally:
+        # never return into the master's code
+        os._exit(status)
+
+
+# The Master
+# ----------
+class Master:
+    """Keeps `workers` workers running, replacing any that exit"""
+
+    def __init__(self, listener, workers, max_requests, jitter, debug=False,
+                 graceful_timeout=None):
+        self.listener = listener
+        self.workers = workers
+        self.max_requests = max_requests
+        self.jitter = jitter
+        self.debug = debug
+        if graceful_timeout is None:
+            graceful_timeout = config.GRACEFUL_TIMEOUT
+        self.graceful_timeout = graceful_timeout
+        self.pids = set()
+        self.retiring = set()  # old workers finishing up after a restart
+        self.stopping = False
+        self.restarting = False
+
+    def spawn(self):
+        while len(self.pids) < self.workers:
+            pid = start_worker(
+                self.listener,
+                max_requests_for_worker(self.max_requests, self.jitter),
+                self.debug,
+            )
+            self.pids.add(pid)
+
+    def reap(self):
+        """Collect every worker that has exited"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.pids and not self.stopping:
+                logger.info('Worker %d exited (status %d), replacing it',
+                            pid, status)
+            self.pids.discard(pid)
+            self.retiring.discard(pid)
+
+    def kill(self, pids, sig):
+        for pid in list(pids):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def handle_hup(self, *args):
+        self.restarting = True
+
+    def handle_term(self, *args):
+        self.stopping = True
+
+    def restart(self):
+        logger.info('Restarting workers')
+        self.restarting = False
+        old = set(self.pids)
+        self.pids.clear()
+        self.retiring |= old
+        self.spawn()
+        self.kill(old, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.handle_hup)
+        signal.signal(signal.SIGTERM, self.handle_term)
+        signal.signal(signal.SIGINT, self.handle_term)
+        logger.info('Listening on %s:%d with %d workers',
+                    *self.listener.getsockname()[:2], self.workers)
+        self.spawn()
+        while not self.stopping:
+            if self.restarting:
+                self.restart()
+            self.reap()
+            self.spawn()
+            time.sleep(0.1)
+        self.shutdown()
+
+    def shutdown(self):
+        logger.info('Stopping workers')
+        running = self.pids | self.retiring
+        self.kill(running, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while (self.pids or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        if self.pids or self.retiring:
+            logger.warning('Killing workers that did not stop in time')
+            self.kill(self.pids | self.retiring, signal.SIGKILL)
+            while self.pids or self.retiring:
+                try:
+                    pid, _ = os.waitpid(-1, 0)
+                except ChildProcessError:
+                    break
+                self.pids.discard(pid)
+                self.retiring.discard(pid)
+        self.listener.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--bind', default='{}:{}'.format(config.HOST,
+                                                         config.PORT),
+                        help='HOST:PORT to listen on')
+    parser.add_argument('--workers', type=int,
+                        default=config.WORKERS or os.cpu_count() or 1,
+                        help='worker processes (default: the CPU count)')
+    parser.add_argument('--max-requests', type=int,
+                        default=config.WORKER_MAX_REQUESTS,
+                        help='restart a worker after this many requests '
+                             '(0 for never)')
+    parser.add_argument('--max-requests-jitter', type=int,
+                        default=config.WORKER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--graceful-timeout', type=float,
+                        default=config.GRACEFUL_TIMEOUT,
+                        help='seconds workers get to finish when stopping')
+    parser.add_argument('--database', default=config.DATABASE_FILENAME,
+                        help='SQLite database file')
+    parser.add_argument('--debug', action='store_true',
+                        help='turn on Flask debug mode')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    host, _, port = args.bind.rpartition(':')
+
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(process)d] %(levelname)s %(message)s')
+
+    config.DATABASE_FILENAME = args.database
+    # once, here, rather than in every worker (which each get a copy of a
+    # memory repository, so they don't share todos)
+    storage.initialize()
+    listener = bind(host or '0.0.0.0', int(port))
+    Master(listener, args.workers, args.max_requests,
+           args.max_requests_jitter, debug=args.debug,
+           graceful_timeout=args.graceful_timeout).run()
+    return 0
+
+
+# ----------------
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,14 +2,68 @@
 
 angular.module('todoListApp')
 .controller('mainCtrl', function($scope, Todo){
-  
+
   $scope.todos = Todo.query();
-  
+
   $scope.addTodo = function() {
     var todo = new Todo();
     todo.name = 'New task!'
     todo.completed = false;
     $scope.todos.unshift(todo);
   };
-  
-})
\ No newline at end of file
+
+  // Changes made by other clients arrive on the change feed, so there is
+  // no need to re-fetch the whole list
+  function indexOfTodo(id) {
+    for (var i = 0; i < $scope.todos.length; i++) {
+      if ($scope.todos[i].id === id) {
+        return i;
+      }
+    }
+    return -1;
+  }
+
+  function applyChange(event) {
+    var change = JSON.parse(event.data);
+    var index = indexOfTodo(change.todo.id);
+    $scope.$apply(function() {
+      if (change.op === 'delete') {
+        if (index !== -1) {
+          $scope.todos.splice(index, 1);
+        }
+      } else if (index !== -1) {
+        // don't overwrite a todo that is being edited here
+        if (!$scope.todos[index].edited) {
+          angular.extend($scope.todos[index], change.todo);
+        }
+      } else if (change.op === 'create') {
+        // our own new todos only get their id once the save returns, so
+        // one with the same name and no id yet is probably this one
+        var ours = $scope.todos.some(function(todo) {
+          return !todo.id && todo.name === change.todo.name;
+        });
+        if (!ours) {
+          $scope.todos.push(new Todo(change.todo));
+        }
+      }
+    });
+  }
+
+  // (the page says whether the feed is on: see config.CHANGES_ENABLED)
+  if (window.EventSource && document.body.hasAttribute('data-change-feed')) {
+    var feed = new EventSource('/api/v1/todos/changes');
+    ['create', 'update', 'delete'].forEach(function(op) {
+      feed.addEventListener(op, applyChange);
+    });
+    // we missed too much to catch up: start again from the full list
+    feed.addEventListener('reset', function() {
+      $scope.$apply(function() {
+        $scope.todos = Todo.query();
+      });
+    });
+    $scope.$on('$destroy', function() {
+      feed.close();
+    });
+  }
+
+})
@@ -0,0 +1,594 @@
+import array
+import bisect
+import datetime
+import heapq
+import itertools
+import operator
+import threading
+
+from peewee import Expression, Tuple
+
+import config
+import models
+import writes
+
+
+# Sorting and Rows
+# ----------------
+# Each sort maps to the columns its keyset is built from. The id is always
+# the last column, so that the key is unique and rows with the same
+# created_date still page correctly. Prefix the sort with '-' to reverse
+# it. 'rank' (relevance, best first) is only for searches (`?q=`), and is
+# their default.
+SORT_KEYS = {
+    'id': ('id',),
+    'created_date': ('created_date', 'id'),
+    'rank': ('rank', 'id'),
+}
+SORT_CHOICES = tuple(SORT_KEYS) + tuple('-' + key for key in SORT_KEYS)
+
+# The JSON types the key columns' values have in a cursor
+KEY_TYPES = {
+    'id': int,
+    'created_date': str,
+    'rank': (int, float),
+}
+
+# Every row a repository lists starts with these (the columns of
+# `resources.todos.todo_fields`), followed by whichever of its sort's key
+# columns they don't include
+ROW_COLUMNS = ('id', 'name', 'completed')
+
+
+def row_columns(sort):
+    """The columns of the rows listed in `sort` order, and the positions
+    of the sort's key columns among them
+    """
+    names = list(ROW_COLUMNS)
+    for name in SORT_KEYS[sort.lstrip('-')]:
+        if name not in names:
+            names.append(name)
+    return names, [names.index(name) for name in SORT_KEYS[sort.lstrip('-')]]
+
+
+class QueryError(ValueError):
+    """A list query that can't be run as asked. `message` is for the 400
+    response, as reqparse would give it ({argument: message}).
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class Unsupported(Exception):
+    """Something this storage engine can't do (the message says what)"""
+
+
+class Repository:
+    """The todo operations the collection and item endpoints are built
+    on. The engines (`SqliteRepository`, `MemoryRepository`) must behave
+    the same through it, which `tests/test_storage.py` checks.
+
+    Todos are handed out as records: objects with `id`, `name`,
+    `completed` and `created_date` attributes. Changing one doesn't change
+    the todo.
+    """
+
+    def initialize(self):
+        """Get the storage ready (once, at startup)"""
+
+    def connect(self):
+        """Called as each API request starts"""
+
+    def release(self):
+        """Called as each API request is torn down (after a streamed
+        response has been sent in full)
+        """
+
+    def version(self, todo_id=None):
+        """A number that changes with every write (that could change todo
+        `todo_id`, if given), for ETags
+        """
+        raise NotImplementedError
+
+    def get(self, todo_id):
+        """The todo's record, or None if there is no such todo"""
+        raise NotImplementedError
+
+    def create(self, name, completed=False):
+        """Create a todo (with the next id) and return its record"""
+        raise NotImplementedError
+
+    def update(self, todo_id, name, completed):
+        """Update a todo and return its record, or None if there is no
+        such todo
+        """
+        raise NotImplementedError
+
+    def delete(self, todo_id):
+        """Delete a todo. Returns whether there was one to delete."""
+        raise NotImplementedError
+
+    def list(self, completed=None, sort='id', after=None, limit=None,
+             q=None):
+        """The todos, filtered by `completed` (if not None) and in `sort`
+        order, after the keyset `after` (a decoded cursor: (sort, values))
+        and at most `limit` of them, as row tuples laid out as
+        `row_columns(sort)` says. `q` searches the names.
+
+        Returns the rows (an iterator, which reads them as it goes when
+        there is no limit) and the key positions. Raises QueryError, or
+        Unsupported, straight away (not as the rows are read).
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """(total, completed, created per day): how many todos there are,
+        how many of them are completed, and a list of (day, how many were
+        created on it) in day order, days as 'YYYY-MM-DD', for the days
+        that have todos. Kept up to date as the todos are written, so
+        reading them doesn't take longer the more todos there are.
+        """
+        raise NotImplementedError
+
+
+# SQLite
+# ------
+# The key columns of each sort
+KEY_COLUMNS = {
+    'id': models.Todo.id,
+    'created_date': models.Todo.created_date,
+    'rank': models.TodoSearch.rank,
+}
+
+
+def list_query(args):
+    """Build the collection query from the parsed list arguments: the
+    `q` search, the `completed` filter, the `sort` order, and the keyset
+    seek past the `after` cursor.
+
+    Returns the query and the columns that make up its keyset (so the
+    caller can build the next cursor from the last row).
+
+    Filtering on `completed` and/or ordering by `created_date` is served
+    by the indexes on `Todo` (see `models.Todo.Meta`), and the seek is
+    a row-value comparison on the same columns, so every page is an index
+    range scan rather than a scan and sort of the whole table.
+
+    A search is a lookup in the full-text index (`models.TodoSearch`),
+    joined to the todos it finds by primary key. Only the matches are
+    sorted.
+    """
+    sort = args['sort']
+    descending = sort.startswith('-')
+    columns = [KEY_COLUMNS[name] for name in SORT_KEYS[sort.lstrip('-')]]
+
+    query = models.Todo.select()
+    if args['q'] is not None:
+        search = models.TodoSearch
+        query = (query
+                 .join(search, on=(search.rowid == models.Todo.id))
+                 .where(Expression(search.name, 'MATCH', args['q'])))
+    elif sort.lstrip('-') == 'rank':
+        raise QueryError({'sort': 'Sorting by rank needs a search (q)'})
+
+    if args['completed'] is not None:
+        query = query.where(models.Todo.completed == args['completed'])
+
+    if args['after'] is not None:
+        cursor_sort, values = args['after']
+        if cursor_sort != sort:
+            raise QueryError({'after': 'Cursor is for a different sort'})
+        key, value = Tuple(*columns), Tuple(*values)
+        query = query.where(key < value if descending else key > value)
+
+    ordering = [column.desc() if descending else column
+                for column in columns]
+    return query.order_by(*ordering), columns
+
+
+def select_columns(key_columns):
+    """The columns to select for the collection: `ROW_COLUMNS`, then any
+    key columns they don't already include (which we need for the next
+    cursor, and to merge shards). Returns them and the positions of the
+    key columns among them.
+    """
+    # (by name: `==` on a peewee field builds an expression)
+    columns = [getattr(models.Todo, name) for name in ROW_COLUMNS]
+    names = [column.name for column in columns]
+    for column in key_columns:
+        if column.name not in names:
+            names.append(column.name)
+            columns.append(column)
+    return columns, [names.index(column.name) for column in key_columns]
+
+
+def fetch_rows(query, columns, key_positions, descending, limit=None):
+    """An iterator over the row tuples of `query`, selecting `columns`,
+    and at most `limit` of them.
+
+    Sharded, the query (limit included) runs on every shard, and the
+    shards' rows are merged by their keys (at `key_positions`). Each
+    shard's rows are already in order, and keys are unique across shards
+    (they end with the id), so this is a k-way merge, which holds no more
+    than one row per shard at a time: big collections still stream in
+    constant memory, and a page is exact, whichever shards its rows came
+    from.
+    """
+    query = query.select(*columns).tuples()
+    if limit is not None:
+        query = query.limit(limit)
+    if models.shard_count() == 1:
+        return query.iterator()
+
+    cursors = []
+    for shard in range(models.shard_count()):
+        with models.using_shard(shard):
+            cursors.append(query.clone().execute().iterator())
+    rows = heapq.merge(*cursors, key=operator.itemgetter(*key_positions),
+                       reverse=descending)
+    return rows if limit is None else itertools.islice(rows, limit)
+
+
+class SqliteRepository(Repository):
+    """The todos in SQLite (see models.py), sharded or not. Each todo is
+    read and written on its own shard, and writes go through group commit
+    (writes.py) when it is on. This engine can do everything; the API's
+    searches, delta syncs, batches, imports and exports need it.
+    """
+
+    def initialize(self):
+        models.initialize()
+
+    def connect(self):
+        models.connect()
+
+    def release(self):
+        models.release_connections()
+
+    def version(self, todo_id=None):
+        if todo_id is None:
+            return models.table_version()
+        with models.using_shard(models.shard_of(todo_id)):
+            return models.table_version()
+
+    def get(self, todo_id):
+        with models.using_shard(models.shard_of(todo_id)):
+            return models.Todo.get_or_none(models.Todo.id == todo_id)
+
+    def create(self, name, completed=False):
+        # (new todos take turns between the shards; the write has
+        # committed by the time writes.run() returns, whether or not group
+        # commit is on)
+        with models.using_shard(models.next_shard()):
+            return writes.run(models.create_todo, name=name,
+                              completed=completed)
+
+    def update(self, todo_id, name, completed):
+        with models.using_shard(models.shard_of(todo_id)):
+            return writes.run(models.update_todo, todo_id, name=name,
+                              completed=completed)
+
+    def delete(self, todo_id):
+        with models.using_shard(models.shard_of(todo_id)):
+            if not writes.run(models.delete_todo, todo_id):
+                return False
+            models.compact_tombstones_if_due()
+        return True
+
+    def list(self, completed=None, sort='id', after=None, limit=None,
+             q=None):
+        query, key_columns = list_query(
+            {'completed': completed, 'sort': sort, 'after': after, 'q': q})
+        columns, key_positions = select_columns(key_columns)
+        rows = fetch_rows(query, columns, key_positions,
+                          sort.startswith('-'), limit)
+        return rows, key_positions
+
+    def stats(self):
+        days = models.todo_stats()
+        total, completed = days.pop(models.ALL_DAYS, (0, 0))
+        return total, completed, sorted(
+            (day, count) for day, (count, _) in days.items() if count)
+
+
+# Memory
+# ------
+class Bitmap:
+    """One bit per slot, in a bytearray"""
+    __slots__ = ('_bytes',)
+
+    def __init__(self, size=0):
+        self._bytes = bytearray((size + 7) // 8)
+
+    def __getitem__(self, index):
+        return self._bytes[index >> 3] >> (index & 7) & 1
+
+    def __setitem__(self, index, value):
+        position = index >> 3
+        if position >= len(self._bytes):
+            self._bytes.extend(bytes(position + 1 - len(self._bytes)))
+        if value:
+            self._bytes[position] |= 1 << (index & 7)
+        else:
+            self._bytes[position] &= 0xFF ^ (1 << (index & 7))
+
+
+class Record:
+    """A todo, as `MemoryRepository` hands it out"""
+    __slots__ = ('id', 'name', 'completed', 'created_date')
+
+    def __init__(self, id, name, completed, created_date):
+        self.id = id
+        self.name = name
+        self.completed = completed
+        self.created_date = created_date
+
+
+# created_dates are held as whole microseconds since this
+EPOCH = datetime.datetime(1970, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_micros(value):
+    return (value - EPOCH) // MICROSECOND
+
+
+def from_micros(micros):
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+
+class MemoryRepository(Repository):
+    """The todos in this process's memory, for edge caches and throwaway
+    instances: they are gone when the process stops, and each worker
+    process has its own.
+
+    The todos are held in columns, indexed by slot: ids and created_dates
+    (as microseconds) in 64 bit integer arrays, names in a list, and
+    completed in a bitmap. New todos are appended, with ids that only go
+    up, so the id column is sorted and is its own index (a binary
+    search). Another array holds the slots in created_date order. Deleted
+    todos are marked in a bitmap of live slots, and the columns are
+    compacted once more than half of them are dead.
+
+    Unlike SQLite, an id is never given out twice, even after the last
+    todo is deleted. Searches aren't supported. The stats are counters,
+    updated by each write.
+    """
+
+    # (compacting a few dead slots isn't worth it)
+    COMPACT_MIN_DEAD = 1024
+
+    def __init__(self, clock=datetime.datetime.now):
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._ids = array.array('q')
+        self._names = []
+        self._created = array.array('q')
+        self._completed = Bitmap()
+        self._live = Bitmap()
+        self._by_created = array.array('q')  # slots
+        self._dead = 0
+        self._next_id = 1
+        self._version = 0
+        self._total = 0
+        self._total_completed = 0
+        self._per_day = {}  # {'YYYY-MM-DD': todos created that day}
+
+    def version(self, todo_id=None):
+        return self._version
+
+    def get(self, todo_id):
+        with self._lock:
+            slot = self._slot(todo_id)
+            return None if slot is None else self._record(slot)
+
+    def create(self, name, completed=False):
+        with self._lock:
+            slot = len(self._ids)
+            todo_id = self._next_id
+            self._next_id += 1
+            now = self.clock()
+            created = to_micros(now)
+            self._ids.append(todo_id)
+            self._names.append(name)
+            self._created.append(created)
+            self._completed[slot] = completed
+            self._live[slot] = True
+            # (usually the newest, so at the end)
+            position = self._created_position((created, todo_id), True)
+            self._by_created.insert(position, slot)
+            self._count(now, 1, completed)
+            self._version += 1
+            return self._record(slot)
+
+    def update(self, todo_id, name, completed):
+        with self._lock:
+            slot = self._slot(todo_id)
+            if slot is None:
+                return None
+            self._names[slot] = name
+            self._total_completed += (bool(completed)
+                                      - self._completed[slot])
+            self._completed[slot] = completed
+            self._version += 1
+            return self._record(slot)
+
+    def delete(self, todo_id):
+        with self._lock:
+            slot = self._slot(todo_id)
+            if slot is None:
+                return False
+            self._live[slot] = False
+            self._count(from_micros(self._created[slot]), -1,
+                        self._completed[slot])
+            self._dead += 1
+            self._version += 1
+            if (self._dead >= self.COMPACT_MIN_DEAD
+                    and self._dead * 2 > len(self._ids)):
+                self._compact()
+            return True
+
+    def list(self, completed=None, sort='id', after=None, limit=None,
+             q=None):
+        if q is not None:
+            raise Unsupported('Searches need the SQLite storage')
+        if sort.lstrip('-') == 'rank':
+            raise QueryError({'sort': 'Sorting by rank needs a search (q)'})
+        if after is not None and after[0] != sort:
+            raise QueryError({'after': 'Cursor is for a different sort'})
+        descending = sort.startswith('-')
+        names, key_positions = row_columns(sort)
+        with_created = 'created_date' in names
+
+        with self._lock:
+            if sort.lstrip('-') == 'id':
+                slots = self._id_slots(after, descending)
+            else:
+                slots = self._created_slots(after, descending)
+            rows = self._rows(slots, completed, with_created)
+            if limit is not None:
+                # (a page is read while the lock is held)
+                rows = iter(list(itertools.islice(rows, limit)))
+        return rows, key_positions
+
+    # the columns are only ever replaced (by `_compact()`), not cut down,
+    # so a list that is still being read can carry on with the ones it
+    # started with
+    def _id_slots(self, after, descending):
+        ids = self._ids
+        if descending:
+            end = len(ids) if after is None else bisect.bisect_left(
+                ids, after[1][0])
+            return range(end - 1, -1, -1)
+        start = 0 if after is None else bisect.bisect_right(ids, after[1][0])
+        return range(start, len(ids))
+
+    def _created_slots(self, after, descending):
+        # (a copy: creates insert into the order)
+        order = self._by_created
+        if after is not None:
+            created, todo_id = after[1]
+            try:
+                key = (to_micros(datetime.datetime.fromisoformat(created)),
+                       todo_id)
+            except ValueError:
+                raise QueryError({'after': 'Invalid cursor'})
+        if descending:
+            end = (len(order) if after is None
+                   else self._created_position(key, False))
+            return order[:end][::-1]
+        start = 0 if after is None else self._created_position(key, True)
+        return order[start:]
+
+    def _rows(self, slots, completed, with_created):
+        # (the columns as they are now, not when the rows are first read)
+        return self._read(slots, completed, with_created, self._ids,
+                          self._names, self._created, self._completed,
+                          self._live)
+
+    @staticmethod
+    def _read(slots, completed, with_created, ids, names, created, done,
+              live):
+        for slot in slots:
+            if not live[slot]:
+                continue
+            flag = bool(done[slot])
+            if completed is not None and flag != completed:
+                continue
+            if with_created:
+                yield (ids[slot], names[slot], flag,
+                       from_micros(created[slot]))
+            else:
+                yield ids[slot], names[slot], flag
+
+    def stats(self):
+        with self._lock:
+            return (self._total, self._total_completed,
+                    sorted(self._per_day.items()))
+
+    def _count(self, created_date, change, completed):
+        """Add (`change` 1) or take away (-1) a todo from the stats"""
+        day = created_date.date().isoformat()
+        count = self._per_day.get(day, 0) + change
+        if count:
+            self._per_day[day] = count
+        else:
+            del self._per_day[day]
+        self._total += change
+        if completed:
+            self._total_completed += change
+
+    def _slot(self, todo_id):
+        slot = bisect.bisect_left(self._ids, todo_id)
+        if (slot < len(self._ids) and self._ids[slot] == todo_id
+                and self._live[slot]):
+            return slot
+        return None
+
+    def _record(self, slot):
+        return Record(self._ids[slot], self._names[slot],
+                      bool(self._completed[slot]),
+                      from_micros(self._created[slot]))
+
+    def _created_position(self, key, right):
+        """Where (created, id) `key` goes in the created_date order:
+        after any equal key if `right` (as `bisect_right`), else before
+        """
+        order, low, high = self._by_created, 0, len(self._by_created)
+        if high and self._created_key(order[high - 1]) < key:
+            return high
+        while low < high:
+            middle = (low + high) // 2
+            found = self._created_key(order[middle])
+            if found < key or (right and found == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _created_key(self, slot):
+        return self._created[slot], self._ids[slot]
+
+    def _compact(self):
+        live = [slot for slot in range(len(self._ids)) if self._live[slot]]
+        new_slots = {slot: new for new, slot in enumerate(live)}
+        completed, alive = Bitmap(len(live)), Bitmap(len(live))
+        for new, slot in enumerate(live):
+            completed[new] = self._completed[slot]
+            alive[new] = True
+        self._by_created = array.array('q', [
+            new_slots[slot] for slot in self._by_created if self._live[slot]])
+        self._ids = array.array('q', [self._ids[slot] for slot in live])
+        self._names = [self._names[slot] for slot in live]
+        self._created = array.array('q', [self._created[slot]
+                                          for slot in live])
+        self._completed, self._live = completed, alive
+        self._dead = 0
+
+
+# Helper Functions
+# ----------------
+# The repository the API uses (see `initialize()`)
+REPOSITORY = SqliteRepository()
+
+
+def make_repository():
+    """Build the repository selected by `config.STORAGE_BACKEND`"""
+    if config.STORAGE_BACKEND == 'sqlite':
+        return SqliteRepository()
+    if config.STORAGE_BACKEND == 'memory':
+        return MemoryRepository()
+    raise ValueError(
+        'Unknown STORAGE_BACKEND: {!r}'.format(config.STORAGE_BACKEND))
+
+
+def initialize():
+    """(Re)build `REPOSITORY` from the config and get it ready (for
+    SQLite, that is `models.initialize()`). A new memory repository starts
+    out empty.
+    """
+    global REPOSITORY
+    REPOSITORY = make_repository()
+    REPOSITORY.initialize()
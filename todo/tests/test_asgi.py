@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from urllib.parse import urlsplit
+
+import app
+import asgi
+import config
+import models
+# imported as a module (rather than importing the classes) so that the
+# test runner doesn't collect the WSGI versions of the tests twice
+from tests import test_resources
+
+
+class AsgiClient:
+    """Just enough of Flask's test client (`get()`, `post()`, ... returning a
+    Flask response) to run the resource tests against `asgi.application`
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.messages = []
+
+    def open(self, path, method='GET', data=None, headers=None,
+             content_type=None):
+        url = urlsplit(path)
+        body = data.encode() if isinstance(data, str) else (data or b'')
+        header_list = [(b'host', b'localhost')]
+        if content_type:
+            header_list.append((b'content-type', content_type.encode()))
+        for name, value in (headers or {}).items():
+            header_list.append((name.lower().encode(), value.encode()))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': method, 'scheme': 'http',
+            'path': url.path, 'root_path': '',
+            'query_string': url.query.encode(), 'headers': header_list,
+            'server': ('localhost', 80), 'client': ('127.0.0.1', 50000),
+        }
+        self.messages = []
+        asyncio.run(self._call(scope, body))
+
+        start = self.messages[0]
+        return app.app.response_class(
+            b''.join(m.get('body', b'') for m in self.messages[1:]),
+            status=start['status'],
+            headers=[(name.decode(), value.decode())
+                     for name, value in start['headers']],
+        )
+
+    async def _call(self, scope, body):
+        async def receive():
+            return {'type': 'http.request', 'body': body,
+                    'more_body': False}
+
+        async def send(message):
+            self.messages.append(message)
+
+        await self.application(scope, receive, send)
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, 'PUT', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, 'DELETE', **kwargs)
+
+
+# The resource tests, run through the ASGI application
+# ====================================================
+class TestAsgiToDoList(test_resources.TestToDoList):
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiClient(asgi.application)
+
+
+class TestAsgiToDo(test_resources.TestToDo):
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiClient(asgi.application)
+
+
+class TestAsgiToDoBatch(test_resources.TestToDoBatch):
+
+    def setUp(self):
+        super().setUp()
+        self.app = AsgiClient(asgi.application)
+
+
+class TestAsgi(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.client = AsgiClient(asgi.application)
+        models.initialize()
+
+    def tearDown(self):
+        asgi.shutdown_executor()
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    # Tests
+    # =====
+    def test_requests_run_on_the_pool(self):
+        threads = []
+
+        @app.app.before_request
+        def record_thread():
+            threads.append(threading.current_thread().name)
+
+        try:
+            self.client.get('/api/v1/todos')
+        finally:
+            app.app.before_request_funcs[None].remove(record_thread)
+
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('asgi'))
+        self.assertNotEqual(threads[0], threading.current_thread().name)
+
+    def test_streamed_list_is_sent_in_chunks(self):
+        models.Todo.insert_many(
+            [{'name': 'todo {}'.format(i)} for i in range(25)]
+        ).execute()
+        original_chunk_size = config.STREAM_CHUNK_SIZE
+        config.STREAM_CHUNK_SIZE = 10
+        try:
+            response = self.client.get('/api/v1/todos')
+        finally:
+            config.STREAM_CHUNK_SIZE = original_chunk_size
+
+        bodies = [m for m in self.client.messages
+                  if m['type'] == 'http.response.body' and m['body']]
+        self.assertGreater(len(bodies), 1)
+        self.assertFalse(self.client.messages[-1]['more_body'])
+        self.assertEqual(len(response.get_json()), 25)
+
+    def test_lifespan_initializes_and_closes_the_database(self):
+        models.close_database()
+        events = [{'type': 'lifespan.startup'},
+                  {'type': 'lifespan.shutdown'}]
+        replies = []
+
+        async def receive():
+            return events.pop(0)
+
+        async def send(message):
+            replies.append(message['type'])
+
+        asyncio.run(asgi.application({'type': 'lifespan'}, receive, send))
+
+        self.assertEqual(replies, ['lifespan.startup.complete',
+                                   'lifespan.shutdown.complete'])
+        self.assertIsNone(asgi.EXECUTOR)
+
+    def test_built_in_server_serves_the_api(self):
+        models.Todo.create(name='first test item')
+
+        async def exercise():
+            loop = asyncio.get_running_loop()
+            ready = loop.create_future()
+            server = asyncio.ensure_future(
+                asgi.serve(host='127.0.0.1', port=0, ready=ready))
+            host, port = await ready
+            reader, writer = await asyncio.open_connection(host, port)
+            # two requests on one keep-alive connection, the second with
+            # its path percent-encoded (as a client may send it)
+            responses = []
+            for path in (b'/api/v1/todos/1', b'/api/v1/todos/%31'):
+                writer.write(b'GET ' + path + b' HTTP/1.1\r\n'
+                             b'Host: localhost\r\n\r\n')
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = int([
+                    line.split(b':')[1] for line in head.split(b'\r\n')
+                    if line.lower().startswith(b'content-length')
+                ][0])
+                responses.append((head, await reader.readexactly(length)))
+            writer.close()
+            server.cancel()
+            try:
+                await server
+            except asyncio.CancelledError:
+                pass
+            return responses
+
+        responses = asyncio.run(exercise())
+
+        for head, body in responses:
+            self.assertTrue(head.startswith(b'HTTP/1.1 200 OK'))
+            self.assertEqual(json.loads(body.decode()),
+                             {'id': 1, 'name': 'first test item',
+                              'completed': False})
+
+
+if __name__ == '__main__':
+    unittest.main()
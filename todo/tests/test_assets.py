@@ -0,0 +1,96 @@
+import gzip
+import os
+import re
+import unittest
+
+import app
+import assets
+import compression
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'static')
+
+
+class TestAssets(unittest.TestCase):
+
+    # Setup and Teardown
+    # ------------------
+    def setUp(self):
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+
+    def read_static(self, name):
+        with open(os.path.join(STATIC_DIR, name), 'rb') as fh:
+            return fh.read()
+
+    # Tests
+    # -----
+    def test_index_links_fingerprinted_assets(self):
+        html = self.app.get('/').get_data(as_text=True)
+
+        url = re.search(r'src="(/static/scripts/app.js\?v=\w+)"', html)
+        self.assertIsNotNone(url)
+
+        response = self.app.get(url.group(1))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.data, self.read_static('scripts/app.js'))
+
+    def test_unfingerprinted_asset_is_revalidated(self):
+        response = self.app.get('/static/templates/todo.html')
+
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIn('ETag', response.headers)
+
+    def test_asset_is_sent_compressed_when_accepted(self):
+        response = self.app.get('/static/styles/main.css',
+                                headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data),
+                         self.read_static('styles/main.css'))
+
+    def test_asset_is_sent_plain_without_accept_encoding(self):
+        response = self.app.get('/static/styles/main.css')
+
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, self.read_static('styles/main.css'))
+
+    def test_asset_returns_304_when_etag_matches(self):
+        etag = self.app.get('/static/styles/main.css').headers['ETag']
+
+        response = self.app.get('/static/styles/main.css',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_asset_returns_404(self):
+        response = self.app.get('/static/scripts/missing.js')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_index_is_rendered_once(self):
+        self.app.get('/')
+        rendered = assets.RENDERED['index.html']
+
+        response = self.app.get('/', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertIs(assets.RENDERED['index.html'], rendered)
+        self.assertEqual(gzip.decompress(response.data),
+                         rendered.variants[None])
+
+    def test_best_encoding_respects_quality_values(self):
+        accept = app.app.test_request_context(
+            headers={'Accept-Encoding': 'gzip;q=0, deflate'}
+        ).request.accept_encodings
+
+        self.assertEqual(
+            compression.best_encoding(accept, ('gzip', 'deflate')),
+            'deflate')
+        self.assertIsNone(compression.best_encoding(accept, ('gzip',)))
+
+
+if __name__ == '__main__':
+    unittest.main()
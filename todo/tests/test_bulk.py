@@ -0,0 +1,303 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import app
+import bulk
+import changes
+import config
+import manage
+import models
+from resources.todos import TODO_PARSER, parse_batch_item
+
+
+class TestValidate(unittest.TestCase):
+
+    def test_agrees_with_the_request_parser(self):
+        items = [
+            {}, {'name': 'a'}, {'name': ''}, {'name': 5}, {'name': 1.5},
+            {'name': True}, {'name': ['first', 'second']},
+            {'completed': True},
+        ] + [
+            {'name': 'a', 'completed': completed}
+            for completed in (True, False, 'true', 'False', '1', '0', 'yes',
+                              '', 1, 0, 2, [True], ['false'], {})
+        ]
+        with app.app.test_request_context():
+            for item in items:
+                with self.subTest(item=item):
+                    args, expected = parse_batch_item(TODO_PARSER, item)
+                    values, error = bulk.validate(item)
+                    self.assertEqual(error, expected)
+                    if args is not None:
+                        self.assertEqual(values[:2],
+                                         (args['name'], args['completed']))
+
+    def test_rejects_nulls_the_database_would_refuse(self):
+        for item in ({'name': None}, {'name': 'a', 'completed': None}):
+            with self.subTest(item=item):
+                self.assertIsNotNone(bulk.validate(item)[1])
+
+    def test_reads_created_date(self):
+        values, _ = bulk.validate({'name': 'a',
+                                   'created_date': '2020-01-02 03:04:05'})
+        self.assertEqual(str(values[2]), '2020-01-02 03:04:05')
+
+        for created_date in ('yesterday', 5, '2020-01-02T03:04:05+01:00'):
+            with self.subTest(created_date=created_date):
+                self.assertEqual(
+                    bulk.validate({'name': 'a',
+                                   'created_date': created_date})[1],
+                    {'created_date': 'Invalid date'})
+
+
+class TestBulk(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+
+    def tearDown(self):
+        config.IMPORT_CHUNK_SIZE = 5000
+        config.IMPORT_MAX_ERRORS = 100
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def import_todos(self, body, content_type='application/x-ndjson'):
+        """POST an import, returning its progress lines"""
+        response = self.app.post('/api/v1/todos/import', data=body,
+                                 content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in
+                response.get_data(as_text=True).splitlines()]
+
+    def todos(self):
+        return [(todo.id, todo.name, todo.completed)
+                for todo in models.Todo.select().order_by(models.Todo.id)]
+
+    # Tests
+    # =====
+    def test_import_ndjson_skips_invalid_rows(self):
+        body = '\n'.join([
+            '{"name": "first"}',
+            '{"name": "second", "completed": true}',
+            'not json',
+            '',
+            '["not", "an", "object"]',
+            '{"completed": true}',
+            '{"name": "third", "completed": "maybe"}',
+            '{"name": "fourth", "completed": "false"}',
+        ])
+
+        report = self.import_todos(body)
+
+        self.assertEqual(report, [{
+            'lines': 8, 'imported': 3, 'rejected': 4, 'done': True,
+            'errors': [
+                {'line': 3, 'message': 'Invalid JSON'},
+                {'line': 5, 'message': 'Expected a JSON object'},
+                {'line': 6, 'message': {'name': 'No todo name provided'}},
+                {'line': 7,
+                 'message': {'completed': 'Invalid value for complete'}},
+            ],
+        }])
+        self.assertEqual(self.todos(), [(1, 'first', False),
+                                        (2, 'second', True),
+                                        (3, 'fourth', False)])
+
+    def test_import_csv(self):
+        body = ('name,completed\n'
+                'plain,true\n'
+                '"with, a comma",false\n'
+                '"over\ntwo lines"\n'
+                'bad,yes\n')
+
+        report = self.import_todos(body, 'text/csv')
+
+        self.assertEqual(report[-1]['imported'], 3)
+        self.assertEqual(report[-1]['errors'], [
+            {'line': 6, 'message': {'completed': 'Invalid value for complete'}}
+        ])
+        self.assertEqual(self.todos(), [(1, 'plain', True),
+                                        (2, 'with, a comma', False),
+                                        (3, 'over\ntwo lines', False)])
+
+    def test_import_reports_progress_for_each_chunk(self):
+        config.IMPORT_CHUNK_SIZE = 2
+        body = '\n'.join(json.dumps({'name': 'todo {}'.format(n)})
+                         for n in range(5))
+
+        report = self.import_todos(body)
+
+        self.assertEqual([line['imported'] for line in report], [2, 4, 5])
+        self.assertNotIn('done', report[0])
+        self.assertTrue(report[-1]['done'])
+
+    def test_import_keeps_only_the_first_errors(self):
+        config.IMPORT_MAX_ERRORS = 2
+
+        report = self.import_todos('{}\n' * 5)
+
+        self.assertEqual(report[-1]['rejected'], 5)
+        self.assertEqual([error['line'] for error in report[-1]['errors']],
+                         [1, 2])
+
+    def test_invalid_utf8_stops_the_import(self):
+        report = self.import_todos(b'{"name": "kept"}\n\xff\xfe\n'
+                                   b'{"name": "never read"}\n')
+
+        self.assertEqual(report[-1]['imported'], 1)
+        self.assertEqual(report[-1]['errors'], [
+            {'line': 2, 'message': 'Invalid UTF-8: the import stopped here'}
+        ])
+        self.assertEqual(self.todos(), [(1, 'kept', False)])
+
+    def test_import_needs_a_known_content_type(self):
+        response = self.app.post('/api/v1/todos/import', data='[]',
+                                 content_type='application/json')
+
+        self.assertEqual(response.status_code, 415)
+
+    def test_imported_todos_are_searchable_and_synced(self):
+        config.CHANGES_ENABLED = True
+        self.addCleanup(setattr, config, 'CHANGES_ENABLED', False)
+        self.app.post('/api/v1/todos', data={'name': 'made by hand'})
+        version = int(self.app.get('/api/v1/todos').headers['X-Version'])
+        last_seq = changes.LOG.last_seq
+
+        self.import_todos('{"name": "buy milk"}\n{"name": "oat milk"}\n')
+
+        response = self.app.get('/api/v1/todos?q=milk&sort=id')
+        self.assertEqual([todo['id'] for todo in response.get_json()], [2, 3])
+        delta = self.app.get('/api/v1/todos?since={}'.format(version))
+        self.assertEqual([todo['id'] for todo in delta.get_json()['changed']],
+                         [2, 3])
+        self.assertEqual(
+            [(change.op, change.todo)
+             for change in changes.LOG.since(last_seq)],
+            [('create', {'id': 2, 'name': 'buy milk', 'completed': False}),
+             ('create', {'id': 3, 'name': 'oat milk', 'completed': False})])
+
+        # single creates are still indexed and versioned by the triggers
+        self.app.post('/api/v1/todos', data={'name': 'more milk'})
+        response = self.app.get('/api/v1/todos?q=milk&sort=id')
+        self.assertEqual([todo['id'] for todo in response.get_json()],
+                         [2, 3, 4])
+
+    def test_import_clears_the_tombstone_of_a_reused_id(self):
+        self.app.post('/api/v1/todos', data={'name': 'deleted'})
+        self.app.delete('/api/v1/todos/1')
+
+        self.import_todos('{"name": "reborn"}\n')
+
+        delta = self.app.get('/api/v1/todos?since=0').get_json()
+        self.assertEqual(delta['deleted'], [])
+        self.assertEqual([todo['id'] for todo in delta['changed']], [1])
+
+    def test_export_round_trips_through_import(self):
+        self.import_todos('\n'.join([
+            '{"name": "first", "created_date": "2020-01-02T03:04:05"}',
+            '{"name": "with, \\"quotes\\"", "completed": true}',
+        ]))
+        for fmt, mimetype in bulk.FORMATS.items():
+            with self.subTest(fmt):
+                url = '/api/v1/todos/export?format={}'.format(fmt)
+                response = self.app.get(url)
+                self.assertEqual(response.mimetype, mimetype)
+                exported = response.get_data()
+                # (so that the import gives them the same ids again)
+                models.Todo.delete().execute()
+
+                self.import_todos(exported, mimetype)
+
+                self.assertEqual(self.app.get(url).get_data(), exported)
+        self.assertEqual(self.todos(), [(1, 'first', False),
+                                        (2, 'with, "quotes"', True)])
+
+    def test_export_format_follows_accept(self):
+        self.import_todos('{"name": "todo"}\n')
+
+        for accept, mimetype in [('text/csv', 'text/csv'),
+                                 ('*/*', 'application/x-ndjson')]:
+            response = self.app.get('/api/v1/todos/export',
+                                    headers={'Accept': accept})
+            response.get_data()
+            self.assertEqual(response.mimetype, mimetype)
+        response = self.app.get('/api/v1/todos/export?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_manage_import_and_export(self):
+        models.close_database()
+        fh, filename = tempfile.mkstemp(suffix='.csv')
+        os.close(fh)
+        self.addCleanup(os.unlink, filename)
+        with open(filename, 'w') as f:
+            f.write('name,completed\nfrom a file,true\n,nope\n')
+
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            manage.main(['--database', config.DATABASE_FILENAME,
+                         'import', filename])
+            manage.main(['--database', config.DATABASE_FILENAME,
+                         '--format', 'ndjson', 'export', filename])
+
+        self.assertIn('3 lines read, 1 imported, 1 rejected',
+                      errors.getvalue())
+        self.assertIn("line 3: {'completed': 'Invalid value for complete'}",
+                      errors.getvalue())
+        with open(filename) as f:
+            self.assertEqual(json.loads(f.read()), {
+                'id': 1, 'name': 'from a file', 'completed': True,
+                'created_date': models.Todo.get_by_id(1).created_date
+                .isoformat(' ')})
+
+
+class TestShardedBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        config.DATABASE_SHARDS = 2
+        config.IMPORT_CHUNK_SIZE = 3
+        self.app = app.app.test_client()
+        models.initialize()
+
+    def tearDown(self):
+        models.close_database()
+        filenames = [models.shard_filename(shard) for shard in range(2)]
+        config.DATABASE_SHARDS = 1
+        config.IMPORT_CHUNK_SIZE = 5000
+        os.close(self.temp_db_fh)
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def test_chunks_take_turns_between_shards(self):
+        body = '\n'.join(json.dumps({'name': 'todo {}'.format(n)})
+                         for n in range(9))
+
+        self.app.post('/api/v1/todos/import', data=body,
+                      content_type='application/x-ndjson').get_data()
+
+        for shard in range(2):
+            with models.using_shard(shard):
+                ids = [todo.id for todo in models.Todo.select()]
+            self.assertTrue(ids)
+            self.assertEqual({models.shard_of(i) for i in ids}, {shard})
+        lines = self.app.get('/api/v1/todos/export').get_data(
+            as_text=True).splitlines()
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual(len(exported), 9)
+        self.assertEqual([todo['id'] for todo in exported],
+                         sorted(todo['id'] for todo in exported))
+
+
+if __name__ == '__main__':
+    unittest.main()
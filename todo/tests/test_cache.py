@@ -0,0 +1,239 @@
+import json
+import os
+import tempfile
+import unittest
+
+import app
+import cache
+import config
+import models
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def response(body):
+    return cache.CachedResponse(body, 'application/json', ())
+
+
+class BackendTests:
+    """Behaviour every cache backend must have. Mixed into a TestCase that
+    provides `make_backend(**bounds)`.
+    """
+
+    def backend(self, max_entries=3, max_bytes=100, max_entry_bytes=50,
+                ttl=10):
+        self.clock = FakeClock()
+        return self.make_backend(max_entries=max_entries,
+                                 max_bytes=max_bytes,
+                                 max_entry_bytes=max_entry_bytes,
+                                 ttl=ttl, clock=self.clock)
+
+    # Tests
+    # =====
+    def test_get_returns_what_was_set(self):
+        backend = self.backend()
+        value = cache.CachedResponse(b'[1]', 'application/json',
+                                     (('X-Next-Cursor', 'abc'),))
+
+        backend.set('key', value)
+
+        self.assertEqual(backend.get('key'), value)
+        self.assertEqual(backend.stats()['hits'], 1)
+
+    def test_get_of_missing_key_counts_a_miss(self):
+        backend = self.backend()
+
+        self.assertIsNone(backend.get('key'))
+        self.assertEqual(backend.stats()['misses'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        backend = self.backend(ttl=10)
+        backend.set('key', response(b'1'))
+
+        self.clock.now = 11
+
+        self.assertIsNone(backend.get('key'))
+        self.assertEqual(backend.stats()['expirations'], 1)
+
+    def test_least_recently_used_entry_is_evicted_first(self):
+        backend = self.backend(max_entries=2)
+        backend.set('a', response(b'1'))
+        self.clock.now = 1
+        backend.set('b', response(b'2'))
+        self.clock.now = 2
+        backend.get('a')
+        self.clock.now = 3
+
+        backend.set('c', response(b'3'))
+
+        self.assertIsNotNone(backend.get('a'))
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.stats()['evictions'], 1)
+
+    def test_entries_are_evicted_to_stay_under_max_bytes(self):
+        backend = self.backend(max_bytes=100)
+        backend.set('a', response(b'x' * 40))
+        self.clock.now = 1
+        backend.set('b', response(b'x' * 40))
+        self.clock.now = 2
+
+        backend.set('c', response(b'x' * 40))
+
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.stats()['bytes'], 80)
+
+    def test_entries_bigger_than_max_entry_bytes_are_not_stored(self):
+        backend = self.backend(max_entry_bytes=50)
+
+        backend.set('big', response(b'x' * 51))
+
+        self.assertIsNone(backend.get('big'))
+        self.assertEqual(backend.stats()['entries'], 0)
+
+
+class TestMemoryBackend(BackendTests, unittest.TestCase):
+
+    def make_backend(self, **kwargs):
+        return cache.MemoryBackend(**kwargs)
+
+
+class TestSqliteBackend(BackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.temp_fh, self.filename = tempfile.mkstemp()
+
+    def tearDown(self):
+        os.close(self.temp_fh)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.filename + suffix):
+                os.unlink(self.filename + suffix)
+
+    def make_backend(self, **kwargs):
+        return cache.SqliteBackend(self.filename, **kwargs)
+
+    def test_instances_share_entries(self):
+        first = self.backend()
+        second = self.make_backend(max_entries=3, max_bytes=100,
+                                   max_entry_bytes=50, ttl=10,
+                                   clock=self.clock)
+
+        first.set('key', response(b'shared'))
+
+        self.assertEqual(second.get('key').body, b'shared')
+
+
+class TestCachedResources(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+
+        config.CACHE_ENABLED = True
+        cache.initialize()
+
+    def tearDown(self):
+        config.CACHE_ENABLED = False
+        cache.initialize()
+
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    # Tests
+    # =====
+    def test_second_collection_read_is_a_hit(self):
+        models.Todo.create(name='cached')
+
+        first = self.app.get('/api/v1/todos').get_json()
+        second = self.app.get('/api/v1/todos').get_json()
+
+        self.assertEqual(first, second)
+        self.assertEqual(cache.CACHE.stats()['hits'], 1)
+
+    def test_cached_page_keeps_pagination_headers(self):
+        for i in range(3):
+            models.Todo.create(name='item {}'.format(i))
+
+        first = self.app.get('/api/v1/todos?limit=2')
+        second = self.app.get('/api/v1/todos?limit=2')
+
+        self.assertEqual(cache.CACHE.stats()['hits'], 1)
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(second.headers['X-Next-Cursor'],
+                         first.headers['X-Next-Cursor'])
+
+    def test_create_invalidates_collection(self):
+        self.app.get('/api/v1/todos')
+
+        self.app.post(
+            '/api/v1/todos',
+            data=json.dumps({'name': 'new'}),
+            content_type='application/json'
+        )
+        names = [item['name'] for item in
+                 self.app.get('/api/v1/todos').get_json()]
+
+        self.assertEqual(names, ['new'])
+
+    def test_update_retires_the_cached_item(self):
+        models.Todo.create(name='first')
+        self.app.get('/api/v1/todos/1')
+        version = models.table_version()
+
+        self.app.put(
+            '/api/v1/todos/1',
+            data=json.dumps({'name': 'renamed'}),
+            content_type='application/json'
+        )
+
+        self.assertIsNotNone(cache.CACHE.get(cache.item_key(version, 1)))
+        self.assertEqual(self.app.get('/api/v1/todos/1').get_json()['name'],
+                         'renamed')
+
+    def test_writes_by_other_processes_are_never_served_stale(self):
+        # (a write this process's cache never hears of, as one made by
+        # another worker process would be)
+        models.Todo.create(name='first')
+        self.app.get('/api/v1/todos')
+        self.app.get('/api/v1/todos/1')
+
+        models.Todo.update(name='elsewhere').execute()
+        item = self.app.get('/api/v1/todos/1')
+        collection = self.app.get('/api/v1/todos')
+
+        self.assertEqual(item.get_json()['name'], 'elsewhere')
+        self.assertEqual(collection.get_json()[0]['name'], 'elsewhere')
+        self.assertEqual(cache.CACHE.stats()['hits'], 0)
+
+    def test_delete_and_batch_invalidate_items(self):
+        models.Todo.create(name='first')
+        models.Todo.create(name='second')
+        self.app.get('/api/v1/todos/1')
+        self.app.get('/api/v1/todos/2')
+
+        self.app.delete('/api/v1/todos/1')
+        self.app.post(
+            '/api/v1/todos/batch',
+            data=json.dumps([{'op': 'update', 'id': 2, 'name': 'batched'}]),
+            content_type='application/json'
+        )
+
+        self.assertEqual(self.app.get('/api/v1/todos/1').status_code, 404)
+        self.assertEqual(self.app.get('/api/v1/todos/2').get_json()['name'],
+                         'batched')
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import app
+import assets
+import changes
+import config
+import models
+
+
+def parse_events(text):
+    """Server-Sent Events text -> [{'id': ..., 'event': ..., 'data': ...}]
+    (comments and the retry field are left out)
+    """
+    events = []
+    for block in text.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n')
+                      if line and not line.startswith(':'))
+        if 'event' in fields:
+            fields['data'] = json.loads(fields['data'])
+            events.append(fields)
+    return events
+
+
+class TestChangeLog(unittest.TestCase):
+
+    def test_since_returns_changes_after_sequence_number(self):
+        log = changes.ChangeLog(10)
+        for todo_id in range(1, 4):
+            log.append('create', {'id': todo_id})
+
+        self.assertEqual([c.seq for c in log.since(1)], [2, 3])
+        self.assertEqual(log.since(3), [])
+
+    def test_since_returns_none_once_changes_have_dropped_out(self):
+        log = changes.ChangeLog(3)
+        for todo_id in range(1, 6):
+            log.append('create', {'id': todo_id})
+
+        self.assertIsNone(log.since(1))
+        self.assertEqual([c.seq for c in log.since(2)], [3, 4, 5])
+
+    def test_since_returns_none_for_unknown_future_sequence_number(self):
+        log = changes.ChangeLog(3)
+        log.append('create', {'id': 1})
+
+        self.assertIsNone(log.since(7))
+
+    def test_resumes_only_from_its_own_event_ids(self):
+        log = changes.ChangeLog(3)
+        other = changes.ChangeLog(3)
+
+        self.assertEqual(changes.resume_seq(changes.event_id(log, 2), log),
+                         2)
+        for last_event_id in (changes.event_id(other, 2), '2', 'soon', ''):
+            with self.subTest(last_event_id=last_event_id):
+                self.assertIsNone(changes.resume_seq(last_event_id, log))
+        with self.assertRaises(ValueError):
+            changes.resume_seq(log.boot_id + '-soon', log)
+
+    def test_extend_appends_in_order(self):
+        log = changes.ChangeLog(3)
+        log.append('create', {'id': 1})
+
+        log.extend('create', ({'id': todo_id} for todo_id in (2, 3)))
+
+        self.assertEqual([(c.seq, c.todo) for c in log.since(0)],
+                         [(1, {'id': 1}), (2, {'id': 2}), (3, {'id': 3})])
+
+    def test_wait_wakes_up_on_append(self):
+        log = changes.ChangeLog(3)
+        timer = threading.Timer(
+            0.05, log.append, args=('delete', {'id': 1}))
+        timer.start()
+
+        self.assertTrue(log.wait(0, timeout=10))
+        self.assertFalse(log.wait(1, timeout=0.01))
+        timer.join()
+
+
+class TestChangeStream(unittest.TestCase):
+
+    def setUp(self):
+        self.original = (config.CHANGES_STREAM_SECONDS,
+                         config.CHANGES_HEARTBEAT_SECONDS)
+        config.CHANGES_STREAM_SECONDS = 0.05
+        config.CHANGES_HEARTBEAT_SECONDS = 0.01
+        self.log = changes.ChangeLog(3)
+
+    def tearDown(self):
+        (config.CHANGES_STREAM_SECONDS,
+         config.CHANGES_HEARTBEAT_SECONDS) = self.original
+
+    def test_stream_sends_missed_changes_then_heartbeats_and_ends(self):
+        self.log.append('create', {'id': 1, 'name': 'a', 'completed': False})
+        self.log.append('delete', {'id': 1})
+
+        text = ''.join(changes.stream(0, log=self.log))
+
+        self.assertTrue(text.startswith('retry: '))
+        self.assertIn(': keep-alive', text)
+        events = parse_events(text)
+        self.assertEqual([(e['id'], e['event']) for e in events],
+                         [(changes.event_id(self.log, 1), 'create'),
+                          (changes.event_id(self.log, 2), 'delete')])
+        self.assertEqual(events[1]['data'],
+                         {'seq': 2, 'op': 'delete', 'todo': {'id': 1}})
+
+    def test_stream_resets_a_client_that_is_too_far_behind(self):
+        for todo_id in range(1, 6):
+            self.log.append('create', {'id': todo_id})
+
+        events = parse_events(''.join(changes.stream(1, log=self.log)))
+
+        self.assertEqual([(e['id'], e['event']) for e in events],
+                         [(changes.event_id(self.log, 5), 'reset')])
+
+    def test_stream_resets_a_client_from_another_log(self):
+        self.log.append('create', {'id': 1})
+
+        events = parse_events(''.join(changes.stream(None, log=self.log)))
+
+        self.assertEqual([(e['id'], e['event']) for e in events],
+                         [(changes.event_id(self.log, 1), 'reset')])
+
+
+class TestChangesResource(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+        changes.initialize()
+        self.original_stream_seconds = config.CHANGES_STREAM_SECONDS
+        config.CHANGES_STREAM_SECONDS = 0
+        config.CHANGES_ENABLED = True
+        assets.RENDERED.clear()
+
+    def tearDown(self):
+        config.CHANGES_ENABLED = False
+        assets.RENDERED.clear()
+        config.CHANGES_STREAM_SECONDS = self.original_stream_seconds
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def changes_since(self, seq):
+        response = self.app.get(
+            '/api/v1/todos/changes',
+            headers={'Last-Event-ID': changes.event_id(changes.LOG, seq)})
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        return parse_events(response.get_data(as_text=True))
+
+    # Tests
+    # =====
+    def test_writes_appear_on_the_feed(self):
+        self.app.post('/api/v1/todos', data=json.dumps({'name': 'first'}),
+                      content_type='application/json')
+        self.app.put('/api/v1/todos/1',
+                     data=json.dumps({'name': 'renamed', 'completed': True}),
+                     content_type='application/json')
+        self.app.delete('/api/v1/todos/1')
+        # failed writes aren't changes
+        self.app.delete('/api/v1/todos/1')
+
+        events = self.changes_since(0)
+
+        self.assertEqual([e['data'] for e in events], [
+            {'seq': 1, 'op': 'create',
+             'todo': {'id': 1, 'name': 'first', 'completed': False}},
+            {'seq': 2, 'op': 'update',
+             'todo': {'id': 1, 'name': 'renamed', 'completed': True}},
+            {'seq': 3, 'op': 'delete', 'todo': {'id': 1}},
+        ])
+
+    def test_feed_resumes_after_last_event_id(self):
+        for name in ('first', 'second', 'third'):
+            self.app.post('/api/v1/todos', data=json.dumps({'name': name}),
+                          content_type='application/json')
+
+        events = self.changes_since(2)
+
+        self.assertEqual([e['id'] for e in events],
+                         [changes.event_id(changes.LOG, 3)])
+        self.assertEqual(events[0]['data']['todo']['name'], 'third')
+
+    def test_batch_writes_appear_in_request_order(self):
+        models.Todo.create(name='first')
+        self.app.post('/api/v1/todos/batch', data=json.dumps([
+            {'op': 'delete', 'id': 1},
+            {'op': 'create', 'name': 'second'},
+            {'op': 'update', 'id': 99, 'name': 'missing'},
+        ]), content_type='application/json')
+
+        events = self.changes_since(0)
+
+        self.assertEqual([(e['event'], e['data']['todo']['id'])
+                          for e in events],
+                         [('delete', 1), ('create', 2)])
+
+    def test_another_workers_last_event_id_gets_a_reset(self):
+        self.app.post('/api/v1/todos', data=json.dumps({'name': 'first'}),
+                      content_type='application/json')
+        # (as if this worker had restarted, or the client had been
+        # connected to another one)
+        response = self.app.get('/api/v1/todos/changes', headers={
+            'Last-Event-ID': changes.event_id(changes.ChangeLog(3), 0)})
+
+        events = parse_events(response.get_data(as_text=True))
+        self.assertEqual([(e['id'], e['event']) for e in events],
+                         [(changes.event_id(changes.LOG, 1), 'reset')])
+
+    def test_invalid_last_event_id_returns_400(self):
+        response = self.app.get(
+            '/api/v1/todos/changes',
+            headers={'Last-Event-ID': changes.LOG.boot_id + '-soon'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_feed_is_off_unless_enabled(self):
+        page = self.app.get('/').get_data(as_text=True)
+        self.assertIn('data-change-feed', page)
+
+        config.CHANGES_ENABLED = False
+        assets.RENDERED.clear()
+
+        response = self.app.get('/api/v1/todos/changes')
+        self.assertEqual(response.status_code, 404)
+        last_seq = changes.LOG.last_seq
+        self.app.post('/api/v1/todos', data={'name': 'unrecorded'})
+        self.assertEqual(changes.LOG.last_seq, last_seq)
+        page = self.app.get('/').get_data(as_text=True)
+        self.assertNotIn('data-change-feed', page)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import zlib
+
+import app
+import config
+import models
+
+
+class TestResponseCompression(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+        models.Todo.insert_many(
+            [{'name': 'todo {}'.format(n)} for n in range(50)]).execute()
+
+    def tearDown(self):
+        config.COMPRESS_RESPONSES = True
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def get(self, uri, encoding='gzip', **headers):
+        headers['Accept-Encoding'] = encoding
+        return self.app.get(uri, headers=headers)
+
+    # Tests
+    # =====
+    def test_streamed_collection_is_gzipped(self):
+        plain = self.app.get('/api/v1/todos').get_data()
+
+        response = self.get('/api/v1/todos')
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.get_data()), plain)
+        self.assertEqual(len(json.loads(plain.decode('utf-8'))), 50)
+
+    def test_page_is_deflated(self):
+        plain = self.app.get('/api/v1/todos?limit=20').get_data()
+
+        response = self.get('/api/v1/todos?limit=20', encoding='deflate')
+
+        self.assertEqual(response.headers['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.get_data()), plain)
+
+    def test_small_response_is_sent_plain(self):
+        response = self.get('/api/v1/todos/1')
+
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.get_json()['id'], 1)
+
+    def test_nothing_is_compressed_without_accept_encoding(self):
+        response = self.app.get('/api/v1/todos')
+
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_compressed_response_revalidates_with_weak_etag(self):
+        response = self.get('/api/v1/todos')
+        self.assertTrue(response.headers['ETag'].startswith('W/'))
+
+        response = self.get('/api/v1/todos',
+                            **{'If-None-Match': response.headers['ETag']})
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(set(response.headers['Vary'].split(', ')),
+                         {'Accept', 'Accept-Encoding'})
+
+    def test_compression_can_be_turned_off(self):
+        config.COMPRESS_RESPONSES = False
+
+        response = self.get('/api/v1/todos')
+
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_change_feed_is_not_compressed(self):
+        original = config.CHANGES_STREAM_SECONDS
+        config.CHANGES_STREAM_SECONDS = 0
+        config.CHANGES_ENABLED = True
+        try:
+            response = self.get('/api/v1/todos/changes')
+        finally:
+            config.CHANGES_STREAM_SECONDS = original
+            config.CHANGES_ENABLED = False
+
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_json_is_compact_even_in_debug_mode(self):
+        app.app.debug = True
+        try:
+            body = self.app.get('/api/v1/todos/1').get_data(as_text=True)
+        finally:
+            app.app.debug = False
+
+        self.assertEqual(body, '{"id":1,"name":"todo 0","completed":false}')
+
+
+if __name__ == '__main__':
+    unittest.main()
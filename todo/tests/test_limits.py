@@ -0,0 +1,321 @@
+import json
+import os
+import tempfile
+import unittest
+
+import app
+import config
+import limits
+import models
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestParseRate(unittest.TestCase):
+
+    def test_parses_rates(self):
+        for text, expected in [
+            ('100/hour', (100, 3600)),
+            ('100 per hour', (100, 3600)),
+            ('10/5 minutes', (10, 300)),
+            (' 2/Second ', (2, 1)),
+            ('1000 per day', (1000, 86400)),
+        ]:
+            with self.subTest(text):
+                self.assertEqual(limits.parse_rate(text), expected)
+
+    def test_rejects_anything_else(self):
+        for text in ('', 'hourly', '100', '100/fortnight', '0/hour',
+                     '-1/hour', '10/0 minutes'):
+            with self.subTest(text):
+                with self.assertRaises(ValueError):
+                    limits.parse_rate(text)
+
+
+class BucketTests:
+    """Behaviour every bucket store must have. Mixed into a TestCase that
+    provides `make_store(clock)`.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = self.make_store(self.clock)
+        self.rate = limits.Rate(3, 60)
+
+    def test_allows_a_burst_up_to_the_limit(self):
+        results = [self.store.hit('client', self.rate)[0] for _ in range(4)]
+
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_refills_steadily_over_the_period(self):
+        for _ in range(3):
+            self.store.hit('client', self.rate)
+
+        self.clock.now = 19
+        self.assertFalse(self.store.hit('client', self.rate)[0])
+        self.clock.now = 20
+        self.assertTrue(self.store.hit('client', self.rate)[0])
+        self.assertFalse(self.store.hit('client', self.rate)[0])
+
+    def test_never_holds_more_than_the_limit(self):
+        self.store.hit('client', self.rate)
+        self.clock.now = 1000
+
+        allowed, tokens = self.store.hit('client', self.rate)
+
+        self.assertTrue(allowed)
+        self.assertEqual(tokens, 2)
+
+    def exhaust_a_long_bucket_then_prune(self, store):
+        """Use up an hourly bucket, then have a per-minute one prune the
+        store after a minute. Returns the hourly bucket's next hit.
+        """
+        hourly, per_minute = limits.Rate(3, 3600), limits.Rate(3, 60)
+        for _ in range(3):
+            store.hit('hourly', hourly)
+        store.hit('per minute', per_minute)
+        self.clock.now = 61
+        store.hit('another', per_minute)
+        return store.hit('hourly', hourly)
+
+    def test_keys_have_separate_buckets(self):
+        for _ in range(3):
+            self.store.hit('one', self.rate)
+
+        self.assertFalse(self.store.hit('one', self.rate)[0])
+        self.assertTrue(self.store.hit('two', self.rate)[0])
+
+
+class TestMemoryBuckets(BucketTests, unittest.TestCase):
+
+    def make_store(self, clock):
+        return limits.MemoryBuckets(clock=clock)
+
+    def test_prunes_full_buckets(self):
+        store = limits.MemoryBuckets(clock=self.clock, max_buckets=2)
+        store.hit('one', self.rate)
+        store.hit('two', self.rate)
+        self.clock.now = 60
+
+        store.hit('three', self.rate)
+
+        self.assertEqual(list(store._buckets), ['three'])
+
+    def test_prunes_each_bucket_by_its_own_period(self):
+        store = limits.MemoryBuckets(clock=self.clock, max_buckets=2)
+
+        allowed, _ = self.exhaust_a_long_bucket_then_prune(store)
+
+        self.assertFalse(allowed)
+        self.assertNotIn('per minute', store._buckets)
+
+
+class TestSqliteBuckets(BucketTests, unittest.TestCase):
+
+    def setUp(self):
+        self.temp_fh, self.filename = tempfile.mkstemp()
+        super().setUp()
+
+    def tearDown(self):
+        os.close(self.temp_fh)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.filename + suffix):
+                os.unlink(self.filename + suffix)
+
+    def make_store(self, clock):
+        return limits.SqliteBuckets(self.filename, clock=clock)
+
+    def test_buckets_are_shared_through_the_file(self):
+        # (as they are between worker processes)
+        other = limits.SqliteBuckets(self.filename, clock=self.clock)
+        for _ in range(2):
+            self.store.hit('client', self.rate)
+
+        self.assertTrue(other.hit('client', self.rate)[0])
+        self.assertFalse(self.store.hit('client', self.rate)[0])
+
+    def test_prunes_each_bucket_by_its_own_period(self):
+        store = limits.SqliteBuckets(self.filename, clock=self.clock,
+                                     prune_every=5)
+
+        allowed, _ = self.exhaust_a_long_bucket_then_prune(store)
+
+        self.assertFalse(allowed)
+        keys = [key for (key,) in store._connection().execute(
+            'SELECT key FROM bucket ORDER BY key')]
+        self.assertEqual(keys, ['another', 'hourly'])
+
+    def test_adds_the_period_to_an_older_file(self):
+        conn = self.store._connection()
+        conn.execute('DROP TABLE bucket')
+        conn.execute('CREATE TABLE bucket (key TEXT PRIMARY KEY,'
+                     ' tokens REAL NOT NULL, updated REAL NOT NULL)')
+        conn.execute("INSERT INTO bucket VALUES ('client', 0, 0)")
+
+        store = limits.SqliteBuckets(self.filename, clock=self.clock)
+
+        self.assertFalse(store.hit('client', self.rate)[0])
+
+
+class TestLoadShedder(unittest.TestCase):
+
+    def test_sheds_beyond_max_in_flight(self):
+        shedder = limits.LoadShedder(max_in_flight=2)
+
+        self.assertIsNone(shedder.admit())
+        self.assertIsNone(shedder.admit())
+        self.assertIsNotNone(shedder.admit())
+        shedder.release()
+        self.assertIsNone(shedder.admit())
+
+    def test_sheds_while_statements_are_slow_then_recovers(self):
+        clock = FakeClock()
+        shedder = limits.LoadShedder(max_db_wait=0.1, clock=clock)
+        for _ in range(10):
+            shedder.record_query('UPDATE ...', 1.0)
+
+        self.assertIsNotNone(shedder.admit())
+        self.assertEqual(shedder.in_flight, 0)
+
+        # (without any more statements to measure)
+        clock.now = 10 * limits.DB_WAIT_HALF_LIFE
+        self.assertIsNone(shedder.admit())
+
+    def test_fast_statements_bring_the_average_down(self):
+        shedder = limits.LoadShedder(max_db_wait=0.1, clock=FakeClock())
+        shedder.record_query('UPDATE ...', 1.0)
+        for _ in range(20):
+            shedder.record_query('SELECT ...', 0.001)
+
+        self.assertIsNone(shedder.admit())
+
+
+class TestAdmissionControl(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+        config.RATE_LIMIT_BACKEND = 'memory'
+
+    def tearDown(self):
+        config.RATE_LIMIT_ENABLED = False
+        config.RATE_LIMITS = {}
+        config.RATE_LIMIT_BACKEND = 'sqlite'
+        config.DEFAULT_RATE = '100/hour'
+        config.SHED_MAX_IN_FLIGHT = None
+        config.SHED_MAX_DB_WAIT_MS = None
+        limits.initialize()
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def get_status(self, url, **kwargs):
+        # (read to the end: a streamed response is only torn down then)
+        response = self.app.get(url, **kwargs)
+        response.get_data()
+        return response.status_code
+
+    def limit(self, rate, **overrides):
+        config.RATE_LIMIT_ENABLED = True
+        config.DEFAULT_RATE = rate
+        config.RATE_LIMITS = overrides
+        limits.initialize()
+
+    # Tests
+    # =====
+    def test_default_rate_is_enforced_with_retry_after(self):
+        self.limit('2/minute')
+
+        statuses = [self.get_status('/api/v1/todos') for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+        response = self.app.get('/api/v1/todos')
+        self.assertEqual(response.headers['Retry-After'], '30')
+        self.assertEqual(response.headers['X-RateLimit-Limit'], '2')
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+        self.assertIn('Rate limit exceeded',
+                      json.loads(response.data)['message'])
+
+    def test_allowed_responses_report_what_is_left(self):
+        self.limit('5/minute')
+
+        response = self.app.get('/api/v1/todos')
+        response.get_data()
+
+        self.assertEqual(response.headers['X-RateLimit-Limit'], '5')
+        self.assertEqual(response.headers['X-RateLimit-Remaining'], '4')
+
+    def test_clients_are_limited_separately(self):
+        self.limit('1/minute')
+
+        first = self.get_status('/api/v1/todos',
+                                environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        second = self.get_status('/api/v1/todos',
+                                 environ_base={'REMOTE_ADDR': '10.0.0.2'})
+
+        self.assertEqual((first, second), (200, 200))
+
+    def test_endpoint_override_has_a_bucket_of_its_own(self):
+        self.limit('1/minute', **{'resources.todos.todos_batch': '3/minute'})
+
+        batches = [self.app.post('/api/v1/todos/batch', data='[]',
+                                 content_type='application/json').status_code
+                   for _ in range(4)]
+
+        self.assertEqual(batches, [200, 200, 200, 429])
+        self.assertEqual(self.get_status('/api/v1/todos'), 200)
+
+    def test_pages_are_not_limited(self):
+        self.limit('1/minute')
+
+        statuses = [self.get_status('/') for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 200])
+
+    def test_requests_beyond_max_in_flight_get_503(self):
+        config.SHED_MAX_IN_FLIGHT = 1
+        limits.initialize()
+        limits.SHEDDER.admit()  # (one already in flight)
+
+        response = self.app.get('/api/v1/todos')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'],
+                         str(config.SHED_RETRY_AFTER))
+        limits.SHEDDER.release()
+        self.assertEqual(self.get_status('/api/v1/todos'), 200)
+        self.assertEqual(limits.SHEDDER.in_flight, 0)
+
+    def test_slow_database_sheds_requests(self):
+        config.SHED_MAX_DB_WAIT_MS = 50
+        limits.initialize()
+
+        self.assertIn(limits.SHEDDER.record_query, models.QUERY_HOOKS)
+        for _ in range(10):
+            limits.SHEDDER.record_query('UPDATE ...', 1.0)
+
+        self.assertEqual(self.get_status('/api/v1/todos'), 503)
+
+    def test_initialize_removes_its_query_hook(self):
+        config.SHED_MAX_DB_WAIT_MS = 50
+        limits.initialize()
+        hook = limits.SHEDDER.record_query
+        config.SHED_MAX_DB_WAIT_MS = None
+
+        limits.initialize()
+
+        self.assertNotIn(hook, models.QUERY_HOOKS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+import unittest
+
+import app
+import config
+import metrics
+import models
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test',
+                                      buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value)
+
+        samples = {(name, labels.get('le')): value
+                   for name, labels, value in histogram.samples()}
+
+        self.assertEqual(samples[('test_seconds_bucket', '0.1')], 1)
+        self.assertEqual(samples[('test_seconds_bucket', '1.0')], 3)
+        self.assertEqual(samples[('test_seconds_bucket', '+Inf')], 4)
+        self.assertEqual(samples[('test_seconds_count', None)], 4)
+        self.assertAlmostEqual(samples[('test_seconds_sum', None)], 6.05)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+
+        config.METRICS_ENABLED = True
+        metrics.reset()
+
+    def tearDown(self):
+        config.METRICS_ENABLED = False
+        config.METRICS_SLOW_QUERY_SECONDS = 0.1
+        config.METRICS_N_PLUS_ONE_THRESHOLD = 10
+        metrics.reset()
+        if metrics.record_query in models.QUERY_HOOKS:
+            models.QUERY_HOOKS.remove(metrics.record_query)
+
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def scrape(self):
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True).splitlines()
+
+    # Tests
+    # =====
+    def test_metrics_is_404_when_disabled(self):
+        config.METRICS_ENABLED = False
+
+        response = self.app.get('/metrics')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_queries_are_not_timed_once_disabled(self):
+        self.app.get('/api/v1/todos')
+        self.assertIn(metrics.record_query, models.QUERY_HOOKS)
+        config.METRICS_ENABLED = False
+
+        self.app.get('/api/v1/todos')
+
+        self.assertNotIn(metrics.record_query, models.QUERY_HOOKS)
+
+    def test_requests_are_counted_by_endpoint_and_status(self):
+        self.app.get('/api/v1/todos')
+        self.app.get('/api/v1/todos')
+        self.app.get('/api/v1/todos/99')
+
+        lines = self.scrape()
+
+        self.assertIn('todo_http_requests_total{method="GET",'
+                      'endpoint="resources.todos.todos",status="200"} 2',
+                      lines)
+        self.assertIn('todo_http_requests_total{method="GET",'
+                      'endpoint="resources.todos.todo",status="404"} 1',
+                      lines)
+        self.assertIn('todo_http_request_duration_seconds_count{method="GET",'
+                      'endpoint="resources.todos.todos"} 2', lines)
+        self.assertIn('# TYPE todo_http_request_duration_seconds histogram',
+                      lines)
+
+    def test_queries_are_counted_per_endpoint(self):
+        self.app.get('/api/v1/todos?limit=10')
+
+        lines = self.scrape()
+        query_lines = [line for line in lines if line.startswith(
+            'todo_db_queries_total{endpoint="resources.todos.todos"}')]
+
+        self.assertEqual(len(query_lines), 1)
+        self.assertGreater(int(query_lines[0].split()[-1]), 0)
+        self.assertIn('todo_db_queries_per_request_count'
+                      '{endpoint="resources.todos.todos"} 1', lines)
+
+    def test_slow_queries_are_counted(self):
+        config.METRICS_SLOW_QUERY_SECONDS = 0
+
+        with self.assertLogs('metrics', level='WARNING'):
+            self.app.get('/api/v1/todos?limit=10')
+
+        self.assertTrue(any(
+            line.startswith('todo_db_slow_queries_total'
+                            '{endpoint="resources.todos.todos"}')
+            for line in self.scrape()))
+
+    def test_repeated_queries_are_flagged_as_n_plus_one(self):
+        config.METRICS_N_PLUS_ONE_THRESHOLD = 3
+        original_chunk_size = config.BATCH_CHUNK_SIZE
+        config.BATCH_CHUNK_SIZE = 1
+        try:
+            with self.assertLogs('metrics', level='WARNING'):
+                self.app.post(
+                    '/api/v1/todos/batch',
+                    data=json.dumps([{'op': 'create', 'name': str(i)}
+                                     for i in range(3)]),
+                    content_type='application/json'
+                )
+        finally:
+            config.BATCH_CHUNK_SIZE = original_chunk_size
+
+        self.assertIn('todo_db_n_plus_one_total'
+                      '{endpoint="resources.todos.todos_batch"} 1',
+                      self.scrape())
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    unittest.main()
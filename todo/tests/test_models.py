@@ -1,11 +1,17 @@
+import contextlib
+import io
 import os
+import subprocess
+import sys
 import tempfile
 import unittest
 
 import config
+import manage
 import models
 
 from peewee import *
+from playhouse.pool import PooledSqliteDatabase
 
 
 class TestTodoModel(unittest.TestCase):
@@ -22,6 +28,8 @@ class TestTodoModel(unittest.TestCase):
         models.initialize()
 
     def tearDown(self):
+        # closing the last connection also removes the WAL files
+        models.close_database()
         os.close(self.temp_db_fh)  # close the temp db
         os.unlink(config.DATABASE_FILENAME)  # remove the file
 
@@ -48,3 +56,190 @@ class TestTodoModel(unittest.TestCase):
 
     def test_initialize_uses_safe_mode_for_table_creation(self):
         models.initialize()  # should not raise (peewee.OperationalError)
+
+    def test_table_version_counts_every_write(self):
+        start = models.table_version()
+
+        todo = models.Todo.create(name='test item')
+        models.Todo.update(completed=True).execute()
+        todo.delete_instance()
+
+        self.assertEqual(models.table_version(), start + 3)
+
+    def test_initialize_keeps_existing_table_version(self):
+        models.Todo.create(name='test item')
+        version = models.table_version()
+
+        models.initialize()
+
+        self.assertEqual(models.table_version(), version)
+
+    def test_writes_stamp_rows_with_the_table_version(self):
+        first = models.Todo.create(name='first')
+        second = models.Todo.create(name='second')
+        models.Todo.update(completed=True).where(
+            models.Todo.id == first.id).execute()
+
+        versions = {todo.id: todo.version for todo in models.Todo.select()}
+
+        self.assertEqual(versions[first.id], models.table_version())
+        self.assertLess(versions[second.id], versions[first.id])
+
+    def test_delete_leaves_a_tombstone_until_the_id_is_reused(self):
+        todo = models.Todo.create(name='test item')
+        todo.delete_instance()
+
+        tombstone = models.Tombstone.get(models.Tombstone.todo_id == todo.id)
+        self.assertEqual(tombstone.version, models.table_version())
+
+        # SQLite hands out the id of the last row again
+        models.Todo.create(name='new item')
+        self.assertEqual(models.Tombstone.select().count(), 0)
+
+    def test_compact_tombstones_moves_the_sync_horizon(self):
+        todos = [models.Todo.create(name=name)
+                 for name in ('first', 'second')]
+        for todo in todos:
+            todo.delete_instance()
+        models.Tombstone.update(deleted_at=0).where(
+            models.Tombstone.todo_id == 1).execute()
+        horizon = models.Tombstone.get(models.Tombstone.todo_id == 1).version
+
+        compacted = models.compact_tombstones()
+
+        self.assertEqual(compacted, 1)
+        self.assertEqual(models.table_version(models.SYNC_HORIZON), horizon)
+        self.assertEqual(
+            [t.todo_id for t in models.Tombstone.select()], [2])
+
+    def test_initialize_adds_version_column_to_existing_table(self):
+        models.close_database()
+        db = SqliteDatabase(config.DATABASE_FILENAME)
+        db.execute_sql('DROP TABLE todo')
+        db.execute_sql('DROP TABLE tableversion')
+        db.execute_sql('CREATE TABLE todo (id INTEGER PRIMARY KEY, '
+                       'name VARCHAR(255) NOT NULL, created_date DATETIME '
+                       'NOT NULL, completed INTEGER NOT NULL)')
+        db.execute_sql("INSERT INTO todo VALUES "
+                       "(1, 'old item', '2019-01-01 00:00:00', 0)")
+        db.close()
+
+        models.initialize()
+
+        self.assertGreater(models.Todo.get_by_id(1).version, 0)
+        models.Todo.create(name='new item')
+        self.assertEqual(models.Todo.get_by_id(2).version,
+                         models.table_version())
+
+    def search(self, words):
+        cursor = models.DATABASE.execute_sql(
+            'SELECT rowid FROM todo_search WHERE todo_search MATCH ?',
+            (words,))
+        return [todo_id for todo_id, in cursor]
+
+    def test_search_index_follows_writes(self):
+        todo = models.Todo.create(name='paint the fence')
+        self.assertEqual(self.search('fence'), [todo.id])
+
+        models.Todo.update(name='fix the gate').execute()
+        self.assertEqual(self.search('fence'), [])
+        self.assertEqual(self.search('gate'), [todo.id])
+
+        todo.delete_instance()
+        self.assertEqual(self.search('gate'), [])
+
+    def test_initialize_indexes_todos_from_before_search(self):
+        models.Todo.create(name='old item')
+        models.close_database()
+        db = SqliteDatabase(config.DATABASE_FILENAME)
+        db.execute_sql('DROP TABLE todo_search')
+        db.close()
+
+        models.initialize()
+
+        self.assertEqual(self.search('old'), [1])
+
+    def test_rebuild_search_command_reindexes_every_todo(self):
+        models.DATABASE.execute_sql(
+            'DROP TRIGGER todo_search_after_insert')
+        models.Todo.create(name='missed by the index')
+        self.assertEqual(self.search('missed'), [])
+        models.close_database()
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            manage.main(['--database', config.DATABASE_FILENAME,
+                         'rebuild-search'])
+
+        self.assertEqual(output.getvalue(), 'Indexed 1 todos\n')
+        self.assertEqual(self.search('missed'), [1])
+
+    def test_initialize_binds_plain_sqlite_database_by_default(self):
+        self.assertIsInstance(models.DATABASE.obj, SqliteDatabase)
+        self.assertNotIsInstance(models.DATABASE.obj, PooledSqliteDatabase)
+        self.assertEqual(models.DATABASE.database, config.DATABASE_FILENAME)
+
+    def test_initialize_binds_pooled_database_when_configured(self):
+        original_backend = config.DATABASE_BACKEND
+        config.DATABASE_BACKEND = 'pooled'
+        try:
+            models.initialize()
+            models.Todo.create(name='pooled')
+            models.DATABASE.close()  # returns the connection to the pool
+
+            self.assertIsInstance(models.DATABASE.obj, PooledSqliteDatabase)
+            self.assertEqual(len(models.DATABASE.obj._connections), 1)
+            self.assertEqual(models.Todo.select().count(), 1)
+        finally:
+            config.DATABASE_BACKEND = original_backend
+            models.initialize()
+
+    def test_pool_is_only_imported_when_configured(self):
+        todo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, app; print("playhouse.pool" in sys.modules)'],
+            cwd=todo_dir, universal_newlines=True)
+
+        self.assertEqual(output.strip(), 'False')
+
+    def test_initialize_applies_performance_profile_pragmas(self):
+        pragmas = models.effective_pragmas()
+
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+        self.assertEqual(pragmas['temp_store'], 2)  # MEMORY
+        self.assertEqual(pragmas['busy_timeout'], 5000)
+        self.assertEqual(models.check_pragmas(), {})
+
+    def test_check_pragmas_reports_settings_that_did_not_take(self):
+        models.close_database()
+        original_filename = config.DATABASE_FILENAME
+        config.DATABASE_FILENAME = ':memory:'
+        try:
+            models.initialize()
+            mismatches = models.check_pragmas()
+        finally:
+            models.close_database()
+            config.DATABASE_FILENAME = original_filename
+
+        # in-memory databases can't use write-ahead logging
+        self.assertEqual(mismatches['journal_mode'], ('wal', 'memory'))
+
+    def test_profile_pragmas_rejects_unknown_profile(self):
+        original_profile = config.DATABASE_PROFILE
+        config.DATABASE_PROFILE = 'ludicrous speed'
+        try:
+            with self.assertRaises(ValueError):
+                models.profile_pragmas()
+        finally:
+            config.DATABASE_PROFILE = original_profile
+
+    def test_make_database_rejects_unknown_backend(self):
+        original_backend = config.DATABASE_BACKEND
+        config.DATABASE_BACKEND = 'carrier pigeon'
+        try:
+            with self.assertRaises(ValueError):
+                models.make_database()
+        finally:
+            config.DATABASE_BACKEND = original_backend
@@ -1,7 +1,9 @@
+import datetime
 import os
 import unittest
 import tempfile
 import json
+from urllib.parse import urlencode
 
 from flask import request
 
@@ -14,6 +16,8 @@ from peewee import *
 import app
 import config
 import models
+import storage
+from resources import todos
 
 
 # Throughout this file:
@@ -54,6 +58,8 @@ class TestToDoList(unittest.TestCase):
 
     def tearDown(self):
         # perform cleanup
+        # closing the last connection also removes the WAL files
+        models.close_database()
         os.close(self.temp_db_fh)  # close the file
         os.unlink(config.DATABASE_FILENAME)  # remove the file
 
@@ -106,6 +112,332 @@ class TestToDoList(unittest.TestCase):
         for key, value in expected_body.items():
             self.assertEqual(response_text[key], value)
 
+    def test_todolist_request_releases_database_connection(self):
+        models.DATABASE.close()
+
+        self.app.get('/api/v1/todos?limit=10')
+
+        self.assertTrue(models.DATABASE.is_closed())
+
+    def test_todolist_get_with_limit_returns_first_page(self):
+        for i in range(5):
+            models.Todo.create(name='item {}'.format(i))
+
+        response = self.app.get('/api/v1/todos?limit=2')
+        json_data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in json_data],
+                         ['item 0', 'item 1'])
+        self.assertIn('X-Next-Cursor', response.headers)
+        self.assertIn('rel="next"', response.headers['Link'])
+
+    def test_todolist_get_follows_cursor_to_last_page(self):
+        for i in range(5):
+            models.Todo.create(name='item {}'.format(i))
+
+        names = []
+        uri = '/api/v1/todos?limit=2'
+        while True:
+            response = self.app.get(uri)
+            names.extend(item['name'] for item in response.get_json())
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+            uri = '/api/v1/todos?limit=2&after={}'.format(cursor)
+
+        self.assertEqual(names, ['item {}'.format(i) for i in range(5)])
+
+    def test_todolist_get_with_invalid_cursor_returns_400(self):
+        response = self.app.get('/api/v1/todos?limit=2&after=not-a-cursor')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_todolist_get_with_limit_above_maximum_returns_400(self):
+        uri = '/api/v1/todos?limit={}'.format(config.MAX_PAGE_SIZE + 1)
+        response = self.app.get(uri)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_todolist_get_reads_maximum_limit_at_request_time(self):
+        original_max_page_size = config.MAX_PAGE_SIZE
+        config.MAX_PAGE_SIZE = 2
+        try:
+            response = self.app.get('/api/v1/todos?limit=3')
+        finally:
+            config.MAX_PAGE_SIZE = original_max_page_size
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['message']['limit'],
+                         'limit must be between 1 and 2')
+
+    def test_todolist_get_without_limit_streams_every_chunk(self):
+        original_chunk_size = config.STREAM_CHUNK_SIZE
+        config.STREAM_CHUNK_SIZE = 2
+        try:
+            for i in range(5):
+                models.Todo.create(name='item {}'.format(i))
+
+            response = self.app.get('/api/v1/todos')
+            json_data = json.loads(response.get_data(as_text=True))
+        finally:
+            config.STREAM_CHUNK_SIZE = original_chunk_size
+
+        self.assertEqual([item['name'] for item in json_data],
+                         ['item {}'.format(i) for i in range(5)])
+
+    def test_todolist_get_streams_ndjson_when_requested(self):
+        for i in range(3):
+            models.Todo.create(name='item {}'.format(i))
+
+        response = self.app.get(
+            '/api/v1/todos',
+            headers={'Accept': 'application/x-ndjson'}
+        )
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['name'] for line in lines],
+                         ['item 0', 'item 1', 'item 2'])
+
+    def test_todolist_get_filters_on_completed(self):
+        for i in range(4):
+            models.Todo.create(name='item {}'.format(i), completed=i % 2)
+
+        response = self.app.get('/api/v1/todos?completed=false')
+
+        self.assertEqual([item['name'] for item in response.get_json()],
+                         ['item 0', 'item 2'])
+
+    def test_todolist_get_sorts_by_created_date_descending(self):
+        start = datetime.datetime(2019, 1, 1)
+        for i in (2, 0, 1):
+            models.Todo.create(name='day {}'.format(i),
+                               created_date=start + datetime.timedelta(i))
+
+        response = self.app.get('/api/v1/todos?sort=-created_date')
+
+        self.assertEqual([item['name'] for item in response.get_json()],
+                         ['day 2', 'day 1', 'day 0'])
+
+    def test_todolist_get_pages_through_filtered_sort_with_ties(self):
+        same_time = datetime.datetime(2019, 1, 1)
+        for i in range(7):
+            models.Todo.create(name='item {}'.format(i), completed=i == 3,
+                               created_date=same_time)
+
+        names = []
+        uri = '/api/v1/todos?limit=2&completed=false&sort=-created_date'
+        while uri:
+            response = self.app.get(uri)
+            names.extend(item['name'] for item in response.get_json())
+            link = response.headers.get('Link')
+            uri = link[1:link.index('>')] if link else None
+
+        self.assertEqual(names, ['item 6', 'item 5', 'item 4', 'item 2',
+                                 'item 1', 'item 0'])
+
+    def test_todolist_get_rejects_cursor_from_another_sort(self):
+        cursor = todos.encode_cursor('id', [1])
+
+        response = self.app.get(
+            '/api/v1/todos?limit=2&sort=created_date&after=' + cursor)
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_todolist_get_rejects_unknown_sort(self):
+        response = self.app.get('/api/v1/todos?sort=name')
+
+        self.assertEqual(response.status_code, 400)
+
+    def assert_uses_index(self, **args):
+        """Guard against the list queries regressing to full table scans
+        or sorts (the plan wording is SQLite's, from 3.24 on)
+        """
+        list_args = {'completed': None, 'sort': 'id', 'after': None,
+                     'q': None}
+        list_args.update(args)
+        query, _ = storage.list_query(list_args)
+        sql, params = query.sql()
+        plan = ' / '.join(
+            row[-1] for row in models.DATABASE.execute_sql(
+                'EXPLAIN QUERY PLAN ' + sql, params)
+        )
+
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        return plan
+
+    def test_todolist_filter_and_sort_queries_use_indexes(self):
+        cursor = ('-created_date', ['2019-01-01 00:00:00', 3])
+
+        self.assertIn(
+            'SEARCH', self.assert_uses_index(completed=False))
+        self.assertIn(
+            'SEARCH', self.assert_uses_index(completed=True, sort='-id'))
+        self.assertIn(
+            'todo_completed_created_date (completed=? AND created_date<?)',
+            self.assert_uses_index(completed=False, sort='-created_date',
+                                   after=cursor))
+        self.assert_uses_index(sort='created_date')
+
+    def test_todolist_get_returns_304_when_etag_matches(self):
+        models.Todo.create(name='cached')
+        first = self.app.get('/api/v1/todos')
+        etag = first.headers['ETag']
+
+        second = self.app.get('/api/v1/todos',
+                              headers={'If-None-Match': etag})
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.get_data(), b'')
+        self.assertEqual(second.headers['ETag'], etag)
+
+    def test_todolist_etag_changes_after_write(self):
+        etag = self.app.get('/api/v1/todos').headers['ETag']
+
+        self.app.post(
+            '/api/v1/todos',
+            data=json.dumps({'name': 'new'}),
+            content_type='application/json'
+        )
+        response = self.app.get('/api/v1/todos',
+                                headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_todolist_etag_depends_on_query_string(self):
+        models.Todo.create(name='cached')
+
+        whole = self.app.get('/api/v1/todos').headers['ETag']
+        page = self.app.get('/api/v1/todos?limit=1').headers['ETag']
+
+        self.assertNotEqual(whole, page)
+
+    def test_todolist_version_header_matches_its_etag(self):
+        models.Todo.create(name='versioned')
+
+        response = self.app.get('/api/v1/todos')
+
+        etag_version = response.headers['ETag'].strip('"').split('-')[0]
+        self.assertEqual(response.headers['X-Version'], etag_version)
+
+    def test_todolist_since_returns_only_changes_and_deletions(self):
+        for name in ('first', 'second', 'third'):
+            models.Todo.create(name=name)
+        version = int(self.app.get('/api/v1/todos').headers['X-Version'])
+
+        self.app.put('/api/v1/todos/2',
+                     data=json.dumps({'name': 'renamed', 'completed': True}),
+                     content_type='application/json')
+        self.app.delete('/api/v1/todos/1')
+        response = self.app.get('/api/v1/todos?since={}'.format(version))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {
+            'version': models.table_version(),
+            'changed': [{'id': 2, 'name': 'renamed', 'completed': True}],
+            'deleted': [1],
+        })
+
+    def test_todolist_since_latest_version_is_empty(self):
+        models.Todo.create(name='first')
+        version = models.table_version()
+
+        response = self.app.get('/api/v1/todos?since={}'.format(version))
+
+        self.assertEqual(response.get_json(),
+                         {'version': version, 'changed': [], 'deleted': []})
+
+    def test_todolist_since_before_compacted_tombstones_returns_410(self):
+        todos = [models.Todo.create(name=name) for name in ('a', 'b')]
+        for todo in todos:
+            todo.delete_instance()
+        models.Tombstone.update(deleted_at=0).execute()
+        models.compact_tombstones()
+
+        response = self.app.get('/api/v1/todos?since=1')
+
+        self.assertEqual(response.status_code, 410)
+
+    def test_todolist_since_rejects_pagination_arguments(self):
+        response = self.app.get('/api/v1/todos?since=0&limit=10')
+
+        self.assertEqual(response.status_code, 400)
+
+    def search(self, q, **args):
+        args['q'] = q
+        response = self.app.get('/api/v1/todos?' + urlencode(args))
+        self.assertEqual(response.status_code, 200)
+        return [todo['name'] for todo in response.get_json()]
+
+    def test_todolist_search_matches_word_prefixes_best_first(self):
+        for name in ('Buy milk', 'walk the dog', 'milk, milk and more milk',
+                     'buy bread'):
+            models.Todo.create(name=name)
+
+        self.assertEqual(self.search('MIL'),
+                         ['milk, milk and more milk', 'Buy milk'])
+        self.assertEqual(self.search('bu mil'), ['Buy milk'])
+        self.assertEqual(self.search('ilk'), [])
+
+    def test_todolist_search_follows_writes(self):
+        models.Todo.create(name='first draft')
+        self.app.put('/api/v1/todos/1',
+                     data=json.dumps({'name': 'final copy'}),
+                     content_type='application/json')
+        self.assertEqual(self.search('draft'), [])
+        self.assertEqual(self.search('final'), ['final copy'])
+
+        self.app.delete('/api/v1/todos/1')
+        self.assertEqual(self.search('final'), [])
+
+    def test_todolist_search_pages_with_filters(self):
+        for i in range(5):
+            models.Todo.create(name='report {}'.format(i),
+                               completed=i % 2 == 0)
+        models.Todo.create(name='unrelated', completed=True)
+
+        names, cursor = [], None
+        while True:
+            args = {'q': 'rep', 'completed': 'true', 'limit': 2}
+            if cursor is not None:
+                args['after'] = cursor
+            response = self.app.get('/api/v1/todos?' + urlencode(args))
+            names.extend(todo['name'] for todo in response.get_json())
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor is None:
+                break
+
+        self.assertEqual(sorted(names),
+                         ['report 0', 'report 2', 'report 4'])
+
+    def test_todolist_search_ignores_query_syntax(self):
+        models.Todo.create(name='call "Bob" OR Alice')
+
+        self.assertEqual(self.search('"bob" OR'), ['call "Bob" OR Alice'])
+        self.assertEqual(self.search('NEAR('), [])
+
+    def test_todolist_search_rejects_bad_arguments(self):
+        for query_string in ('q=+-+', 'sort=rank', 'q=x&since=0'):
+            with self.subTest(query_string=query_string):
+                response = self.app.get('/api/v1/todos?' + query_string)
+                self.assertEqual(response.status_code, 400)
+
+    def test_todolist_search_is_an_index_lookup(self):
+        query, _ = storage.list_query({'completed': None, 'sort': 'rank',
+                                       'after': None, 'q': '"x"*'})
+        sql, params = query.sql()
+        plan = ' / '.join(
+            row[-1] for row in models.DATABASE.execute_sql(
+                'EXPLAIN QUERY PLAN ' + sql, params)
+        )
+
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+        self.assertIn('INTEGER PRIMARY KEY', plan)
+
 
 class TestToDo(unittest.TestCase):
 
@@ -120,11 +452,47 @@ class TestToDo(unittest.TestCase):
 
     def tearDown(self):
         # perform cleanup
+        # closing the last connection also removes the WAL files
+        models.close_database()
         os.close(self.temp_db_fh)  # close the file
         os.unlink(config.DATABASE_FILENAME)  # remove the file
 
     # Tests
     # =====
+    def test_todo_get_returns_item_with_etag(self):
+        models.Todo.create(name='first test item', completed=True)
+
+        response = self.app.get('/api/v1/todos/1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+                         {'id': 1, 'name': 'first test item',
+                          'completed': True})
+        self.assertIn('ETag', response.headers)
+
+    def test_todo_get_missing_item_returns_404(self):
+        response = self.app.get('/api/v1/todos/42')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_todo_get_returns_304_until_the_item_changes(self):
+        models.Todo.create(name='first test item')
+        etag = self.app.get('/api/v1/todos/1').headers['ETag']
+
+        unchanged = self.app.get('/api/v1/todos/1',
+                                 headers={'If-None-Match': etag})
+        self.app.put(
+            '/api/v1/todos/1',
+            data=json.dumps({'name': 'renamed'}),
+            content_type='application/json'
+        )
+        changed = self.app.get('/api/v1/todos/1',
+                               headers={'If-None-Match': etag})
+
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.get_json()['name'], 'renamed')
+
     def test_todo_put_with_name_change_returns_correct_response(self):
 
         test_todo_item_data = [
@@ -289,6 +657,195 @@ class TestToDo(unittest.TestCase):
         self.assertEqual(also_do_not_erase.count(), 1)
         self.assertFalse(also_do_not_erase.get().completed)
 
+    def test_todo_put_runs_one_statement(self):
+        models.Todo.create(name='first test item')
+        statements = []
+        models.QUERY_HOOKS.append(
+            lambda sql, seconds: statements.append(sql))
+        try:
+            response = self.app.put(
+                '/api/v1/todos/1',
+                data=json.dumps({'name': 'renamed', 'completed': True}),
+                content_type='application/json'
+            )
+        finally:
+            models.QUERY_HOOKS.clear()
+
+        self.assertEqual(response.get_json(),
+                         {'id': 1, 'name': 'renamed', 'completed': True})
+        if models.RETURNING_SUPPORTED:
+            self.assertEqual(len(statements), 1)
+            self.assertIn('RETURNING', statements[0])
+
+    def test_todo_put_without_returning_support(self):
+        models.Todo.create(name='first test item')
+        returning, models.RETURNING_SUPPORTED = (
+            models.RETURNING_SUPPORTED, False)
+        try:
+            response = self.app.put(
+                '/api/v1/todos/1',
+                data=json.dumps({'name': 'renamed', 'completed': True}),
+                content_type='application/json'
+            )
+            missing = self.app.put(
+                '/api/v1/todos/42',
+                data=json.dumps({'name': 'renamed'}),
+                content_type='application/json'
+            )
+        finally:
+            models.RETURNING_SUPPORTED = returning
+
+        self.assertEqual(response.get_json(),
+                         {'id': 1, 'name': 'renamed', 'completed': True})
+        self.assertEqual(missing.status_code, 404)
+
+    def test_todo_put_missing_item_returns_404(self):
+        response = self.app.put(
+            '/api/v1/todos/42',
+            data=json.dumps({'name': 'renamed'}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(models.Todo.select().count(), 0)
+
+    def test_todo_delete_missing_item_returns_404(self):
+        models.Todo.create(name='first test item')
+
+        response = self.app.delete('/api/v1/todos/42')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(models.Todo.select().count(), 1)
+
+
+class TestToDoBatch(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+
+    def tearDown(self):
+        # perform cleanup
+        # closing the last connection also removes the WAL files
+        models.close_database()
+        os.close(self.temp_db_fh)  # close the file
+        os.unlink(config.DATABASE_FILENAME)  # remove the file
+
+    def post_batch(self, operations):
+        return self.app.post(
+            '/api/v1/todos/batch',
+            data=json.dumps(operations),
+            content_type='application/json'
+        )
+
+    # Tests
+    # =====
+    def test_batch_applies_mixed_operations(self):
+        models.Todo.create(name='to update')
+        models.Todo.create(name='to delete')
+
+        response = self.post_batch([
+            {'op': 'create', 'name': 'first new', 'completed': False},
+            {'op': 'update', 'id': 1, 'name': 'updated', 'completed': True},
+            {'op': 'delete', 'id': 2},
+            {'op': 'create', 'name': 'second new', 'completed': True},
+        ])
+        results = response.get_json()['results']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['status'] for r in results], [201, 200, 204, 201])
+        self.assertEqual(results[0]['todo']['name'], 'first new')
+        self.assertEqual(results[3]['todo']['completed'], True)
+
+        for result in (results[0], results[3]):
+            todo = models.Todo.get(models.Todo.id == result['todo']['id'])
+            self.assertEqual(todo.name, result['todo']['name'])
+
+        updated = models.Todo.get(models.Todo.id == 1)
+        self.assertEqual(updated.name, 'updated')
+        self.assertTrue(updated.completed)
+        self.assertEqual(
+            models.Todo.select().where(models.Todo.id == 2).count(), 0
+        )
+
+    def test_batch_reports_invalid_and_missing_items_individually(self):
+        models.Todo.create(name='existing')
+
+        response = self.post_batch([
+            {'op': 'create', 'completed': False},
+            {'op': 'update', 'id': 99, 'name': 'nope'},
+            {'op': 'delete', 'id': 99},
+            {'op': 'explode'},
+            {'op': 'create', 'name': 'valid'},
+        ])
+        results = response.get_json()['results']
+
+        self.assertEqual([r['status'] for r in results],
+                         [400, 404, 404, 400, 201])
+        self.assertIn('name', results[0]['message'])
+        self.assertEqual(models.Todo.select().count(), 2)
+
+    def test_batch_rejects_boolean_ids(self):
+        models.Todo.create(name='existing')
+
+        response = self.post_batch([
+            {'op': 'update', 'id': True, 'name': 'not todo 1'},
+            {'op': 'delete', 'id': False},
+        ])
+        results = response.get_json()['results']
+
+        self.assertEqual([r['status'] for r in results], [400, 400])
+        self.assertEqual(results[0]['message'], {'id': 'No todo id provided'})
+        self.assertEqual(models.Todo.get_by_id(1).name, 'existing')
+
+    def test_batch_later_update_of_same_item_wins(self):
+        models.Todo.create(name='original')
+
+        self.post_batch([
+            {'op': 'update', 'id': 1, 'name': 'first'},
+            {'op': 'update', 'id': 1, 'name': 'second'},
+        ])
+
+        self.assertEqual(models.Todo.get(models.Todo.id == 1).name, 'second')
+
+    def test_batch_update_after_delete_of_same_item_returns_404(self):
+        models.Todo.create(name='original')
+
+        response = self.post_batch([
+            {'op': 'delete', 'id': 1},
+            {'op': 'update', 'id': 1, 'name': 'too late'},
+        ])
+        results = response.get_json()['results']
+
+        self.assertEqual([r['status'] for r in results], [204, 404])
+        self.assertEqual(models.Todo.select().count(), 0)
+
+    def test_batch_creates_span_multiple_chunks(self):
+        original_chunk_size = config.BATCH_CHUNK_SIZE
+        config.BATCH_CHUNK_SIZE = 2
+        try:
+            response = self.post_batch([
+                {'op': 'create', 'name': 'item {}'.format(i)}
+                for i in range(5)
+            ])
+        finally:
+            config.BATCH_CHUNK_SIZE = original_chunk_size
+        results = response.get_json()['results']
+
+        for result in results:
+            todo = models.Todo.get(models.Todo.id == result['todo']['id'])
+            self.assertEqual(todo.name, result['todo']['name'])
+
+    def test_batch_rejects_non_list_body(self):
+        response = self.post_batch({'op': 'create', 'name': 'not a list'})
+
+        self.assertEqual(response.status_code, 400)
+
 # ------------------------
 
 if __name__ == '__main__':
@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import unittest
+
+from flask_restful import fields, marshal
+
+import app
+import config
+import models
+import serializers
+from resources.todos import todo_fields
+from serializers import CompiledSerializer
+
+
+TRICKY_ROWS = [
+    (1, 'plain', False),
+    (2, 'quotes " and \\\\ backslashes', True),
+    (3, 'tabs\\tnew\\nlines and \\x00 control characters', False),
+    (4, 'ünïcödé, 中文 and emoji \\U0001F600', True),
+    (5, '', False),
+    (6, None, None),
+    (None, 'missing id', 1),
+    (8, 12345, 0),
+]
+
+
+class TestCompiledSerializer(unittest.TestCase):
+
+    def assert_matches_marshal(self, serializer, fields_map, row):
+        marshalled = marshal(serializer.as_dict(row), fields_map)
+        self.assertEqual(
+            serializer(row),
+            json.dumps(marshalled, separators=serializers.SEPARATORS))
+        self.assertEqual(serializer.marshal(row), dict(marshalled))
+        self.assertEqual(serializer.dumps_row(row),
+                         serializers.dumps(marshalled))
+
+    # Tests
+    # =====
+    def test_todo_fields_output_matches_marshal(self):
+        serializer = CompiledSerializer(todo_fields, models.Todo)
+
+        for row in TRICKY_ROWS:
+            with self.subTest(row=row):
+                self.assert_matches_marshal(serializer, todo_fields, row)
+
+    def test_columns_follow_the_fields_mapping(self):
+        serializer = CompiledSerializer(todo_fields, models.Todo)
+
+        self.assertEqual(serializer.attributes, ['id', 'name', 'completed'])
+
+    def test_field_instances_with_attribute_and_default(self):
+        fields_map = {
+            'title': fields.String(attribute='name', default='untitled'),
+            'done': fields.Boolean(attribute='completed', default=False),
+            'number': fields.Integer(attribute='id', default=-1),
+        }
+        serializer = CompiledSerializer(fields_map, models.Todo)
+
+        self.assertEqual(serializer.attributes, ['name', 'completed', 'id'])
+        for row in [('x', True, 3), (None, None, None)]:
+            with self.subTest(row=row):
+                self.assert_matches_marshal(serializer, fields_map, row)
+
+    def test_other_field_types_fall_back_to_marshal(self):
+        fields_map = {'id': fields.Float, 'name': fields.Raw}
+        serializer = CompiledSerializer(fields_map, models.Todo)
+
+        self.assert_matches_marshal(serializer, fields_map, (3, 'x'))
+
+    def test_dumps_rows_matches_dumps_of_marshal(self):
+        serializer = CompiledSerializer(todo_fields, models.Todo)
+        expected = [marshal(serializer.as_dict(row), todo_fields)
+                    for row in TRICKY_ROWS]
+
+        self.assertEqual(serializer.dumps_rows(TRICKY_ROWS),
+                         serializers.dumps(expected))
+        self.assertEqual(serializer.dumps_rows([]), '[]')
+
+    def test_nested_attributes_are_rejected(self):
+        with self.assertRaises(ValueError):
+            CompiledSerializer({'x': fields.String(attribute='a.b')},
+                               models.Todo)
+
+
+class TestSerializerParity(unittest.TestCase):
+    """The API's output must not change with `config.FAST_SERIALIZER`"""
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+        for _, name, completed in TRICKY_ROWS:
+            if name is not None and completed is not None:
+                models.Todo.create(name=name, completed=completed)
+
+    def tearDown(self):
+        config.FAST_SERIALIZER = True
+        config.FAST_JSON = True
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def get_both_ways(self, uri, **kwargs):
+        bodies = []
+        for fast in (True, False):
+            config.FAST_SERIALIZER = fast
+            bodies.append(self.app.get(uri, **kwargs).get_data())
+        return bodies
+
+    # Tests
+    # =====
+    def test_streamed_collection_is_identical(self):
+        fast, slow = self.get_both_ways('/api/v1/todos')
+
+        self.assertEqual(fast, slow)
+        self.assertEqual(json.loads(fast.decode('utf-8'))[3]['name'],
+                         TRICKY_ROWS[3][1])
+
+    def test_ndjson_collection_is_identical(self):
+        fast, slow = self.get_both_ways(
+            '/api/v1/todos', headers={'Accept': 'application/x-ndjson'})
+
+        self.assertEqual(fast, slow)
+
+    def test_page_is_identical(self):
+        fast, slow = self.get_both_ways('/api/v1/todos?limit=3')
+
+        self.assertEqual(fast, slow)
+
+    def test_streamed_collection_matches_json_dumps_of_marshal(self):
+        config.FAST_SERIALIZER = True
+        body = self.app.get('/api/v1/todos').get_data(as_text=True)
+
+        expected = serializers.dumps(
+            marshal(list(models.Todo.select().order_by(models.Todo.id)),
+                    todo_fields)
+        )
+        self.assertEqual(body, expected)
+
+    def test_output_is_identical_without_the_fast_json_encoder(self):
+        config.FAST_JSON = False
+        fast, slow = self.get_both_ways('/api/v1/todos')
+
+        self.assertEqual(fast, slow)
+        self.assertEqual(
+            fast.decode('utf-8'),
+            json.dumps(json.loads(fast.decode('utf-8')),
+                       separators=serializers.SEPARATORS))
+
+
+# ------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+import app
+import config
+import models
+import serve
+
+
+class TestWorker(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        models.initialize()
+        self.listener = serve.bind('127.0.0.1', 0)
+        self.base_url = 'http://127.0.0.1:{}'.format(
+            self.listener.getsockname()[1])
+
+    def tearDown(self):
+        self.listener.close()
+        app.app.debug = False
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    # Tests
+    # =====
+    def test_worker_stops_after_max_requests(self):
+        models.Todo.create(name='first test item')
+        worker = serve.Worker(self.listener, max_requests=3)
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+
+        statuses = []
+        for _ in range(3):
+            with urllib.request.urlopen(self.base_url + '/api/v1/todos/1',
+                                        timeout=10) as response:
+                statuses.append(response.status)
+        thread.join(timeout=10)
+
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(worker.served, 3)
+
+    def test_worker_stops_when_asked(self):
+        worker = serve.Worker(self.listener, max_requests=0)
+        worker.poll_interval = 0.05
+        thread = threading.Thread(target=worker.run)
+        thread.start()
+
+        worker.stop()
+        thread.join(timeout=10)
+
+        self.assertFalse(thread.is_alive())
+
+    def test_max_requests_are_jittered(self):
+        limits = {serve.max_requests_for_worker(100, 10) for _ in range(50)}
+
+        self.assertTrue(all(100 <= limit <= 110 for limit in limits))
+        self.assertGreater(len(limits), 1)
+        self.assertEqual(serve.max_requests_for_worker(0, 10), 0)
+
+    def test_reopen_after_fork_replaces_the_database(self):
+        before = models.DATABASE.obj
+
+        models.reopen_after_fork()
+
+        self.assertIsNot(models.DATABASE.obj, before)
+        self.assertEqual(models.DATABASE.obj.database,
+                         config.DATABASE_FILENAME)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'serve.py needs os.fork()')
+class TestServe(unittest.TestCase):
+    """Runs the launcher for real, in a subprocess"""
+
+    def setUp(self):
+        self.temp_db_fh, self.filename = tempfile.mkstemp()
+        todo_dir = os.path.dirname(os.path.dirname(os.path.abspath(
+            __file__)))
+        self.process = subprocess.Popen(
+            [sys.executable, 'serve.py', '--bind', '127.0.0.1:0',
+             '--database', self.filename, '--workers', '2',
+             '--max-requests', '2', '--max-requests-jitter', '0',
+             '--graceful-timeout', '5'],
+            cwd=todo_dir, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        for line in self.process.stderr:
+            match = re.search(r'Listening on [\d.]+:(\d+)', line)
+            if match:
+                break
+        self.base_url = 'http://127.0.0.1:{}'.format(match.group(1))
+        # keep draining the log so the launcher never blocks writing it
+        self.log = []
+        self.drain = threading.Thread(
+            target=lambda: self.log.extend(self.process.stderr))
+        self.drain.start()
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.drain.join()
+        self.process.stderr.close()
+        os.close(self.temp_db_fh)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.filename + suffix):
+                os.unlink(self.filename + suffix)
+
+    def request(self, path, data=None, method=None):
+        request = urllib.request.Request(
+            self.base_url + path, method=method,
+            data=json.dumps(data).encode() if data else None,
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read()
+
+    def test_serves_recycles_restarts_and_stops(self):
+        # more requests than two workers allowed two requests each can
+        # serve, so workers have to be replaced along the way
+        statuses = [self.request('/api/v1/todos', {'name': 'todo'},
+                                 'POST')[0] for _ in range(6)]
+        self.process.send_signal(signal.SIGHUP)
+        status, body = self.request('/api/v1/todos')
+        self.process.send_signal(signal.SIGTERM)
+        returncode = self.process.wait(timeout=30)
+
+        self.assertEqual(statuses, [201] * 6)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body.decode())), 6)
+        self.assertEqual(returncode, 0)
+        self.assertTrue(any('recycling' in line for line in self.log))
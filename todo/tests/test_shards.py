@@ -0,0 +1,255 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from urllib.parse import urlencode
+
+import app
+import config
+import models
+import writes
+
+
+SHARDS = 3
+
+
+class TestShards(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        config.DATABASE_SHARDS = SHARDS
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+
+    def tearDown(self):
+        config.GROUP_COMMIT = False
+        writes.initialize()
+        models.close_database()
+        filenames = [models.shard_filename(shard) for shard in range(SHARDS)]
+        config.DATABASE_SHARDS = 1
+        os.close(self.temp_db_fh)
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def post(self, name, completed=False):
+        response = self.app.post(
+            '/api/v1/todos',
+            data=json.dumps({'name': name, 'completed': completed}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['id']
+
+    def create(self, shard, **values):
+        with models.using_shard(shard):
+            return models.create_todo(**values).id
+
+    def shard_ids(self, shard):
+        with models.using_shard(shard):
+            return [todo.id for todo in models.Todo.select()]
+
+    def walk_pages(self, url):
+        """Follow the Link headers from `url`, returning every page's ids"""
+        ids = []
+        while url is not None:
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(todo['id'] for todo in response.get_json())
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        return ids
+
+    # Tests
+    # =====
+    def test_creates_take_turns_between_shards(self):
+        ids = [self.post('todo {}'.format(n)) for n in range(6)]
+
+        self.assertEqual(len(set(ids)), 6)
+        self.assertEqual(sorted(todo_id % SHARDS for todo_id in ids),
+                         [0, 0, 1, 1, 2, 2])
+        for shard in range(SHARDS):
+            self.assertEqual(
+                sorted(self.shard_ids(shard)),
+                sorted(i for i in ids if models.shard_of(i) == shard))
+            self.assertTrue(os.path.exists(models.shard_filename(shard)))
+
+    def test_ids_are_unique_within_and_across_shards(self):
+        ids = [self.create(shard, name='todo')
+               for shard in (0, 1, 2, 1, 1, 0)]
+
+        self.assertEqual(ids, [3, 4, 5, 7, 10, 6])
+
+    def test_database_needs_a_shard_selected(self):
+        with self.assertRaises(RuntimeError):
+            models.Todo.select().count()
+
+    def test_item_requests_go_to_the_todos_shard(self):
+        ids = [self.post('todo {}'.format(n)) for n in range(3)]
+
+        for n, todo_id in enumerate(ids):
+            response = self.app.get('/api/v1/todos/{}'.format(todo_id))
+            self.assertEqual(response.get_json()['name'],
+                             'todo {}'.format(n))
+
+        response = self.app.put(
+            '/api/v1/todos/{}'.format(ids[1]),
+            data=json.dumps({'name': 'renamed', 'completed': True}),
+            content_type='application/json')
+        self.assertEqual(response.get_json(),
+                         {'id': ids[1], 'name': 'renamed', 'completed': True})
+
+        response = self.app.delete('/api/v1/todos/{}'.format(ids[2]))
+        self.assertEqual(response.status_code, 204)
+        self.assertNotIn(ids[2], self.shard_ids(models.shard_of(ids[2])))
+        response = self.app.get('/api/v1/todos/{}'.format(ids[2]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_missing_todo_returns_404(self):
+        self.post('todo')
+
+        for method in (self.app.get, self.app.delete):
+            self.assertEqual(method('/api/v1/todos/100').status_code, 404)
+
+    def test_collection_is_merged_in_order(self):
+        ids = [self.post('todo {}'.format(n)) for n in range(10)]
+
+        response = self.app.get('/api/v1/todos')
+        self.assertEqual([todo['id'] for todo in response.get_json()],
+                         sorted(ids))
+
+        response = self.app.get('/api/v1/todos?sort=-id',
+                                headers={'Accept': 'application/x-ndjson'})
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines],
+                         sorted(ids, reverse=True))
+
+    def test_pages_walk_the_collection_across_shards(self):
+        start = datetime.datetime(2020, 1, 1)
+        created = {}
+        for n in range(20):
+            # dates out of step with the ids and shards, with some ties
+            created_date = start + datetime.timedelta(days=(n * 7) % 5)
+            todo_id = self.create(n % SHARDS, name='todo {}'.format(n),
+                                  completed=n % 4 == 0,
+                                  created_date=created_date)
+            created[todo_id] = (created_date, n % 4 == 0)
+
+        for query, expected in [
+            ({'sort': 'id'}, sorted(created)),
+            ({'sort': '-id'}, sorted(created, reverse=True)),
+            ({'sort': 'created_date'},
+             sorted(created, key=lambda i: (created[i][0], i))),
+            ({'sort': '-created_date'},
+             sorted(created, key=lambda i: (created[i][0], i),
+                    reverse=True)),
+            ({'sort': 'created_date', 'completed': 'false'},
+             sorted((i for i in created if not created[i][1]),
+                    key=lambda i: (created[i][0], i))),
+        ]:
+            with self.subTest(**query):
+                url = '/api/v1/todos?' + urlencode(dict(query, limit=3))
+                self.assertEqual(self.walk_pages(url), expected)
+
+    def test_search_finds_matches_on_every_shard(self):
+        ids = [self.post(name) for name in
+               ('buy milk', 'milk the cow', 'oat milk', 'walk the dog')]
+
+        response = self.app.get('/api/v1/todos?q=milk&sort=id')
+
+        found = [todo['id'] for todo in response.get_json()]
+        self.assertEqual(found, sorted(ids[:3]))
+        self.assertEqual(len({models.shard_of(i) for i in found}), 3)
+
+        url = '/api/v1/todos?' + urlencode({'q': 'milk', 'limit': 1})
+        self.assertEqual(sorted(self.walk_pages(url)), sorted(found))
+
+    def test_batch_writes_to_each_shard(self):
+        ids = [self.post('todo {}'.format(n)) for n in range(3)]
+
+        response = self.app.post(
+            '/api/v1/todos/batch',
+            data=json.dumps([
+                {'op': 'create', 'name': 'new 1'},
+                {'op': 'update', 'id': ids[0], 'name': 'renamed'},
+                {'op': 'delete', 'id': ids[1]},
+                {'op': 'create', 'name': 'new 2'},
+                {'op': 'delete', 'id': 100},
+            ]),
+            content_type='application/json')
+
+        results = response.get_json()['results']
+        self.assertEqual([result['status'] for result in results],
+                         [201, 200, 204, 201, 404])
+        created = [results[0]['todo']['id'], results[3]['todo']['id']]
+        self.assertEqual(len({models.shard_of(i) for i in created}), 1)
+        response = self.app.get('/api/v1/todos')
+        self.assertEqual(
+            [(todo['id'], todo['name']) for todo in response.get_json()],
+            sorted([(ids[0], 'renamed'), (ids[2], 'todo 2'),
+                    (created[0], 'new 1'), (created[1], 'new 2')]))
+
+    def test_etag_changes_after_a_write_to_any_shard(self):
+        for n in range(3):
+            self.post('todo {}'.format(n))
+        etag = self.app.get('/api/v1/todos').headers['ETag']
+
+        for shard in range(SHARDS):
+            self.create(shard, name='another')
+            response = self.app.get('/api/v1/todos',
+                                    headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            response.close()
+
+    def test_delta_sync_is_refused(self):
+        self.post('todo')
+
+        response = self.app.get('/api/v1/todos')
+        self.assertNotIn('X-Version', response.headers)
+        response = self.app.get('/api/v1/todos?since=0')
+        self.assertEqual(response.status_code, 400)
+
+    def test_group_commit_queues_each_shard(self):
+        config.GROUP_COMMIT = True
+        writes.initialize()
+
+        ids = [self.post('todo {}'.format(n)) for n in range(6)]
+
+        self.assertEqual([queue.shard for queue in writes.QUEUES],
+                         list(range(SHARDS)))
+        self.assertEqual([queue.writes for queue in writes.QUEUES],
+                         [2, 2, 2])
+        for shard in range(SHARDS):
+            self.assertEqual(
+                sorted(self.shard_ids(shard)),
+                sorted(i for i in ids if models.shard_of(i) == shard))
+
+    def test_initialize_refuses_a_different_number_of_shards(self):
+        self.post('todo')
+        models.close_database()
+
+        config.DATABASE_SHARDS = 2
+        with self.assertRaises(ValueError):
+            models.initialize()
+
+        config.DATABASE_SHARDS = SHARDS
+        models.initialize()
+
+    def test_unsharded_database_with_todos_cannot_be_sharded(self):
+        models.close_database()
+        config.DATABASE_SHARDS = 1
+        models.initialize()
+        models.Todo.create(name='unsharded')
+        models.close_database()
+
+        config.DATABASE_SHARDS = SHARDS
+        with self.assertRaises(ValueError):
+            models.initialize()
+
+
+if __name__ == '__main__':
+    unittest.main()
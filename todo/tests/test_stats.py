@@ -0,0 +1,171 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import app
+import config
+import manage
+import models
+
+
+class TestStats(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        models.initialize()
+
+    def tearDown(self):
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def stats(self):
+        response = self.app.get('/api/v1/todos/stats')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def import_todos(self, *items):
+        self.app.post('/api/v1/todos/import',
+                      data='\n'.join(json.dumps(item) for item in items),
+                      content_type='application/x-ndjson').get_data()
+
+    def manage(self, *argv):
+        models.close_database()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            status = manage.main(['--database', config.DATABASE_FILENAME]
+                                 + list(argv))
+        return status, output.getvalue()
+
+    # Tests
+    # =====
+    def test_empty(self):
+        self.assertEqual(self.stats(), {'total': 0, 'completed': 0,
+                                        'pending': 0, 'created_per_day': []})
+
+    def test_counts_follow_every_write_path(self):
+        self.import_todos(
+            {'name': 'old', 'created_date': '2020-01-02 03:04:05'},
+            {'name': 'older', 'completed': True,
+             'created_date': '2020-01-01 23:59:59.999999'},
+            {'name': 'also old', 'created_date': '2020-01-02T12:00:00'})
+        self.app.post('/api/v1/todos', data={'name': 'new'})
+        self.app.put('/api/v1/todos/1', data={'name': 'old',
+                                              'completed': True})
+        self.app.delete('/api/v1/todos/3')
+        self.app.post('/api/v1/todos/batch', data=json.dumps([
+            {'op': 'create', 'name': 'batched', 'completed': True},
+            {'op': 'delete', 'id': 4},
+        ]), content_type='application/json')
+
+        stats = self.stats()
+
+        self.assertEqual((stats['total'], stats['completed'],
+                          stats['pending']), (3, 3, 0))
+        today = models.Todo.get_by_id(5).created_date.date().isoformat()
+        self.assertEqual(stats['created_per_day'], [
+            {'date': '2020-01-01', 'count': 1},
+            {'date': '2020-01-02', 'count': 1},
+            {'date': today, 'count': 1},
+        ])
+        self.assertEqual(models.check_stats(), {})
+
+    def test_moving_a_todo_to_another_day(self):
+        self.import_todos({'name': 'todo',
+                           'created_date': '2020-01-02 03:04:05'})
+
+        (models.Todo
+         .update(created_date='2020-03-04 05:06:07')
+         .where(models.Todo.id == 1)
+         .execute())
+
+        self.assertEqual(self.stats()['created_per_day'],
+                         [{'date': '2020-03-04', 'count': 1}])
+        self.assertEqual(models.check_stats(), {})
+
+    def test_conditional_get(self):
+        etag = self.app.get('/api/v1/todos/stats').headers['ETag']
+
+        response = self.app.get('/api/v1/todos/stats',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.app.post('/api/v1/todos', data={'name': 'new'})
+        response = self.app.get('/api/v1/todos/stats',
+                                headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_finds_and_repairs_wrong_counts(self):
+        self.import_todos({'name': 'todo', 'completed': True,
+                           'created_date': '2020-01-02 03:04:05'})
+        models.TodoStats.update(total=5).execute()
+        models.TodoStats.create(day='2019-12-31', total=1, completed=0)
+
+        self.assertEqual(models.check_stats(), {
+            '2019-12-31': ((1, 0), (0, 0)),
+            '2020-01-02': ((5, 1), (1, 1)),
+            models.ALL_DAYS: ((5, 1), (1, 1)),
+        })
+
+        status, output = self.manage('check-stats')
+        self.assertEqual(status, 1)
+        self.assertIn('2019-12-31: kept 1 todos (0 completed), counted 0 '
+                      '(0 completed)', output)
+        self.assertIn('all days: kept 5 todos', output)
+
+        status, output = self.manage('--repair', 'check-stats')
+        self.assertEqual(status, 0)
+        self.assertIn('Recounted the stats (3 differences)', output)
+        self.assertEqual(self.manage('check-stats'),
+                         (0, 'The stats match the todos\n'))
+        self.assertEqual(self.stats()['total'], 1)
+
+    def test_initialize_counts_an_existing_database(self):
+        for name in ('first', 'second'):
+            self.app.post('/api/v1/todos', data={'name': name})
+        models.DATABASE.drop_tables([models.TodoStats])
+        models.close_database()
+
+        models.initialize()
+
+        self.assertEqual(self.stats()['total'], 2)
+
+
+class TestShardedStats(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        config.DATABASE_SHARDS = 2
+        self.app = app.app.test_client()
+        models.initialize()
+
+    def tearDown(self):
+        models.close_database()
+        filenames = [models.shard_filename(shard) for shard in range(2)]
+        config.DATABASE_SHARDS = 1
+        os.close(self.temp_db_fh)
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def test_adds_up_the_shards(self):
+        for completed in (True, False, True):
+            self.app.post('/api/v1/todos', data={'name': 'todo',
+                                                 'completed': completed})
+
+        stats = self.app.get('/api/v1/todos/stats').get_json()
+
+        self.assertEqual((stats['total'], stats['completed']), (3, 2))
+        self.assertEqual([day['count'] for day in stats['created_per_day']],
+                         [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
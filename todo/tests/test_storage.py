@@ -0,0 +1,329 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import app
+import config
+import models
+import storage
+
+
+class RepositoryTests:
+    """Behaviour every storage engine must have. Mixed into a TestCase
+    that provides `make_repository()`.
+    """
+
+    def setUp(self):
+        self.repository = self.make_repository()
+        self.repository.initialize()
+
+    def create(self, *names, completed=False):
+        return [self.repository.create(name, completed=completed).id
+                for name in names]
+
+    def list_ids(self, **kwargs):
+        rows, _ = self.repository.list(**kwargs)
+        return [row[0] for row in rows]
+
+    def in_order(self, sort, ids):
+        """`ids` as a list in `sort` order should have them. (Sharded,
+        ids don't follow the order todos were created in.)
+        """
+        todos = [self.repository.get(todo_id) for todo_id in ids]
+        if sort.lstrip('-') == 'id':
+            keys = [todo.id for todo in todos]
+        else:
+            keys = [(todo.created_date, todo.id) for todo in todos]
+        return [todo_id for _, todo_id in
+                sorted(zip(keys, ids), reverse=sort.startswith('-'))]
+
+    def test_creates_and_gets_todos(self):
+        todo = self.repository.create('write tests', completed=True)
+
+        found = self.repository.get(todo.id)
+
+        self.assertEqual((found.id, found.name, found.completed),
+                         (todo.id, 'write tests', True))
+        self.assertIsInstance(found.created_date, datetime.datetime)
+        self.assertIsNone(self.repository.get(todo.id + 1))
+
+    def test_ids_are_unique(self):
+        ids = self.create('one', 'two', 'three')
+
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_updates_todos(self):
+        todo_id, = self.create('draft')
+
+        updated = self.repository.update(todo_id, 'final', True)
+
+        self.assertEqual((updated.id, updated.name, updated.completed),
+                         (todo_id, 'final', True))
+        self.assertEqual(self.repository.get(todo_id).name, 'final')
+        self.assertIsNone(self.repository.update(todo_id + 1, 'x', False))
+
+    def test_deletes_todos(self):
+        first, second = self.create('first', 'second')
+
+        self.assertTrue(self.repository.delete(first))
+
+        self.assertIsNone(self.repository.get(first))
+        self.assertFalse(self.repository.delete(first))
+        self.assertIsNone(self.repository.update(first, 'back', False))
+        self.assertEqual(self.list_ids(), [second])
+
+    def test_every_write_changes_the_version(self):
+        versions = [self.repository.version()]
+        todo_id, = self.create('todo')
+        versions.append(self.repository.version())
+        self.repository.update(todo_id, 'renamed', False)
+        versions.append(self.repository.version(todo_id))
+        self.repository.delete(todo_id)
+        versions.append(self.repository.version())
+
+        self.assertEqual(len(set(versions)), 4)
+
+    def test_lists_in_each_sort(self):
+        ids = self.create('a', 'b', 'c')
+
+        for sort in ('id', '-id', 'created_date', '-created_date'):
+            with self.subTest(sort):
+                self.assertEqual(self.list_ids(sort=sort),
+                                 self.in_order(sort, ids))
+
+    def test_rows_are_laid_out_by_row_columns(self):
+        todo = self.repository.create('todo', completed=True)
+
+        for sort in ('id', '-created_date'):
+            with self.subTest(sort):
+                rows, key_positions = self.repository.list(sort=sort)
+                names, expected_positions = storage.row_columns(sort)
+                row = dict(zip(names, next(rows)))
+                self.assertEqual(key_positions, expected_positions)
+                self.assertEqual(
+                    (row['id'], row['name'], row['completed']),
+                    (todo.id, 'todo', True))
+                if 'created_date' in row:
+                    self.assertEqual(row['created_date'], todo.created_date)
+
+    def test_filters_on_completed(self):
+        done = self.create('done', completed=True)
+        pending = self.create('pending', completed=False)
+
+        self.assertEqual(self.list_ids(completed=True), done)
+        self.assertEqual(self.list_ids(completed=False), pending)
+
+    def test_pages_with_a_limit_and_cursor(self):
+        ids = self.create(*'abcdefg')
+        self.repository.delete(ids[3])
+        expected = [todo_id for todo_id in ids if todo_id != ids[3]]
+
+        for sort in ('id', '-id', 'created_date', '-created_date'):
+            with self.subTest(sort):
+                seen, after = [], None
+                while True:
+                    rows, key_positions = self.repository.list(
+                        sort=sort, after=after, limit=2)
+                    rows = list(rows)
+                    if not rows:
+                        break
+                    self.assertLessEqual(len(rows), 2)
+                    seen.extend(row[0] for row in rows)
+                    # (as a cursor would carry the key back)
+                    after = (sort, [str(value)
+                                    if isinstance(value, datetime.datetime)
+                                    else value
+                                    for value in (rows[-1][position]
+                                                  for position in
+                                                  key_positions)])
+                self.assertEqual(seen, self.in_order(sort, expected))
+
+    def test_keeps_stats(self):
+        self.assertEqual(self.repository.stats(), (0, 0, []))
+        first, second = self.create('first', 'second')
+        third, = self.create('third', completed=True)
+        self.repository.update(first, 'first', True)
+        self.repository.update(third, 'renamed', True)
+        self.repository.delete(second)
+
+        total, completed, days = self.repository.stats()
+
+        self.assertEqual((total, completed), (2, 2))
+        today = self.repository.get(first).created_date.date().isoformat()
+        self.assertEqual(days, [(today, 2)])
+        self.repository.delete(first)
+        self.repository.delete(third)
+        self.assertEqual(self.repository.stats(), (0, 0, []))
+
+    def test_rejects_queries_it_cant_run(self):
+        for kwargs in [{'sort': 'rank'},
+                       {'sort': 'id', 'after': ('-id', [1])}]:
+            with self.subTest(**kwargs):
+                with self.assertRaises(storage.QueryError):
+                    self.repository.list(**kwargs)
+
+
+class TestSqliteRepository(RepositoryTests, unittest.TestCase):
+
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        super().setUp()
+
+    def tearDown(self):
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def make_repository(self):
+        return storage.SqliteRepository()
+
+    def test_searches(self):
+        self.create('buy milk', 'walk the dog', 'oat milk')
+
+        self.assertEqual(self.list_ids(q='milk', sort='id'), [1, 3])
+
+
+class TestShardedSqliteRepository(RepositoryTests, unittest.TestCase):
+
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        config.DATABASE_SHARDS = 2
+        super().setUp()
+
+    def tearDown(self):
+        models.close_database()
+        filenames = [models.shard_filename(shard) for shard in range(2)]
+        config.DATABASE_SHARDS = 1
+        os.close(self.temp_db_fh)
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+    def make_repository(self):
+        return storage.SqliteRepository()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime.datetime(2020, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryRepository(RepositoryTests, unittest.TestCase):
+
+    def make_repository(self):
+        return storage.MemoryRepository()
+
+    def test_searches_are_unsupported(self):
+        with self.assertRaises(storage.Unsupported):
+            self.repository.list(q='milk')
+
+    def test_created_date_ties_are_ordered_by_id(self):
+        clock = FakeClock()
+        repository = storage.MemoryRepository(clock=clock)
+        first = repository.create('first').id
+        clock.now -= datetime.timedelta(days=1)
+        earlier = repository.create('earlier').id
+        clock.now += datetime.timedelta(days=1)
+        tie = repository.create('tie').id
+
+        rows, _ = repository.list(sort='created_date')
+
+        self.assertEqual([row[0] for row in rows], [earlier, first, tie])
+
+    def test_stats_count_by_created_day(self):
+        clock = FakeClock()
+        repository = storage.MemoryRepository(clock=clock)
+        repository.create('first')
+        clock.now += datetime.timedelta(days=1, hours=23)
+        repository.create('second', completed=True)
+        repository.create('third')
+
+        self.assertEqual(repository.stats(), (3, 1, [('2020-01-01', 1),
+                                                     ('2020-01-02', 2)]))
+
+    def test_compacts_dead_slots_and_never_reuses_ids(self):
+        self.repository.COMPACT_MIN_DEAD = 2
+        ids = self.create(*'abcde')
+        for todo_id in ids[:3]:
+            self.repository.delete(todo_id)
+
+        self.assertEqual(len(self.repository._ids), 2)
+        self.assertEqual(self.list_ids(sort='-created_date'), ids[:2:-1])
+        self.assertEqual(self.repository.get(ids[4]).name, 'e')
+        self.assertEqual(self.create('f'), [ids[-1] + 1])
+
+    def test_a_streaming_list_skips_deletes_and_survives_compaction(self):
+        self.repository.COMPACT_MIN_DEAD = 2
+        ids = self.create(*'abcd')
+        rows, _ = self.repository.list()
+        first = next(rows)
+
+        for todo_id in ids[:3]:
+            self.repository.delete(todo_id)
+
+        self.assertEqual(first[0], ids[0])
+        self.assertEqual([row[0] for row in rows], ids[3:])
+
+
+class TestMemoryStorageApi(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        app.app.config["TESTING"] = True
+        self.app = app.app.test_client()
+        config.STORAGE_BACKEND = 'memory'
+        storage.initialize()
+
+    def tearDown(self):
+        config.STORAGE_BACKEND = 'sqlite'
+        storage.REPOSITORY = storage.SqliteRepository()
+
+    # Tests
+    # =====
+    def test_crud(self):
+        response = self.app.post('/api/v1/todos', data={'name': 'in memory'})
+        self.assertEqual(response.status_code, 201)
+        todo_id = response.get_json()['id']
+        url = '/api/v1/todos/{}'.format(todo_id)
+
+        self.app.put(url, data={'name': 'renamed', 'completed': True})
+        self.assertEqual(self.app.get(url).get_json(),
+                         {'id': todo_id, 'name': 'renamed',
+                          'completed': True})
+        self.assertEqual(self.app.delete(url).status_code, 204)
+        self.assertEqual(self.app.get(url).status_code, 404)
+
+    def test_pages_and_etags(self):
+        for name in 'abc':
+            self.app.post('/api/v1/todos', data={'name': name})
+
+        page = self.app.get('/api/v1/todos?limit=2&sort=-id')
+        self.assertEqual([todo['name'] for todo in page.get_json()],
+                         ['c', 'b'])
+        self.assertNotIn('X-Version', page.headers)
+        next_page = self.app.get(page.headers['Link'].split(';')[0][1:-1])
+        self.assertEqual([todo['name'] for todo in next_page.get_json()],
+                         ['a'])
+
+        unchanged = self.app.get('/api/v1/todos?limit=2&sort=-id', headers={
+            'If-None-Match': page.headers['ETag']})
+        self.assertEqual(unchanged.status_code, 304)
+
+    def test_sqlite_only_features_are_not_implemented(self):
+        for method, url in [('get', '/api/v1/todos?q=milk'),
+                            ('get', '/api/v1/todos?since=0'),
+                            ('get', '/api/v1/todos/export'),
+                            ('post', '/api/v1/todos/batch'),
+                            ('post', '/api/v1/todos/import')]:
+            with self.subTest(url=url):
+                response = getattr(self.app, method)(url)
+                self.assertEqual(response.status_code, 501)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import app
+import config
+import models
+import writes
+# imported as a module (rather than importing the classes) so that the
+# test runner doesn't collect the direct-write versions of the tests twice
+from tests import test_resources
+
+
+def create(name):
+    return models.Todo.create(name=name).id
+
+
+class TestWriteQueue(unittest.TestCase):
+
+    # Setup and Teardown
+    # ==================
+    def setUp(self):
+        self.temp_db_fh, config.DATABASE_FILENAME = tempfile.mkstemp()
+        models.initialize()
+        self.queue = writes.WriteQueue(max_ops=64, max_wait=0.05)
+
+    def tearDown(self):
+        self.queue.stop()
+        models.close_database()
+        os.close(self.temp_db_fh)
+        os.unlink(config.DATABASE_FILENAME)
+
+    def submit_concurrently(self, calls):
+        """Submit every (fn, args) at once, from a thread each. Returns the
+        results (or exceptions) in the same order.
+        """
+        results = [None] * len(calls)
+
+        def submit(index, fn, args):
+            try:
+                results[index] = self.queue.submit(fn, *args)
+            except Exception as exc:
+                results[index] = exc
+            finally:
+                models.DATABASE.close()
+
+        threads = [threading.Thread(target=submit, args=(i, fn, args))
+                   for i, (fn, args) in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    # Tests
+    # =====
+    def test_concurrent_writes_share_transactions(self):
+        ids = self.submit_concurrently(
+            [(create, ('todo {}'.format(n),)) for n in range(20)])
+
+        self.assertEqual(sorted(ids), list(range(1, 21)))
+        self.assertEqual(self.queue.writes, 20)
+        self.assertLess(self.queue.batches, 20)
+        self.assertEqual(models.Todo.select().count(), 20)
+
+    def test_failed_write_raises_without_undoing_the_rest_of_its_batch(self):
+        def fail():
+            models.Todo.create(name='rolled back')
+            raise ValueError('no')
+
+        results = self.submit_concurrently(
+            [(create, ('kept',)) for _ in range(3)] + [(fail, ())])
+
+        self.assertEqual(len(set(results[:3])), 3)
+        self.assertIsInstance(results[-1], ValueError)
+        self.assertEqual(models.Todo.select().count(), 3)
+        self.assertEqual(
+            models.Todo.select().where(
+                models.Todo.name == 'rolled back').count(), 0)
+
+    def test_writer_restarts_after_stop(self):
+        self.queue.submit(models.Todo.create, name='first')
+        self.queue.stop()
+
+        self.queue.submit(models.Todo.create, name='second')
+
+        self.assertEqual(models.Todo.select().count(), 2)
+
+    def test_run_writes_directly_when_group_commit_is_off(self):
+        writes.initialize()
+
+        todo = writes.run(models.Todo.create, name='direct')
+
+        self.assertIsNone(writes.QUEUES)
+        self.assertEqual(models.Todo.get_by_id(todo.id).name, 'direct')
+
+
+# The resource tests, with group commit on
+# ========================================
+class GroupCommitMixin:
+
+    def setUp(self):
+        super().setUp()
+        config.GROUP_COMMIT = True
+        writes.initialize()
+
+    def tearDown(self):
+        config.GROUP_COMMIT = False
+        writes.initialize()
+        super().tearDown()
+
+
+class TestGroupCommitToDoList(GroupCommitMixin, test_resources.TestToDoList):
+    pass
+
+
+class TestGroupCommitToDo(GroupCommitMixin, test_resources.TestToDo):
+
+    def test_todo_put_runs_one_statement(self):
+        models.Todo.create(name='first test item')
+        statements = []
+        models.QUERY_HOOKS.append(
+            lambda sql, seconds: statements.append(sql))
+        try:
+            self.app.put(
+                '/api/v1/todos/1',
+                data=json.dumps({'name': 'renamed', 'completed': True}),
+                content_type='application/json'
+            )
+        finally:
+            models.QUERY_HOOKS.clear()
+
+        # (plus the writer's BEGIN)
+        if models.RETURNING_SUPPORTED:
+            self.assertEqual(len(statements), 2)
+            self.assertEqual(statements[0], 'BEGIN')
+            self.assertIn('RETURNING', statements[1])
+
+    def test_concurrent_puts_all_commit(self):
+        for n in range(8):
+            models.Todo.create(name='todo {}'.format(n))
+        client = app.app.test_client()
+        statuses = []
+
+        def put(todo_id):
+            response = client.put(
+                '/api/v1/todos/{}'.format(todo_id),
+                data=json.dumps({'name': 'renamed', 'completed': True}),
+                content_type='application/json')
+            statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=put, args=(todo_id,))
+                   for todo_id in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 8)
+        self.assertEqual(models.Todo.select().where(
+            models.Todo.name == 'renamed').count(), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
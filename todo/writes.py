@@ -0,0 +1,203 @@
+import queue
+import threading
+import time
+
+import config
+import models
+
+
+# The write queues, one per shard (see `initialize()`). None means every
+# write commits its own transaction, on the thread of the request that made
+# it.
+QUEUES = None
+
+
+class _Write:
+    """One queued write: the call to make, and (once the batch it was in
+    has committed) its result or the exception it raised
+    """
+    __slots__ = ('fn', 'args', 'kwargs', 'done', 'result', 'error')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class WriteQueue:
+    """Group commit. Writes from concurrent requests are handed to a single
+    writer thread, which runs up to `max_ops` of them at a time in one
+    transaction: the batch shares one commit (and one trip through
+    SQLite's write lock) instead of paying for one each.
+
+    After taking the first write of a batch, the writer waits up to
+    `max_wait` seconds for more to arrive. 0 means it only takes the writes
+    that are already waiting, which coalesces nothing when there is no
+    contention (so costs nothing either).
+
+    `submit()` only returns once the batch has committed, so a request
+    still only answers once its write is durable.
+
+    The writer writes to `shard` (each shard has a write lock, and so a
+    queue, of its own).
+    """
+
+    def __init__(self, max_ops, max_wait, shard=0):
+        self.max_ops = max_ops
+        self.max_wait = max_wait
+        self.shard = shard
+        # (for the tests and benchmarks)
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Call `fn(*args, **kwargs)` on the writer thread, in the next
+        batch, and return its result (or raise its exception) once the
+        batch has committed
+        """
+        write = _Write(fn, args, kwargs)
+        self._start()
+        self._queue.put(write)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def stop(self):
+        """Let the writer finish what is queued, then stop it (the next
+        `submit()` starts it again)
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _start(self):
+        # (started on first use, so a forked worker starts its own)
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True,
+                    name='group-commit-{}'.format(self.shard))
+                self._thread.start()
+
+    def _run(self):
+        with models.using_shard(self.shard):
+            self._write()
+
+    def _write(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                self._commit(batch)
+        finally:
+            if not models.DATABASE.is_closed():
+                models.DATABASE.close()
+
+    def _next_batch(self):
+        """The next batch of writes, or None once stopped"""
+        try:
+            first = self._queue.get(timeout=config.GROUP_COMMIT_IDLE_SECONDS)
+        except queue.Empty:
+            # idle: give the connection back until there is work again
+            if not models.DATABASE.is_closed():
+                models.DATABASE.close()
+            first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_ops:
+            try:
+                timeout = deadline - time.perf_counter()
+                if timeout > 0:
+                    write = self._queue.get(timeout=timeout)
+                else:
+                    write = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if write is None:
+                # stop once this batch is done
+                self._queue.put(None)
+                break
+            batch.append(write)
+        return batch
+
+    def _apply(self, write):
+        try:
+            write.result = write.fn(*write.args, **write.kwargs)
+        except Exception as exc:
+            write.error = exc
+            raise
+
+    def _commit(self, batch):
+        models.DATABASE.connect(reuse_if_open=True)
+        try:
+            with models.DATABASE.atomic():
+                if len(batch) == 1:
+                    # (nothing else to protect from it)
+                    self._apply(batch[0])
+                else:
+                    for write in batch:
+                        # each write in a savepoint of its own, so one
+                        # that fails is undone without undoing the others
+                        try:
+                            with models.DATABASE.atomic():
+                                self._apply(write)
+                        except Exception:
+                            pass  # (kept in write.error)
+        except Exception as exc:
+            # the commit itself failed, and with it every write
+            for write in batch:
+                write.error = exc
+        finally:
+            self.batches += 1
+            self.writes += len(batch)
+            for write in batch:
+                write.done.set()
+
+
+# Helper Functions
+# ----------------
+def initialize():
+    """(Re)build `QUEUES` from the config (stopping the old writers
+    first), with a queue for each of the database's shards. Like
+    `cache.initialize()` this reads the config when it is called, so call
+    it after `models.initialize()`.
+    """
+    global QUEUES
+    stop()
+    QUEUES = None
+    if config.GROUP_COMMIT:
+        QUEUES = [WriteQueue(config.GROUP_COMMIT_MAX_OPS,
+                             config.GROUP_COMMIT_MAX_WAIT_MS / 1000, shard)
+                  for shard in range(models.shard_count())]
+
+
+def stop():
+    """Let every writer finish what is queued, then stop it"""
+    for write_queue in QUEUES or ():
+        write_queue.stop()
+
+
+def run(fn, *args, **kwargs):
+    """Make a write, `fn(*args, **kwargs)`, on the current shard:
+    directly, or with `config.GROUP_COMMIT` through that shard's write
+    queue. Either way it has committed by the time this returns.
+    """
+    if QUEUES is None:
+        return fn(*args, **kwargs)
+    return QUEUES[models.current_shard()].submit(fn, *args, **kwargs)